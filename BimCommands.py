@@ -508,3 +508,62 @@ class BIM_MoveView:
                 FreeCAD.ActiveDocument.recompute()
                 view.X = x
                 view.Y = y
+
+
+class BIM_IfcUpdate:
+    def GetResources(self):
+        return {
+            "Pixmap": os.path.join(os.path.dirname(__file__), "icons", "IFC.svg"),
+            "MenuText": QT_TRANSLATE_NOOP("BIM_IfcUpdate", "Update from IFC"),
+            "ToolTip": QT_TRANSLATE_NOOP(
+                "BIM_IfcUpdate",
+                "Updates the objects of this document from its linked IFC file",
+            ),
+        }
+
+    def IsActive(self):
+        doc = FreeCAD.ActiveDocument
+        if doc and "IfcFileLink" in doc.Meta:
+            return True
+        else:
+            return False
+
+    def Activated(self):
+        import BimIfcImport
+
+        BimIfcImport.update(FreeCAD.ActiveDocument)
+
+
+class BIM_IfcExportPatch:
+    def GetResources(self):
+        return {
+            "Pixmap": os.path.join(os.path.dirname(__file__), "icons", "IFC.svg"),
+            "MenuText": QT_TRANSLATE_NOOP("BIM_IfcExportPatch", "Export IFC changes"),
+            "ToolTip": QT_TRANSLATE_NOOP(
+                "BIM_IfcExportPatch",
+                "Writes a copy of the linked IFC file where only the objects "
+                "modified in this document are rewritten",
+            ),
+        }
+
+    def IsActive(self):
+        doc = FreeCAD.ActiveDocument
+        if doc and "IfcFileLink" in doc.Meta:
+            return True
+        else:
+            return False
+
+    def Activated(self):
+        from PySide import QtGui
+        import BimIfcExport
+
+        doc = FreeCAD.ActiveDocument
+        filename = QtGui.QFileDialog.getSaveFileName(
+            QtGui.QApplication.activeWindow(),
+            translate("BIM", "Export IFC changes"),
+            None,
+            "IFC files (*.ifc *.ifczip *.gz)",
+        )
+        if filename and filename[0]:
+            objectslist = BimIfcExport.buildExportLists(doc.Objects)[0]
+            BimIfcExport.exportPatch(doc, objectslist, filename[0])
@@ -0,0 +1,235 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+"""
+Converts IFC files to FreeCAD documents without the GUI, using BimIfcImport.
+
+USAGE:
+
+python BimIfcBatch.py [options] file_or_folder [file_or_folder ...]
+
+Each IFC file is imported in its own process, and saved as a .FCStd file
+beside it, or in the output folder if given. A file that fails to import
+doesn't stop the others. The time and peak memory of each conversion are
+printed at the end, and written as json to the report file if given.
+A file that takes longer than the timeout, or crashes its process, is
+reported as failed, and its process is killed.
+
+The processors are divided between the processes: each import runs its
+geometry iterator with the number of processors divided by the number of
+processes, so running fewer processes gives more threads to each import.
+
+The FreeCAD lib folder must be importable, either because this script runs
+with the FreeCAD python, or by giving its path with --freecad.
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import traceback
+import multiprocessing
+import multiprocessing.connection
+
+
+def getFiles(paths):
+    """returns the IFC files found in the given files and folders"""
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(".ifc"):
+                        files.append(os.path.join(root, name))
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            print("Skipping", path + ": file not found")
+    return files
+
+
+def getOutputFile(filename, outdir=None):
+    """returns the FCStd file path of an IFC file"""
+
+    base = os.path.splitext(os.path.basename(filename))[0] + ".FCStd"
+    if outdir:
+        return os.path.join(outdir, base)
+    return os.path.join(os.path.dirname(filename), base)
+
+
+def convert(job):
+    """imports an IFC file and saves it as a FreeCAD document. Runs in
+    its own process, and returns a dict of results"""
+
+    filename, outdir, freecadpath, cores = job
+    if freecadpath and freecadpath not in sys.path:
+        sys.path.append(freecadpath)
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    result = {"file": filename, "output": None, "error": None}
+    starttime = time.time()
+    try:
+        import FreeCAD
+        import BimIfcImport
+
+        name = os.path.splitext(os.path.basename(filename))[0]
+        docname = "".join([c if c.isalnum() else "_" for c in name])
+        doc = BimIfcImport.insert(filename, docname, cores=cores)
+        output = getOutputFile(filename, outdir)
+        doc.saveAs(output)
+        result["output"] = output
+        result["objects"] = len(doc.Objects)
+        result["memory"] = BimIfcImport.getPeakMemory()
+        FreeCAD.closeDocument(doc.Name)
+    except Exception:
+        result["error"] = traceback.format_exc()
+    result["time"] = round(time.time() - starttime, 1)
+    return result
+
+
+def runJob(function, job, connection):
+    """runs a function on a job and sends its result through the given
+    connection. Runs in its own process"""
+
+    connection.send(function(job))
+    connection.close()
+
+
+def getFailure(job, error):
+    """returns the result of a job that didn't return one"""
+
+    return {"file": job[0], "output": None, "time": None, "error": error}
+
+
+def runJobs(jobs, processes, timeout, function=convert, callback=None):
+    """runs the function on each job in its own process, with at most the
+    given number of processes at once, so memory is given back after each
+    job and a crash doesn't take the others along. A job that runs longer
+    than timeout seconds is killed. Returns the results in the order they
+    finished, and gives each of them to the callback function if any"""
+
+    pending = list(jobs)
+    running = {}  # process : [job, connection, start time]
+    results = []
+    while pending or running:
+        while pending and len(running) < processes:
+            job = pending.pop(0)
+            receiver, sender = multiprocessing.Pipe(False)
+            args = (function, job, sender)
+            process = multiprocessing.Process(target=runJob, args=args)
+            process.start()
+            sender.close()  # so the receiver gets EOF if the process dies
+            running[process] = [job, receiver, time.time()]
+        connections = [r[1] for r in running.values()]
+        multiprocessing.connection.wait(connections, 0.5)
+        for process, (job, receiver, start) in list(running.items()):
+            result = None
+            if receiver.poll():
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    process.join()
+                    error = "Crashed with exit code " + str(process.exitcode)
+                    result = getFailure(job, error)
+            elif time.time() - start > timeout:
+                process.kill()
+                result = getFailure(job, "Timed out after " + str(timeout) + "s")
+            if result:
+                process.join()
+                receiver.close()
+                del running[process]
+                results.append(result)
+                if callback:
+                    callback(result)
+    return results
+
+
+def printResult(result, count, total):
+    """prints the result of a conversion"""
+
+    progress = "[" + str(count) + "/" + str(total) + "] "
+    if result["error"]:
+        print(progress + "FAILED", result["file"])
+        print(result["error"])
+    else:
+        stats = str(result["time"]) + "s"
+        if result.get("memory"):
+            stats += ", " + str(result["memory"]) + " Mb"
+        print(progress + "OK", result["file"], "(" + stats + ")")
+
+
+if __name__ == "__main__":
+    "main thread"
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("paths", nargs="+", help="IFC files or folders")
+    parser.add_argument("-o", "--output", help="folder to save the FCStd files")
+    parser.add_argument("-j", "--jobs", type=int, help="number of processes")
+    parser.add_argument("-r", "--report", help="json file to write the results")
+    parser.add_argument(
+        "-t", "--timeout", type=int, default=3600, help="max seconds per file"
+    )
+    parser.add_argument("--freecad", help="path to the FreeCAD lib folder")
+    args = parser.parse_args()
+
+    files = getFiles(args.paths)
+    if not files:
+        print("No IFC file to convert")
+        sys.exit(1)
+    if args.output and not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    processes = args.jobs or multiprocessing.cpu_count()
+    processes = min(processes, len(files))
+    cores = max(1, multiprocessing.cpu_count() // processes)
+    jobs = [(f, args.output, args.freecad, cores) for f in files]
+    starttime = time.time()
+    results = []
+
+    def report(result):
+        results.append(result)
+        printResult(result, len(results), len(jobs))
+
+    runJobs(jobs, processes, args.timeout, callback=report)
+
+    failed = [r for r in results if r["error"]]
+    endtime = round(time.time() - starttime, 1)
+    print(
+        "Converted",
+        len(results) - len(failed),
+        "of",
+        len(jobs),
+        "files in",
+        endtime,
+        "seconds using",
+        processes,
+        "processes of",
+        cores,
+        "cores",
+    )
+    for result in failed:
+        print("Failed:", result["file"])
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"time": endtime, "results": results}, f, indent=2)
+    sys.exit(1 if failed else 0)
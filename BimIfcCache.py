@@ -0,0 +1,237 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+"""Persistent geometry cache for the BIM IFC importer.
+
+Shapes are stored as BREP files in a folder beside the IFC file, one per
+product, keyed on the product's GlobalId plus a hash of everything that
+defines its geometry (representation, placement, openings and material
+layers) and of the geometry settings used to compute it. Entity ids are
+normalized in the hash, so a product that is unchanged in a new version of
+the file, even if renumbered, is found again.
+"""
+
+import os
+import re
+import time
+import json
+import hashlib
+
+
+REFERENCE = re.compile(r"#(\d+)")
+
+
+def getCachePath(filename):
+    """returns the cache folder of the given IFC file"""
+
+    return os.path.splitext(filename)[0] + ".ifccache"
+
+
+def getEntitiesHash(ifcfile, entities, hashes=None):
+    """returns a md5 hash of the given entities and everything they reference.
+    References are replaced by the hash of the referenced entity, so the hash
+    doesn't depend on the numbering of the file. The hashes of the entities
+    are stored in the given {id: hash} dict, so entities shared by many
+    products (contexts, parent placements, materials) are only hashed once"""
+
+    if hashes is None:
+        hashes = {}
+    hasher = hashlib.md5()
+    for entity in entities:
+        if entity:
+            hasher.update(getEntityHash(ifcfile, entity, hashes).encode("utf8"))
+        hasher.update(b";")
+    return hasher.hexdigest()
+
+
+def getEntityHash(ifcfile, entity, hashes):
+    """returns the hash of an entity and everything it references, see
+    getEntitiesHash()"""
+
+    eid = entity.id()
+    if not eid in hashes:
+        hashes[eid] = "?"  # guards against reference cycles
+        line = str(entity).split("=", 1)[-1]
+        renumber = lambda m: "#" + getEntityHash(
+            ifcfile, ifcfile.by_id(int(m.group(1))), hashes
+        )
+        line = REFERENCE.sub(renumber, line)
+        hashes[eid] = hashlib.md5(line.encode("utf8")).hexdigest()
+    return hashes[eid]
+
+
+def getSettingsKey(settings):
+    """returns a string describing the values of the given ifcopenshell
+    geometry settings, and the ifcopenshell version that uses them"""
+
+    import ifcopenshell
+
+    values = [getattr(ifcopenshell, "version", "")]
+    if settings is None:
+        return ";".join(values)
+    if hasattr(settings, "setting_names"):
+        # ifcopenshell 0.8 and later
+        names = settings.setting_names()
+        options = names
+    else:
+        names = sorted([n for n in dir(settings) if n.isupper()])
+        options = [getattr(settings, n) for n in names]
+    for name, option in zip(names, options):
+        try:
+            value = settings.get(option)
+        except Exception:
+            continue  # not a geometry option
+        values.append(name + "=" + str(value))
+    return ";".join(values)
+
+
+def getRepresentationHash(ifcfile, ifcproduct, hashes=None):
+    """returns a hash of the geometry-defining data of an IFC product.
+    hashes is an optional dict of entity hashes, see getEntitiesHash()"""
+
+    entities = [ifcproduct.ObjectPlacement, ifcproduct.Representation]
+    for rel in getattr(ifcproduct, "HasOpenings", []) or []:
+        opening = rel.RelatedOpeningElement
+        entities.extend([opening.ObjectPlacement, opening.Representation])
+    for rel in getattr(ifcproduct, "HasAssociations", []) or []:
+        if rel.is_a("IfcRelAssociatesMaterial"):
+            entities.append(rel.RelatingMaterial)  # layer sets split the geometry
+    return getEntitiesHash(ifcfile, entities, hashes)
+
+
+class ShapeCache:
+
+    """A size-bounded, least-recently-used store of product shapes"""
+
+    def __init__(self, filename, ifcfile, maxsize=500, settings=None):
+        """filename is the IFC file, maxsize the max cache size in Mb and
+        settings the ifcopenshell geometry settings the shapes are made with"""
+
+        self.ifcfile = ifcfile
+        self.path = getCachePath(filename)
+        self.maxsize = maxsize * 1000000
+        self.settings = getSettingsKey(settings)
+        self.index = {}  # key : [size, last access time]
+        self.keys = {}  # ifcid : key
+        self.hashes = {}  # ifcid : representation hash
+        self.entityhashes = {}  # ifcid : entity hash, see getEntitiesHash()
+        self.hits = 0
+        self.misses = 0
+        self.error = None  # set if the cache could not be written
+        indexfile = os.path.join(self.path, "index.json")
+        if os.path.exists(indexfile):
+            try:
+                with open(indexfile) as f:
+                    self.index = json.load(f)
+            except ValueError:
+                self.index = {}
+
+    def getHash(self, ifcproduct):
+        """returns the representation hash of an IFC product, computed once"""
+
+        if not ifcproduct.id() in self.hashes:
+            h = getRepresentationHash(self.ifcfile, ifcproduct, self.entityhashes)
+            self.hashes[ifcproduct.id()] = h
+        return self.hashes[ifcproduct.id()]
+
+    def getKey(self, ifcproduct):
+        """returns the cache key of an IFC product"""
+
+        if not ifcproduct.id() in self.keys:
+            h = self.getHash(ifcproduct)
+            key = ifcproduct.GlobalId + ";" + h + ";" + self.settings
+            self.keys[ifcproduct.id()] = hashlib.md5(key.encode("utf8")).hexdigest()
+        return self.keys[ifcproduct.id()]
+
+    def getFile(self, key):
+        """returns the BREP file path of a key"""
+
+        return os.path.join(self.path, key + ".brp")
+
+    def contains(self, ifcproduct):
+        """returns True if the shape of this product is in the cache"""
+
+        key = self.getKey(ifcproduct)
+        return (key in self.index) and os.path.exists(self.getFile(key))
+
+    def getShape(self, ifcproduct):
+        """returns the cached shape of an IFC product, or None. The shapes
+        not found are counted in misses by the caller, that computes them"""
+
+        key = self.getKey(ifcproduct)
+        if key in self.index:
+            import Part
+
+            shape = Part.Shape()
+            try:
+                shape.importBrep(self.getFile(key))
+            except Exception:
+                pass
+            else:
+                self.index[key][1] = time.time()
+                self.hits += 1
+                return shape
+            del self.index[key]
+        return None
+
+    def putShape(self, ifcproduct, shape):
+        """stores the shape of an IFC product. If the cache cannot be written,
+        the error is kept in self.error and no more shapes are stored"""
+
+        if self.error:
+            return
+        key = self.getKey(ifcproduct)
+        brep = self.getFile(key)
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            shape.exportBrep(brep)
+            size = os.path.getsize(brep)
+        except Exception as e:
+            # read-only folder, full disk...
+            self.error = str(e)
+            return
+        self.index[key] = [size, time.time()]
+
+    def save(self):
+        """evicts the least recently used shapes above the size limit
+        and writes the cache index"""
+
+        if not os.path.isdir(self.path):
+            return
+        size = sum([v[0] for v in self.index.values()])
+        if size > self.maxsize:
+            for key in sorted(self.index, key=lambda k: self.index[k][1]):
+                size -= self.index[key][0]
+                del self.index[key]
+                try:
+                    if os.path.exists(self.getFile(key)):
+                        os.remove(self.getFile(key))
+                except OSError as e:
+                    # read-only or locked folder, the file stays orphaned
+                    self.error = str(e)
+                if size <= self.maxsize:
+                    break
+        try:
+            with open(os.path.join(self.path, "index.json"), "w") as f:
+                json.dump(self.index, f)
+        except OSError as e:
+            self.error = str(e)
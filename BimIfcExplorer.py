@@ -23,10 +23,18 @@
 from __future__ import print_function
 
 import os
+import queue
+import threading
+import collections
 import FreeCAD
 from BimTranslateUtils import *
 
 
+COMPOSEDMESHES = 16  # number of composed selection meshes kept in memory
+VIEWS = 64  # number of entities whose attributes and properties are kept
+LISTROWS = 100  # rows of a list attribute shown at once
+
+
 class BIM_IfcExplorer:
     def __init__(self):
         self.tree = None
@@ -149,8 +157,44 @@ class BIM_IfcExplorer:
         self.meshAction.setIcon(QtGui.QIcon(":/icons/DrawStyleShaded.svg"))
         toolbar.addAction(self.meshAction)
 
+        # search box
+        self.searchBox = QtGui.QLineEdit()
+        self.searchBox.setPlaceholderText(translate("BIM", "Search"))
+        self.searchBox.setToolTip(
+            translate(
+                "BIM",
+                "Search by id, GlobalId, name, class, property name or value. "
+                "Ex: IfcDoor where FireRating=EI60. Press Enter for the next result",
+            )
+        )
+        self.searchBox.setMaximumWidth(240)
+        self.searchBox.returnPressed.connect(self.search)
+        toolbar.addWidget(self.searchBox)
+        self.searchLabel = QtGui.QLabel()
+        toolbar.addWidget(self.searchLabel)
+
+        # progress bar and cancel button for background tasks
+        self.progressbar = QtGui.QProgressBar()
+        self.progressbar.setMaximumWidth(200)
+        self.progressAction = toolbar.addWidget(self.progressbar)
+        self.progressAction.setVisible(False)
+        self.cancelAction = QtGui.QAction(translate("BIM", "Cancel"), None)
+        self.cancelAction.setToolTip(translate("BIM", "Stop the current operation"))
+        self.cancelAction.triggered.connect(self.cancel)
+        self.cancelAction.setIcon(QtGui.QIcon(":/icons/process-stop.svg"))
+        self.cancelAction.setVisible(False)
+        toolbar.addAction(self.cancelAction)
+
+        # background tasks post their results in a queue, read by a timer
+        self.queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.timer = QtCore.QTimer()
+        self.timer.setInterval(100)
+        self.timer.timeout.connect(self.poll)
+
         # connect signals/slots
         self.tree.currentItemChanged.connect(self.onSelectTree)
+        self.tree.itemExpanded.connect(self.onExpandTree)
         self.attributes.itemDoubleClicked.connect(self.onDoubleClickTree)
         self.properties.itemDoubleClicked.connect(self.onDoubleClickTree)
         self.dialog.rejected.connect(self.close)
@@ -199,31 +243,368 @@ class BIM_IfcExplorer:
         )
 
         # clear everything
+        self.cancel()
         self.tree.clear()
         self.attributes.clear()
         self.properties.clear()
-        self.done = []
+        self.done = set()  # ids of the entities already in the tree
+        self.items = {}  # eid : QTreeWidgetItem
         self.backnav = []
-        self.mesh = None
+        self.meshes = []  # one Mesh::Feature per storey
+        self.meshing = False
         self.products = []
         self.omeshes = {}
         self.currentmesh = None
+        self.ifc = None
+        self.descendants = {}  # eid : [descendant product ids]
+        self.index = {}  # search index, see buildSearchIndex()
+        self.results = []  # ids found by the last search
+        self.query = None
+        self.searchLabel.setText("")
+        self.composed = collections.OrderedDict()  # eid : (count, mesh)
+        self.views = collections.OrderedDict()  # eid : (attributes, psets)
+        self.pending = {}  # "more" item : (list item, values, next index)
+        self.setIndexed(False)
+
+        # read the file in the background, the tree is filled by poll()
+        self.progressbar.setRange(0, 0)
+        self.startTask(self.readFile, self.filename)
+
+    def setIndexed(self, indexed):
+        "enables the search and the mesh display, which need the indexes"
+
+        self.searchBox.setEnabled(indexed)
+        self.meshAction.setEnabled(indexed)
+        if indexed:
+            self.searchBox.setPlaceholderText(translate("BIM", "Search"))
+        else:
+            self.searchBox.setPlaceholderText(translate("BIM", "Indexing..."))
+
+    def startTask(self, target, *args):
+        "runs a function in a background thread, with progress and cancel"
+
+        self.cancelled = threading.Event()
+        self.queue = queue.Queue()
+        args = (self.queue, self.cancelled) + args
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self.progressAction.setVisible(True)
+        self.cancelAction.setVisible(True)
+        self.timer.start()
+
+    def cancel(self):
+        "stops the current background task"
+
+        self.cancelled.set()
+        self.timer.stop()
+        self.progressAction.setVisible(False)
+        self.cancelAction.setVisible(False)
+        if self.meshAction.isChecked() and not self.meshes:
+            self.meshAction.setChecked(False)
+            self.meshing = False
+
+    def readFile(self, q, cancelled, filename):
+        """reads an IFC file, then indexes it. The file is posted first, so
+        the tree is shown while the indexes are built. Runs in a background
+        thread"""
+
+        import ifcopenshell
+
+        error = None
+        try:
+            ifc = ifcopenshell.open(filename)
+            if cancelled.is_set():
+                return
+            q.put(("file", ifc))
+            # the tree reads the posted file meanwhile, and IFC files are not
+            # thread-safe, so the indexes are built from a file of their own
+            ifc = ifcopenshell.open(filename)
+            descendants = {}
+            for site in ifc.by_type("IfcSite"):
+                self.buildDescendants(site, descendants)
+            index = self.buildSearchIndex(ifc)
+            if not cancelled.is_set():
+                q.put(("index", descendants, index))
+        except Exception as e:
+            error = str(e)
+        finally:
+            q.put(("done", error))
+
+    def buildSearchIndex(self, ifc):
+        """returns a search index of the products of a file, as a dict:
+        - words: {word : set of ids}, with ids, GlobalIds, names, classes,
+          property names and values, including the ones of the types
+        - classes: {class : set of ids}
+        - values: {id : {attribute or property name : value}}"""
+
+        words = {}
+        classes = {}
+        values = {}
+
+        def addWord(word, eid):
+            word = self.tostr(word).lower()
+            if word:
+                words.setdefault(word, set()).add(eid)
+
+        def addProperties(psets, objects):
+            props = []
+            for pset in psets:
+                for prop in getattr(pset, "HasProperties", None) or []:
+                    value = getattr(prop, "NominalValue", None)
+                    if value is not None:
+                        value = value.wrappedValue
+                    props.append((prop.Name, value))
+            for obj in objects:
+                eid = obj.id()
+                if not eid in values:
+                    continue
+                for name, value in props:
+                    name = self.tostr(name).lower()
+                    addWord(name, eid)
+                    if value is not None:
+                        addWord(value, eid)
+                        values[eid][name] = self.tostr(value).lower()
+                    else:
+                        values[eid].setdefault(name, "")
+
+        for product in ifc.by_type("IfcProduct"):
+            eid = product.id()
+            classes.setdefault(product.is_a(), set()).add(eid)
+            addWord(eid, eid)
+            addWord(product.GlobalId, eid)
+            addWord(product.is_a(), eid)
+            values[eid] = {}
+            for attr in ["Name", "Description", "ObjectType", "Tag"]:
+                value = getattr(product, attr, None)
+                if value:
+                    values[eid][attr.lower()] = self.tostr(value).lower()
+                    addWord(value, eid)
+                    for word in self.tostr(value).split():
+                        addWord(word, eid)
+        # type properties first, so the occurrence ones override them
+        for rel in ifc.by_type("IfcRelDefinesByType"):
+            psets = getattr(rel.RelatingType, "HasPropertySets", None) or []
+            addProperties(psets, rel.RelatedObjects)
+        for rel in ifc.by_type("IfcRelDefinesByProperties"):
+            addProperties([rel.RelatingPropertyDefinition], rel.RelatedObjects)
+        return {"words": words, "classes": classes, "values": values}
+
+    def find(self, query):
+        """returns the sorted ids of the products matching a query, made of
+        words, IFC classes, and optional conditions after "where", separated
+        by "and": ex. IfcDoor where FireRating=EI60 and Name=D01"""
+
+        if not self.index:
+            return []
+        conditions = []
+        # a leading space, so a query can start with the conditions
+        parts = (" " + query).split(" where ", 1)
+        if len(parts) == 1:
+            parts = (" " + query).split(" WHERE ", 1)
+        if len(parts) == 2:
+            for condition in parts[1].split(" and "):
+                if "=" in condition:
+                    name, value = condition.split("=", 1)
+                else:
+                    name, value = condition, None
+                name = name.strip().lower()
+                if value is not None:
+                    value = value.strip().strip("\"'").lower()
+                conditions.append((name, value))
+        result = None
+        for term in parts[0].split():
+            ids = self.findClass(term)
+            if ids is None:
+                term = term.lower()
+                ids = self.index["words"].get(term)
+                if ids is None:
+                    # no exact match, look for words containing the term
+                    ids = set()
+                    for word, wids in self.index["words"].items():
+                        if term in word:
+                            ids |= wids
+            result = ids if result is None else result & ids
+        if result is None:
+            result = set(self.index["values"].keys())
+        for name, value in conditions:
+            values = self.index["values"]
+            if value is None:
+                result = set([i for i in result if name in values[i]])
+            else:
+                result = set([i for i in result if values[i].get(name) == value])
+        return sorted(result)
+
+    def findClass(self, term):
+        """returns the ids of the products of the given IFC class and its
+        subclasses, or None if the term is not a class"""
+
+        if not term.lower().startswith("ifc"):
+            return None
+        result = None
+        for ifcclass, ids in self.index["classes"].items():
+            # one entity of each class tells if it derives from the term
+            try:
+                match = self.ifc[next(iter(ids))].is_a(term)
+            except Exception:
+                return None
+            if match:
+                result = ids if result is None else result | ids
+        return result
+
+    def search(self):
+        "selects the next product matching the text of the search box"
+
+        query = self.searchBox.text().strip()
+        if not query or not self.ifc:
+            return
+        if query != self.query:
+            self.query = query
+            self.results = self.find(query)
+            self.current = -1
+        if not self.results:
+            self.searchLabel.setText(translate("BIM", "No result"))
+            return
+        self.current = (self.current + 1) % len(self.results)
+        text = str(self.current + 1) + "/" + str(len(self.results))
+        item = self.findItem(self.results[self.current])
+        if item:
+            self.tree.scrollToItem(item)
+            self.tree.setCurrentItem(item)
+        else:
+            # not under a site, or its parents can't be loaded
+            text += " " + translate("BIM", "(not in the tree)")
+        self.searchLabel.setText(text)
+
+    def buildDescendants(self, obj, descendants):
+        """fills the descendants dict with the ids of the products found
+        under obj and its children, and returns the list of obj"""
+
+        result = []
+        for child in self.getChildEntities(obj):
+            if child.is_a("IfcProduct"):
+                result.append(child.id())
+                result.extend(self.buildDescendants(child, descendants))
+        if result:
+            descendants[obj.id()] = result
+        return result
+
+    def readMeshes(self, q, cancelled, filename, groups, scaling):
+        """tessellates the given lists of product ids with the multicore
+        geometry iterator, and sends one mesh per group. Runs in a
+        background thread"""
+
+        error = None
+        try:
+            self.sendMeshes(q, cancelled, filename, groups, scaling)
+        except Exception as e:
+            error = str(e)
+        finally:
+            # always posted, or the progress bar would stay up forever
+            q.put(("done", error))
+
+    def sendMeshes(self, q, cancelled, filename, groups, scaling):
+        "sends the meshes for readMeshes, which handles the exceptions"
+
+        import ifcopenshell
+        import Mesh
+        from ifcopenshell import geom
+
+        # the tree reads self.ifc meanwhile, and IFC files are not
+        # thread-safe, so the geometry is read from a file of its own
+        ifc = ifcopenshell.open(filename)
+        settings = geom.settings()
+        settings.set(settings.USE_WORLD_COORDS, True)
+        cores = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Arch").GetInt(
+            "ifcMulticore", 0
+        )
+        cores = cores or os.cpu_count() or 1
+        trf = None
+        if scaling != 1:
+            trf = FreeCAD.Matrix()
+            trf.scale(scaling, scaling, scaling)
+        total = sum([len(group) for group in groups])
+        count = 0
+        for group in groups:
+            groupmesh = Mesh.Mesh()
+            omeshes = {}
+            include = [ifc[eid] for eid in group]
+            iterator = geom.iterator(settings, ifc, cores, include=include)
+            ok = iterator.initialize()
+            while ok and not cancelled.is_set():
+                shape = iterator.get()
+                v = shape.geometry.verts
+                f = shape.geometry.faces
+                # flat buffers to tuples, no FreeCAD.Vector per vertex
+                verts = list(zip(v[0::3], v[1::3], v[2::3]))
+                faces = list(zip(f[0::3], f[1::3], f[2::3]))
+                omesh = Mesh.Mesh((verts, faces))
+                if trf:
+                    omesh.transform(trf)
+                omeshes[shape.id] = omesh
+                groupmesh.addMesh(omesh)
+                count += 1
+                q.put(("progress", count, total))
+                if not iterator.next():
+                    break
+            if cancelled.is_set():
+                break
+            q.put(("meshes", groupmesh, omeshes))
 
-        # read file and order contents
-        self.ifc = ifcopenshell.open(self.filename)
-        root = self.getEntitiesTree()
+    def poll(self):
+        "reads the results posted by the background task"
 
-        # populate tree contents
-        for eid, children in root.items():
-            self.addEntity(eid, children, self.tree)
-        # self.tree.expandAll()
+        import FreeCADGui
+
+        while True:
+            try:
+                message = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "file":
+                self.ifc = message[1]
+                for site in self.ifc.by_type("IfcSite"):
+                    self.addEntity(site.id(), self.tree)
+            elif message[0] == "index":
+                self.descendants = message[1]
+                self.index = message[2]
+                self.setIndexed(True)
+            elif message[0] == "progress":
+                self.progressbar.setRange(0, message[2])
+                self.progressbar.setValue(message[1])
+            elif message[0] == "meshes":
+                self.omeshes.update(message[2])
+                if not FreeCAD.ActiveDocument:
+                    continue
+                # one object per storey, so the meshes already shown are
+                # not copied again each time a storey arrives
+                mesh = FreeCAD.ActiveDocument.addObject("Mesh::Feature", "IFCMesh")
+                mesh.Mesh = message[1]
+                mesh.ViewObject.Transparency = 85
+                mesh.ViewObject.Visibility = self.meshAction.isChecked()
+                self.meshes.append(mesh)
+                FreeCAD.ActiveDocument.recompute()
+                if len(self.meshes) == 1:
+                    FreeCADGui.Selection.clearSelection()
+                    FreeCADGui.Selection.addSelection(mesh)
+                    FreeCADGui.SendMsgToActiveView("ViewSelection")
+            elif message[0] == "done":
+                if message[1]:
+                    FreeCAD.Console.PrintError(message[1] + "\n")
+                    if self.meshAction.isChecked() and not self.meshes:
+                        self.meshAction.setChecked(False)
+                        self.meshing = False
+                self.timer.stop()
+                self.progressAction.setVisible(False)
+                self.cancelAction.setVisible(False)
+                break
 
     def close(self):
         "close the dialog"
 
         if FreeCAD.ActiveDocument:
-            if self.mesh:
-                FreeCAD.ActiveDocument.removeObject(self.mesh.Name)
+            for mesh in self.meshes:
+                FreeCAD.ActiveDocument.removeObject(mesh.Name)
             if self.currentmesh:
                 FreeCAD.ActiveDocument.removeObject(self.currentmesh.Name)
 
@@ -257,19 +638,18 @@ class BIM_IfcExplorer:
     def toggleMesh(self, checked=False):
         "turns mesh display on/off"
 
-        import FreeCADGui
-        import Mesh
-        import ifcopenshell
-        from ifcopenshell import geom
-
+        if not self.ifc:
+            self.meshAction.setChecked(False)
+            return
         if not FreeCAD.ActiveDocument:
             doc = FreeCAD.newDocument()
             FreeCAD.setActiveDocument(doc.Name)
         if FreeCAD.ActiveDocument:
             if checked:
-                if self.mesh:
-                    self.mesh.ViewObject.show()
-                else:
+                if self.meshes:
+                    for mesh in self.meshes:
+                        mesh.ViewObject.show()
+                elif not self.meshing:
                     try:
                         import importIFCHelper
 
@@ -279,105 +659,88 @@ class BIM_IfcExplorer:
 
                         s = importIFC.getScaling(self.ifc)
                     s *= 1000  # ifcopenshell outputs its meshes in metres
-                    trf = None
-                    if s != 1:
-                        trf = FreeCAD.Matrix()
-                        trf.scale(s, s, s)
-                    basemesh = Mesh.Mesh()
-                    s = geom.settings()
-                    s.set(s.USE_WORLD_COORDS, True)
-                    for product in self.products:
-                        try:
-                            m = geom.create_shape(s, product)
-                            g = m.geometry
-                            v = g.verts
-                            f = g.faces
-                            verts = [
-                                FreeCAD.Vector(v[i : i + 3])
-                                for i in range(0, len(v), 3)
-                            ]
-                            faces = [tuple(f[i : i + 3]) for i in range(0, len(f), 3)]
-                            omesh = Mesh.Mesh((verts, faces))
-                            if trf:
-                                omesh.transform(trf)
-                            self.omeshes[product.id()] = omesh
-                            basemesh.addMesh(omesh)
-                        except:
-                            pass
-                    self.mesh = FreeCAD.ActiveDocument.addObject(
-                        "Mesh::Feature", "IFCMesh"
-                    )
-                    self.mesh.Mesh = basemesh
-                    self.mesh.ViewObject.Transparency = 85
-                    FreeCAD.ActiveDocument.recompute()
-                    FreeCADGui.Selection.clearSelection()
-                    FreeCADGui.Selection.addSelection(self.mesh)
-                    FreeCADGui.SendMsgToActiveView("ViewSelection")
+                    groups = [[p.id() for p in g] for g in self.getStoreyGroups()]
+                    self.meshing = True
+                    self.progressbar.setRange(0, 0)
+                    self.startTask(self.readMeshes, self.filename, groups, s)
             else:
-                if self.mesh:
-                    self.mesh.ViewObject.hide()
+                for mesh in self.meshes:
+                    mesh.ViewObject.hide()
                 if self.currentmesh:
                     self.currentmesh.ViewObject.hide()
 
-    def getEntitiesTree(self):
-        "stacks the entities inside containers"
+    def getStoreyGroups(self):
+        """returns the products of the file as lists, one per storey,
+        followed by the products outside storeys"""
+
+        if not self.products:
+            self.products = self.getProducts()
+        groups = []
+        done = set()
+        for storey in self.ifc.by_type("IfcBuildingStorey"):
+            group = [storey]
+            for eid in self.descendants.get(storey.id(), []):
+                group.append(self.ifc[eid])
+            groups.append(group)
+            done.update([p.id() for p in group])
+        others = [p for p in self.products if not p.id() in done]
+        if others:
+            groups.append(others)
+        return groups
+
+    def getProducts(self):
+        "returns the products found under the sites of the file"
+
+        products = []
+        for site in self.ifc.by_type("IfcSite"):
+            products.append(site)
+            for eid in self.descendants.get(site.id(), []):
+                products.append(self.ifc[eid])
+        return products
 
-        root = {}
+    def getChildEntities(self, obj):
+        "returns the direct children of this obj"
 
-        for site in self.ifc.by_type("IfcSite"):
-            root[site.id()] = self.getChildren(site)
-
-        return root
-
-        # entities =  ifc.by_type("IfcRoot")
-        # entities += ifc.by_type("IfcRepresentation")
-        # entities += ifc.by_type("IfcRepresentationItem")
-        # entities += ifc.by_type("IfcRepresentationMap")
-        # entities += ifc.by_type("IfcPlacement")
-        # entities += ifc.by_type("IfcProperty")
-        # entities += ifc.by_type("IfcPhysicalSimpleQuantity")
-        # entities += ifc.by_type("IfcMaterial")
-        # entities += ifc.by_type("IfcProductRepresentation")
-        # entities = sorted(entities, key=lambda eid: eid.id())
-
-    def getChildren(self, obj, keys=False):
-        "returns a recursive dict of the children of this obj"
-
-        children = {}
-        if obj.is_a("IfcProduct"):
-            self.products.append(obj)
+        children = []
         if hasattr(obj, "IsDecomposedBy"):  # building structure
             for rel in obj.IsDecomposedBy:
                 if hasattr(rel, "RelatedObjects"):
-                    for child in rel.RelatedObjects:
-                        children[child.id()] = self.getChildren(child)
+                    children.extend(rel.RelatedObjects)
         if hasattr(obj, "ContainsElements"):  # objects inside building structure
             for rel in obj.ContainsElements:
                 if hasattr(rel, "RelatedElements"):
-                    for child in rel.RelatedElements:
-                        children[child.id()] = self.getChildren(child)
+                    children.extend(rel.RelatedElements)
         if hasattr(obj, "Representation"):  # Shape representation
             if obj.Representation:
-                children[obj.Representation.id()] = self.getChildren(obj.Representation)
+                children.append(obj.Representation)
         if hasattr(obj, "Representations"):
-            for rep in obj.Representations:
-                children[rep.id()] = self.getChildren(rep)
+            children.extend(obj.Representations)
         if obj.is_a("IfcShapeRepresentation"):
-            for it in obj.Items:
-                children[it.id()] = self.getChildren(it)
-        if keys:
-
-            def getkeys(d):
-                ck = list(d.keys())
-                for v in d.values():
-                    ck.extend(getkeys(v))
-                return ck
-
-            return getkeys(children)
+            children.extend(obj.Items)
         return children
 
-    def addEntity(self, eid, children, parent):
-        "adds a given entity and its children to the given tree item"
+    def getParentEntity(self, obj):
+        "returns the entity under which this obj appears in the tree, or None"
+
+        for rel in getattr(obj, "Decomposes", None) or []:
+            return rel.RelatingObject
+        for rel in getattr(obj, "ContainedInStructure", None) or []:
+            return rel.RelatingStructure
+        if obj.is_a("IfcProductRepresentation"):
+            for product in getattr(obj, "ShapeOfProduct", None) or []:
+                return product
+        if obj.is_a("IfcRepresentation"):
+            for rep in getattr(obj, "OfProductRepresentation", None) or []:
+                return rep
+        if obj.is_a("IfcRepresentationItem"):
+            for parent in self.ifc.get_inverse(obj):
+                if parent.is_a("IfcShapeRepresentation"):
+                    return parent
+        return None
+
+    def addEntity(self, eid, parent):
+        """adds a given entity to the given tree item. Its children
+        are added when the item is expanded"""
 
         from PySide import QtCore, QtGui
 
@@ -395,8 +758,6 @@ class BIM_IfcExplorer:
             if entity.is_a("IfcProduct"):
                 name = get_name(entity)
                 item.setFont(0, self.bold)
-                if isinstance(parent, QtGui.QTreeWidgetItem):
-                    parent.setExpanded(True)
             item.setText(
                 0, "#" + self.tostr(eid) + " : " + self.tostr(entity.is_a()) + name
             )
@@ -450,117 +811,173 @@ class BIM_IfcExplorer:
                 item.setIcon(0, QtGui.QIcon(":icons/Arch_Component.svg"))
             self.tree.setFirstItemColumnSpanned(item, True)
             item.setData(0, QtCore.Qt.UserRole, eid)
-            for childid, grandchildren in children.items():
-                self.addEntity(childid, grandchildren, item)
-            self.done.append(eid)
+            item.setChildIndicatorPolicy(QtGui.QTreeWidgetItem.ShowIndicator)
+            self.done.add(eid)
+            self.items[eid] = item
+            if entity.is_a() in ["IfcSite", "IfcBuilding"]:
+                item.setExpanded(True)
 
-    def addAttributes(self, eid, parent):
-        "adds the attributes of the given IFC entity under the given QTreeWidgetITem"
+    def onExpandTree(self, item):
+        "adds the children of a tree item the first time it is expanded"
 
-        import ifcopenshell
         from PySide import QtCore, QtGui
 
+        if item.data(0, QtCore.Qt.UserRole + 1):
+            return
+        item.setData(0, QtCore.Qt.UserRole + 1, True)
+        entity = self.ifc[item.data(0, QtCore.Qt.UserRole)]
+        for child in self.getChildEntities(entity):
+            self.addEntity(child.id(), item)
+        if not item.childCount():
+            item.setChildIndicatorPolicy(
+                QtGui.QTreeWidgetItem.DontShowIndicatorWhenChildless
+            )
+
+    def findItem(self, eid):
+        "returns the tree item of an entity, loading its parents if needed"
+
+        path = []
         entity = self.ifc[eid]
+        while entity is not None and not entity.id() in self.items:
+            path.append(entity)
+            entity = self.getParentEntity(entity)
+        if entity is None:
+            return None
+        for entity in [entity] + path[::-1]:
+            if not entity.id() in self.items:
+                return None
+            self.items[entity.id()].setExpanded(True)
+        return self.items[eid]
+
+    def getView(self, eid):
+        """returns the attributes and property sets views of an entity,
+        from the cache of the last viewed entities if possible"""
+
+        if eid in self.views:
+            self.views.move_to_end(eid)
+            return self.views[eid]
+        view = (self.getAttributesView(eid), self.getPropertiesView(eid))
+        self.views[eid] = view
+        while len(self.views) > VIEWS:
+            self.views.popitem(last=False)
+        return view
+
+    def formatValue(self, value):
+        "returns the text of an attribute value, and True if it is a link"
+
+        import ifcopenshell
 
+        if isinstance(value, ifcopenshell.entity_instance):
+            if value.id() == 0:
+                return self.tostr(value), False
+            return "#" + self.tostr(value.id()) + ": " + self.tostr(value.is_a()), True
+        return self.tostr(value), False
+
+    def getAttributesView(self, eid):
+        """returns the attributes of an entity as a list of (name, text,
+        link, values) tuples. Lists are kept in values, unformatted"""
+
+        rows = []
+        entity = self.ifc[eid]
         i = 0
         while True:
             try:
                 argname = entity.attribute_name(i)
             except RuntimeError:
                 break
-            else:
-                try:
-                    argvalue = getattr(entity, argname)
-                except AttributeError:
-                    FreeCAD.Console.PrintError(
-                        translate("BIM", "Error in entity")
-                        + " "
-                        + self.tostr(entity)
-                        + "\n"
-                    )
-                    break
+            try:
+                argvalue = getattr(entity, argname)
+            except AttributeError:
+                msg = translate("BIM", "Error in entity") + " " + self.tostr(entity)
+                FreeCAD.Console.PrintError(msg + "\n")
+                break
+            if argname not in ["Id", "GlobalId"]:
+                if isinstance(argvalue, (list, tuple)):
+                    rows.append((self.tostr(argname), "", False, argvalue))
                 else:
-                    if argname not in ["Id", "GlobalId"]:
-                        colored = False
-                        if isinstance(argvalue, ifcopenshell.entity_instance):
-                            if argvalue.id() == 0:
-                                t = self.tostr(argvalue)
-                            else:
-                                colored = True
-                                t = (
-                                    "#"
-                                    + self.tostr(argvalue.id())
-                                    + ": "
-                                    + self.tostr(argvalue.is_a())
-                                )
-                        elif isinstance(argvalue, (list, tuple)):
-                            t = ""
-                        else:
-                            t = self.tostr(argvalue)
-                        item = QtGui.QTreeWidgetItem(parent)
-                        item.setText(0, self.tostr(argname))
-                        if t and (t != "None"):
-                            item.setText(1, t)
-                            if colored:
-                                item.setForeground(1, self.linkbrush)
-                                item.setFont(1, self.linkfont)
-                            if argname == "Name":
-                                item.setFont(1, self.bold)
-                        if isinstance(argvalue, (list, tuple)):
-                            j = 0
-                            for argitem in argvalue:
-                                colored = False
-                                if isinstance(argitem, ifcopenshell.entity_instance):
-                                    if argitem.id() == 0:
-                                        t = self.tostr(argitem)
-                                    else:
-                                        colored = True
-                                        t = (
-                                            "#"
-                                            + self.tostr(argitem.id())
-                                            + ": "
-                                            + self.tostr(argitem.is_a())
-                                        )
-                                else:
-                                    t = argitem
-                                t = self.tostr(t)
-                                if j == 0:
-                                    item.setText(1, t)
-                                    if colored:
-                                        item.setForeground(1, self.linkbrush)
-                                        item.setFont(1, self.linkfont)
-                                else:
-                                    subitem = QtGui.QTreeWidgetItem(item)
-                                    subitem.setText(1, t)
-                                    if colored:
-                                        subitem.setForeground(1, self.linkbrush)
-                                        subitem.setFont(1, self.linkfont)
-                                j += 1
-                i += 1
+                    t, colored = self.formatValue(argvalue)
+                    rows.append((self.tostr(argname), t, colored, None))
+            i += 1
+        return rows
 
-    def addProperties(self, eid, parent):
-        "adds properties of a given entity to the given QTReeWidgetItem"
-
-        from PySide import QtCore, QtGui
+    def getPropertiesView(self, eid):
+        """returns the property sets of an entity as a list of (name,
+        [property attributes]) tuples, see getAttributesView()"""
 
+        psets = []
         entity = self.ifc[eid]
         if hasattr(entity, "IsDefinedBy"):
             for rel in entity.IsDefinedBy:
                 if hasattr(rel, "RelatingPropertyDefinition"):
-                    if rel.RelatingPropertyDefinition:
-                        item = QtGui.QTreeWidgetItem(parent)
-                        item.setText(
-                            0,
-                            "PropertySet: "
-                            + self.tostr(rel.RelatingPropertyDefinition.Name),
-                        )
-                        item.setFont(0, self.bold)
-                        self.properties.setFirstItemColumnSpanned(item, True)
-                        if hasattr(rel.RelatingPropertyDefinition, "HasProperties"):
-                            for prop in rel.RelatingPropertyDefinition.HasProperties:
-                                subitem = QtGui.QTreeWidgetItem(item)
-                                subitem.setText(0, "Property")
-                                self.addAttributes(prop.id(), subitem)
+                    pset = rel.RelatingPropertyDefinition
+                    if pset:
+                        props = getattr(pset, "HasProperties", None) or []
+                        props = [self.getAttributesView(p.id()) for p in props]
+                        psets.append((self.tostr(pset.Name), props))
+        return psets
+
+    def addAttributes(self, eid, parent):
+        "adds the attributes of the given IFC entity under the given QTreeWidgetITem"
+
+        self.addRows(self.getView(eid)[0], parent)
+
+    def addRows(self, rows, parent):
+        "adds attribute rows made by getAttributesView() under a tree item"
+
+        from PySide import QtCore, QtGui
+
+        for argname, t, colored, values in rows:
+            item = QtGui.QTreeWidgetItem(parent)
+            item.setText(0, argname)
+            if values is not None:
+                self.addListItems(item, values, 0)
+            elif t and (t != "None"):
+                item.setText(1, t)
+                if colored:
+                    item.setForeground(1, self.linkbrush)
+                    item.setFont(1, self.linkfont)
+                if argname == "Name":
+                    item.setFont(1, self.bold)
+
+    def addListItems(self, item, values, start):
+        """adds the values of a list attribute to a tree item, by chunks of
+        LISTROWS. The first value goes in the item itself. A last item
+        gives access to the remaining values on double-click"""
+
+        from PySide import QtCore, QtGui
+
+        end = min(start + LISTROWS, len(values))
+        for j in range(start, end):
+            t, colored = self.formatValue(values[j])
+            if j == 0:
+                subitem = item
+            else:
+                subitem = QtGui.QTreeWidgetItem(item)
+            subitem.setText(1, t)
+            if colored:
+                subitem.setForeground(1, self.linkbrush)
+                subitem.setFont(1, self.linkfont)
+        if end < len(values):
+            more = QtGui.QTreeWidgetItem(item)
+            more.setText(
+                1, "... " + str(len(values) - end) + " " + translate("BIM", "more")
+            )
+            self.pending[more] = (item, values, end)
+
+    def addProperties(self, eid, parent):
+        "adds properties of a given entity to the given QTReeWidgetItem"
+
+        from PySide import QtCore, QtGui
+
+        for name, props in self.getView(eid)[1]:
+            item = QtGui.QTreeWidgetItem(parent)
+            item.setText(0, "PropertySet: " + name)
+            item.setFont(0, self.bold)
+            self.properties.setFirstItemColumnSpanned(item, True)
+            for rows in props:
+                subitem = QtGui.QTreeWidgetItem(item)
+                subitem.setText(0, "Property")
+                self.addRows(rows, subitem)
 
     def tostr(self, text):
         "resolves py2/py3 string representation hassles"
@@ -585,6 +1002,7 @@ class BIM_IfcExplorer:
 
         self.backnav.append(previous)
         eid = item.data(0, QtCore.Qt.UserRole)
+        self.pending = {}
         self.attributes.clear()
         self.addAttributes(eid, self.attributes)
         self.attributes.expandAll()
@@ -596,18 +1014,7 @@ class BIM_IfcExplorer:
             self.shapeAction.setEnabled(True)
         else:
             self.shapeAction.setEnabled(False)
-        if eid in self.omeshes:
-            omesh = self.omeshes[eid]
-        else:
-            omesh = None
-        children = self.getChildren(entity, keys=True)
-        for k in children:
-            if k in self.omeshes:
-                kmesh = self.omeshes[k]
-                if omesh:
-                    omesh.addMesh(kmesh)
-                else:
-                    omesh = kmesh
+        omesh = self.getComposedMesh(eid)
         if omesh:
             if not self.currentmesh:
                 self.currentmesh = FreeCAD.ActiveDocument.addObject(
@@ -621,20 +1028,50 @@ class BIM_IfcExplorer:
             if self.currentmesh:
                 self.currentmesh.ViewObject.hide()
 
+    def getComposedMesh(self, eid):
+        """returns a mesh of an entity and its descendants, or None. The
+        per-product meshes are never modified, and the last composed
+        meshes are kept"""
+
+        import Mesh
+
+        meshes = []
+        for k in [eid] + self.descendants.get(eid, []):
+            if k in self.omeshes:
+                meshes.append(self.omeshes[k])
+        if len(meshes) < 2:
+            return meshes[0] if meshes else None
+        # meshes may still be loading, so the count is part of the key
+        if eid in self.composed and self.composed[eid][0] == len(meshes):
+            self.composed.move_to_end(eid)
+            return self.composed[eid][1]
+        omesh = Mesh.Mesh()
+        for m in meshes:
+            omesh.addMesh(m)
+        self.composed[eid] = (len(meshes), omesh)
+        self.composed.move_to_end(eid)
+        while len(self.composed) > COMPOSEDMESHES:
+            self.composed.popitem(last=False)
+        return omesh
+
     def onDoubleClickTree(self, item, column):
         "when a property or attribute is double-clicked"
 
         from PySide import QtCore, QtGui
 
+        if item in self.pending:
+            listitem, values, start = self.pending.pop(item)
+            listitem.removeChild(item)
+            self.addListItems(listitem, values, start)
+            return
         if self.tree:
             txt = item.text(column)
             if txt.startswith("#"):
-                eid = txt[1:].split(":")[0]
-                target = self.tree.findItems(
-                    "#" + eid + " :",
-                    QtCore.Qt.MatchStartsWith | QtCore.Qt.MatchRecursive,
-                    0,
-                )
+                try:
+                    eid = int(txt[1:].split(":")[0])
+                except ValueError:
+                    return
+                target = self.findItem(eid)
                 if target:
-                    self.tree.scrollToItem(target[0])
-                    self.tree.setCurrentItem(target[0])
+                    self.tree.scrollToItem(target)
+                    self.tree.setCurrentItem(target)
@@ -24,11 +24,14 @@
 
 import os
 import time
+import gzip
+import zipfile
 import tempfile
 import math
 
 import FreeCAD
 import exportIFCHelper
+import BimIfcRecycler
 import Draft
 import Arch
 
@@ -65,31 +68,95 @@ END-ISO-10303-21;
 # temp constants (to be turned into FreeCAD parameters later)
 SCHEMA = "IFC4"
 FULL_PARAMETRIC = False
+PATCH = False  # if linked to an IFC file, write a patched copy of it instead
+TESSELLATION = 0.5  # max deviation of exported faceted geometry, in mm
+STREAMING = False  # write the file by storeys, to save memory
+CHUNKSIZE = 1000  # max number of objects written at once when streaming
+COMPRESSION = None  # None, "gzip" or "ifczip". Also set by the file extension
+
+# types exported as annotations, and types not exported
+ANNOTATIONTYPES = [
+    "DraftText",
+    "Text",
+    "Dimension",
+    "LinearDimension",
+    "AngularDimension",
+]
+EXCLUDETYPES = [
+    "Dimension",
+    "Material",
+    "MaterialContainer",
+    "WorkingPlaneProxy",
+    "Project",
+]
+
+categories = {}  # (docname, objname) : (token, category), see getCategory()
 
 
 def export(exportList, filename):
     """Exports the given list of objects to the given filename"""
 
-    import ifcopenshell
+    import importIFCHelper
 
-    ifcfile = buildTemplate(FreeCAD.ActiveDocument, filename)
     objectslist, annotations = buildExportLists(exportList)
-    history, context, objectslist = setupProject(ifcfile, objectslist)
-
-    # run the recycler on the existing file
-    ifcbin = exportIFCHelper.recycler(ifcfile)  # TODO replace with own
-
-    for obj in objectslist:
-        writeObject(obj, ifcbin)
-        writeProperties(obj, ifcbin)
-    ifcfile.write(filename)
+    if PATCH and getLinkedFile(FreeCAD.ActiveDocument):
+        exportPatch(FreeCAD.ActiveDocument, objectslist, filename)
+        return
+    ifcfile = buildTemplate(FreeCAD.ActiveDocument, filename)
+    history, context, objectslist = setupProject(objectslist, ifcfile)
+    scaling = importIFCHelper.getScaling(ifcfile)
+    colors = getColorDict(FreeCAD.ActiveDocument)
+    writer = None
+    chunks = [objectslist]
+    if STREAMING:
+        writer = StreamWriter(ifcfile, filename)
+        chunks = getChunks(objectslist)
+
+    for chunk in chunks:
+        # triangulate the shapes of a chunk at once, so it can be done in parallel
+        jobs = []  # (objname, shape, placement)
+        for obj in chunk:
+            # the shape of containers is made of their children
+            if hasattr(obj, "Shape") and obj.Shape.Faces:
+                if not getattr(obj, "Group", None):
+                    jobs.append((obj.Name, obj.Shape, obj.Placement))
+        shapes = getShapesData(jobs, scaling)
+
+        target, chunkhistory, chunkcontext = ifcfile, history, context
+        if writer:
+            target, chunkhistory, chunkcontext = writer.start(history, context)
+
+        # run the recycler on the existing file
+        ifcbin = BimIfcRecycler.Recycler(target, seed=True)
+
+        for obj in chunk:
+            data = shapes.get(obj.Name)
+            product = writeObject(
+                obj, ifcbin, data, chunkhistory, chunkcontext, scaling
+            )
+            if data:
+                writeStyle(ifcbin, product, getColor(obj, colors))
+            writeProperties(obj, ifcbin)
+        if writer:
+            writer.flush()
+    if writer:
+        writer.close()
+    else:
+        with openOutput(filename) as f:
+            f.write(getFileText(ifcfile).encode("utf8"))
 
 
 def buildTemplate(doc, filename):
     """builds a template IFC file for the given document"""
 
+    import ifcopenshell
+
     if doc.getObject("IfcFileData"):
-        ifcfile = getIfcDocument(doc.getObject("IfcFileData").Text)
+        fobj = doc.getObject("IfcFileData")
+        if hasattr(fobj, "IfcFile"):
+            ifcfile = ifcopenshell.open(fobj.IfcFile)
+        else:
+            ifcfile = getIfcDocument(fobj.Text)
     elif "IfcFileLink" in doc.Meta:
         filedata = doc.Meta["IfcFileLink"].split(";;")
         filename = filedata[0].replace("file://", "")
@@ -129,7 +196,12 @@ def buildTemplate(doc, filename):
 def getIfcDocument(text):
     """returns an IFC file object from IFC text"""
 
-    tmp = tempfile.NamedTemporaryFile()
+    import ifcopenshell
+
+    if hasattr(ifcopenshell.file, "from_string"):
+        return ifcopenshell.file.from_string(text)
+    # older versions of IfcOpenShell can only open files
+    tmp = tempfile.NamedTemporaryFile(suffix=".ifc")
     with open(tmp.name, "w") as f:
         f.write(text)
     ifcfile = ifcopenshell.open(tmp.name)
@@ -151,24 +223,13 @@ def setupProject(objectslist, ifcfile):
 
     history = ifcfile.by_type("IfcOwnerHistory")[0]
     cc = exportIFCHelper.ContextCreator(ifcfile, objectslist)
-    context = contextCreator.model_view_subcontext
-    project = contextCreator.project
+    context = cc.model_view_subcontext
     objectslist = [obj for obj in objectslist if obj != cc.project_object]
-    setDeclination(objectslist, cc)
+    setDeclinations(objectslist, cc)
     return history, context, objectslist
     # include project?
 
 
-def getIfcDocument(text):
-    """returns an IFC file object from IFC text"""
-
-    tmp = tempfile.NamedTemporaryFile()
-    with open(tmp.name, "w") as f:
-        f.write(text)
-    ifcfile = ifcopenshell.open(tmp.name)
-    return ifcfile
-
-
 def setUnits(ifcfile):
     """sets the units of the IFC file (meters or feet)"""
 
@@ -184,70 +245,669 @@ def setUnits(ifcfile):
 def buildExportLists(exportList):
     """builds a complete list of objects to export"""
 
-    texttypes = [
-        "DraftText",
-        "Text",
-        "Dimension",
-        "LinearDimension",
-        "AngularDimension",
-    ]
-    exlist = [
-        "Dimension",
-        "Material",
-        "MaterialContainer",
-        "WorkingPlaneProxy",
-        "Project",
-    ]
     objectslist = Draft.get_group_contents(exportList, walls=True, addgroups=True)
     annotations = []
+    objects = []
+    excluded = set()
+    keys = set()
     for obj in objectslist:
-        if obj.isDerivedFrom("Part::Part2DObject"):
+        keys.add((obj.Document.Name, obj.Name))
+        category = getCategory(obj)
+        if category == "annotation":
             annotations.append(obj)
-        elif obj.isDerivedFrom("App::Annotation"):
-            annotations.append(obj)
-        elif Draft.getType(obj) in texttypes:
-            annotations.append(obj)
-        elif obj.isDerivedFrom("Part::Feature"):
-            if obj.Shape and (not obj.Shape.Solids) and obj.Shape.Edges:
-                if not obj.Shape.Faces:
-                    annotations.append(obj)
-                elif obj.Shape.BoundBox.XLength < 0.0001:
-                    annotations.append(obj)
-                elif obj.Shape.BoundBox.YLength < 0.0001:
-                    annotations.append(obj)
-                elif obj.Shape.BoundBox.ZLength < 0.0001:
-                    annotations.append(obj)
-    objectslist = [obj for obj in objectslist if obj not in annotations]
-    objectslist = Arch.pruneIncluded(objectslist, strict=True)
-    objectslist = [obj for obj in objectslist if Draft.getType(obj) not in exlist]
+        else:
+            objects.append(obj)
+            if category == "excluded":
+                excluded.add(obj.Name)
+    # only the objects of the last export are kept in the cache
+    for key in list(categories):
+        if not key in keys:
+            del categories[key]
+    objectslist = Arch.pruneIncluded(objects, strict=True)
+    objectslist = [obj for obj in objectslist if not obj.Name in excluded]
     if FULL_PARAMETRIC:
         objectslist = Arch.getAllChildren(objectslist)
     return objectslist, annotations
 
 
-def writeObject(obj, ifcbin):
-    """writes a FreeCAD object to the given IFC file"""
+def getCategory(obj):
+    """returns the export category of an object, "annotation", "excluded"
+    or "object". The result is cached until the shape or type changes"""
+
+    dtype = Draft.getType(obj)
+    shape = getattr(obj, "Shape", None)
+    token = (dtype, shape.hashCode() if shape else None)
+    key = (obj.Document.Name, obj.Name)
+    cached = categories.get(key)
+    if cached and cached[0] == token:
+        return cached[1]
+    category = "object"
+    if dtype in EXCLUDETYPES:
+        category = "excluded"
+    if obj.isDerivedFrom("Part::Part2DObject"):
+        category = "annotation"
+    elif obj.isDerivedFrom("App::Annotation"):
+        category = "annotation"
+    elif dtype in ANNOTATIONTYPES:
+        category = "annotation"
+    elif obj.isDerivedFrom("Part::Feature"):
+        if shape and (not shape.Solids) and shape.Edges:
+            if not shape.Faces:
+                category = "annotation"
+            else:
+                bb = shape.BoundBox
+                if min(bb.XLength, bb.YLength, bb.ZLength) < 0.0001:
+                    category = "annotation"
+    categories[key] = (token, category)
+    return category
+
+
+def getLinkedFile(doc):
+    """returns the path of the IFC file linked to a document, or None"""
+
+    if "IfcFileLink" in doc.Meta:
+        filedata = doc.Meta["IfcFileLink"].split(";;")
+        filename = filedata[0].replace("file://", "")
+        if os.path.exists(filename):
+            return filename
+    return None
 
-    # to integrate
-    if preferences["EXPORT_MODEL"] in ["struct", "hybrid"]:
-        structobj = exportIFCStructuralTools.createStructuralMember(
-            ifcfile, ifcbin, obj
+
+def exportPatch(doc, objectslist, filename):
+    """writes a copy of the IFC file linked to the document, where only
+    the entities of modified or new objects are written anew. All the
+    other entities are copied byte for byte from the linked file. Used by
+    the BIM_IfcExportPatch command, or by export() if PATCH is set"""
+
+    import ifcopenshell
+    import importIFCHelper
+
+    starttime = time.time()
+    source = getLinkedFile(doc)
+    if not source:
+        msg = "The IFC file linked to this document was not found\n"
+        FreeCAD.Console.PrintError(msg)
+        return
+    if os.path.abspath(filename) == os.path.abspath(source):
+        # the source is read while the copy is written
+        FreeCAD.Console.PrintError("Cannot patch the linked IFC file itself\n")
+        return
+    ifcfile = ifcopenshell.open(source)
+    scaling = importIFCHelper.getScaling(ifcfile)
+
+    # find what to write, and which shapes must be triangulated
+    targets = []  # (obj, product, modifications, placement)
+    jobs = []  # (objname, shape, placement)
+    for obj in objectslist:
+        product = None
+        if getattr(obj, "GlobalId", None) and getattr(obj, "IfcID", None):
+            try:
+                product = ifcfile.by_guid(obj.GlobalId)
+            except RuntimeError:
+                product = None
+        if product:
+            mods = getModifications(obj, product)
+            placement = getWorldPlacement(obj, product, scaling, mods[2])
+            geom = mods[1] and hasattr(obj, "Shape") and obj.Shape.Faces
+            # the shape of containers is made of their children
+            if geom and not getattr(obj, "Group", None):
+                jobs.append((obj.Name, obj.Shape, placement))
+            targets.append((obj, product, mods, placement))
+        elif hasattr(obj, "Shape") and obj.Shape.Faces:
+            jobs.append((obj.Name, obj.Shape, obj.Placement))
+            targets.append((obj, None, None, obj.Placement))
+    shapes = getShapesData(jobs, scaling)
+
+    # write entities in the order of the objects, so ids are stable
+    changed = {}  # ifcid : modified entity
+    ifcbin = BimIfcRecycler.Recycler(ifcfile)
+    # only the entities used by the patched products can be reused
+    ifcbin.seed([product for obj, product, mods, pl in targets if product])
+    colors = getColorDict(doc)
+    for obj, product, mods, placement in targets:
+        data = shapes.get(obj.Name)
+        if product:
+            patchProduct(ifcbin, obj, product, mods, placement, data, scaling, changed)
+        else:
+            product = writeNewProduct(ifcbin, obj, data, scaling)
+        if data:
+            # the styles of the former geometry don't apply to the new one
+            writeStyle(ifcbin, product, getColor(obj, colors))
+    writePatch(source, filename, changed, ifcbin.created)
+    endtime = round(time.time() - starttime, 1)
+    print(
+        "Patched",
+        len(changed),
+        "entities and wrote",
+        len(ifcbin.created),
+        "new ones in",
+        endtime,
+        "s",
+    )
+    print("Recycler:", ifcbin.hits, "entities reused,", ifcbin.misses, "created")
+
+
+def getModifications(obj, product):
+    """returns 3 booleans telling if the attributes, the geometry or the
+    placement of an object changed since it was imported from an IFC
+    product, by comparing it with the hashes stored at import time"""
+
+    import BimIfcImport
+
+    if getattr(obj, "Modified", False):
+        return True, True, True
+    if not hasattr(obj, "ShapeHashes") or len(obj.ShapeHashes) != 3:
+        return False, False, False
+    current = BimIfcImport.getShapeHashes(obj)
+    geom = current[0] != obj.ShapeHashes[0]
+    placement = current[1] != obj.ShapeHashes[1]
+    attrs = current[2] != obj.ShapeHashes[2]
+    return attrs, geom, placement
+
+
+def getWorldPlacement(obj, product, scaling, moved=False):
+    """returns the placement of an IFC product in mm. If moved is True,
+    the displacement of the FreeCAD object since import is applied"""
+
+    import importIFCHelper
+
+    world = None
+    if getattr(product, "ObjectPlacement", None):
+        world = importIFCHelper.getPlacement(product.ObjectPlacement, scaling)
+    if not world:
+        world = FreeCAD.Placement()
+    if moved and hasattr(obj, "ShapeHashes"):
+        # the placement of the object at import time
+        values = [float(v) for v in obj.ShapeHashes[1].split(";")]
+        old = FreeCAD.Placement(
+            FreeCAD.Vector(values[:3]), FreeCAD.Rotation(*values[3:])
         )
-        if preferences["EXPORT_MODEL"] == "struct":
-            return
+        world = obj.Placement.multiply(old.inverse()).multiply(world)
+    return world
+
+
+def patchProduct(ifcbin, obj, product, mods, world, data, scaling, changed):
+    """modifies an IFC product after the FreeCAD object imported from it.
+    mods is given by getModifications, world by getWorldPlacement, and data
+    by getShapesData. Modified entities are stored in changed"""
+
+    import importIFCHelper
+
+    attrs, geom, placement = mods
+    if attrs:
+        product.Name = obj.Label
+        if hasattr(obj, "Description"):
+            product.Description = obj.Description or None
+        changed[product.id()] = product
+    if not product.is_a("IfcProduct"):
+        return
+    if placement:
+        parent = None
+        relative = world
+        if product.ObjectPlacement and product.ObjectPlacement.PlacementRelTo:
+            parent = product.ObjectPlacement.PlacementRelTo
+            parentpl = importIFCHelper.getPlacement(parent, scaling)
+            relative = parentpl.inverse().multiply(world)
+        axis = writeAxisPlacement(ifcbin, relative, scaling)
+        old = product.ObjectPlacement
+        if (
+            old
+            and old.is_a("IfcLocalPlacement")
+            and not isShared(ifcbin.file, old, product)
+        ):
+            # modified in place, so the placements relative to it (openings)
+            # move with the product
+            ifcbin.modify(old, RelativePlacement=axis)
+            changed[old.id()] = old
+        else:
+            product.ObjectPlacement = ifcbin.createLocalPlacement(parent, axis)
+            changed[product.id()] = product
+    if geom and data:
+        context = getBodyContext(ifcbin.file, product)
+        product.Representation = writeShape(ifcbin, data, context)
+        changed[product.id()] = product
+
+
+def isShared(ifcfile, placement, product):
+    """tells if a placement is also the placement of another product"""
+
+    for entity in ifcfile.get_inverse(placement):
+        if entity.is_a("IfcProduct") and entity != product:
+            return True
+    return False
+
+
+def writeNewProduct(ifcbin, obj, data, scaling):
+    """writes a FreeCAD object that doesn't exist in the IFC file yet"""
+
+    import ifcopenshell
+
+    ifcfile = ifcbin.file
+    uid = getattr(obj, "GlobalId", None)
+    if not uid:
+        uid = ifcopenshell.guid.new()
+        if hasattr(obj, "GlobalId"):
+            obj.GlobalId = uid
+    history = ifcfile.by_type("IfcOwnerHistory")
+    history = history[0] if history else None
+    axis = writeAxisPlacement(ifcbin, obj.Placement, scaling)
+    placement = ifcbin.createLocalPlacement(None, axis)
+    context = getBodyContext(ifcfile)
+    shape = writeShape(ifcbin, data, context)
+    args = [uid, history, obj.Label, getattr(obj, "Description", None) or None]
+    args += [None, placement, shape]
+    try:
+        product = ifcbin.create(getIfcType(obj), *args)
+    except RuntimeError:
+        product = ifcbin.create("IfcBuildingElementProxy", *args)
+    for parent in obj.InList:
+        if getattr(parent, "GlobalId", None) and getattr(parent, "IfcID", None):
+            try:
+                container = ifcfile.by_guid(parent.GlobalId)
+            except RuntimeError:
+                continue
+            if container.is_a("IfcSpatialStructureElement"):
+                ifcbin.create(
+                    "IfcRelContainedInSpatialStructure",
+                    ifcopenshell.guid.new(),
+                    history,
+                    None,
+                    None,
+                    [product],
+                    container,
+                )
+                break
+    return product
+
+
+def getBodyContext(ifcfile, product=None):
+    """returns the representation context used by the body of a product,
+    or the first 3D context of the file"""
+
+    if product and product.Representation:
+        for rep in product.Representation.Representations:
+            if rep.RepresentationIdentifier == "Body":
+                return rep.ContextOfItems
+    for context in ifcfile.by_type("IfcGeometricRepresentationSubContext"):
+        if context.ContextIdentifier == "Body":
+            return context
+    for context in ifcfile.by_type("IfcGeometricRepresentationContext"):
+        if context.ContextType == "Model":
+            return context
+    return ifcfile.by_type("IfcGeometricRepresentationContext")[0]
+
+
+def writeAxisPlacement(ifcbin, placement, scaling):
+    """writes an IfcAxis2Placement3D from a FreeCAD placement in mm"""
+
+    rot = placement.Rotation
+    loc = [v / scaling for v in placement.Base]
+    axis = rot.multVec(FreeCAD.Vector(0, 0, 1))
+    ref = rot.multVec(FreeCAD.Vector(1, 0, 0))
+    return ifcbin.createAxis2Placement(
+        ifcbin.createPoint(loc),
+        ifcbin.createDirection(axis),
+        ifcbin.createDirection(ref),
+    )
+
+
+def getShapesData(jobs, scaling):
+    """triangulates a list of (objname, shape, placement) tuples, and
+    returns a {objname: shape data} dict (see getShapeData). Shapes are
+    passed as BREP strings, so the work can be done in other processes,
+    see BimProcesses"""
+
+    import BimProcesses
+
+    starttime = time.time()
+    args = []
+    for name, shape, placement in jobs:
+        pl = tuple(placement.Base) + tuple(placement.Rotation.Q)
+        args.append((shape.exportBrepToString(), pl, scaling, TESSELLATION))
+    cores = BimProcesses.getCores()
+    executor = None
+    if len(args) > 1:
+        executor = BimProcesses.getExecutor(cores)
+    if executor:
+        chunksize = max(1, len(args) // (cores * 4))
+        with executor:
+            # map keeps the order, so the result is the same as serial
+            results = list(executor.map(getShapeData, args, chunksize=chunksize))
+    else:
+        cores = 1
+        results = [getShapeData(a) for a in args]
+    endtime = round(time.time() - starttime, 1)
+    print("Triangulated", len(args), "shapes in", endtime, "s using", cores, "cores")
+    return dict(zip([job[0] for job in jobs], results))
+
+
+def getShapeData(args):
+    """returns the triangulated geometry of a BREP string, in the
+    coordinates of the given placement and in file units, as a list of
+    (solid, points, triangles) tuples. args is a (brep, placement, scaling,
+    tolerance) tuple, placement being a (x, y, z, q0, q1, q2, q3) tuple.
+    Uses no document data, so it can run in another process"""
+
+    import Part
+
+    brep, pl, scaling, tolerance = args
+    shape = Part.Shape()
+    shape.importBrepFromString(brep, False)
+    placement = FreeCAD.Placement(FreeCAD.Vector(pl[:3]), FreeCAD.Rotation(*pl[3:]))
+    inverse = placement.inverse()
+    data = []
+    parts = [(True, s) for s in shape.Solids]
+    if not parts:
+        parts = [(False, shape)]
+    for solid, part in parts:
+        points, triangles = part.tessellate(tolerance)
+        points = [inverse.multVec(p) for p in points]
+        points = [(p.x / scaling, p.y / scaling, p.z / scaling) for p in points]
+        triangles = [tuple(t) for t in triangles]
+        data.append((solid, points, triangles))
+    return data
+
+
+def writeShape(ifcbin, data, context):
+    """writes shape data given by getShapeData as faceted geometry,
+    and returns the new IfcProductDefinitionShape"""
+
+    items = []
+    for solid, points, triangles in data:
+        points = [ifcbin.createPoint(p) for p in points]
+        faces = []
+        for triangle in triangles:
+            loop = ifcbin.create("IfcPolyLoop", [points[i] for i in triangle])
+            bound = ifcbin.create("IfcFaceOuterBound", loop, True)
+            faces.append(ifcbin.create("IfcFace", [bound]))
+        if solid:
+            shell = ifcbin.create("IfcClosedShell", faces)
+            items.append(ifcbin.create("IfcFacetedBrep", shell))
+        else:
+            shell = ifcbin.create("IfcOpenShell", faces)
+            items.append(ifcbin.create("IfcShellBasedSurfaceModel", [shell]))
+    reptype = "Brep"
+    if not all([i.is_a("IfcFacetedBrep") for i in items]):
+        reptype = "SurfaceModel"
+    rep = ifcbin.create("IfcShapeRepresentation", context, "Body", reptype, items)
+    return ifcbin.create("IfcProductDefinitionShape", None, None, [rep])
 
-    # if unmodified, do nothing
 
-    # if modified, locate the old one
+def getColorDict(doc):
+    """returns the {objname: color} dict stored by the importer in the
+    document Meta, when it runs without the GUI"""
 
-    # if no old one, write from scratch
+    import json
+
+    if "colordict" in doc.Meta:
+        return json.loads(doc.Meta["colordict"])
+    return {}
+
+
+def getColor(obj, colors):
+    """returns the (r, g, b) color and the transparency of an object, from
+    its view provider, or else from the given color dict, or None"""
+
+    vobj = getattr(obj, "ViewObject", None)
+    if vobj and hasattr(vobj, "ShapeColor"):
+        return vobj.ShapeColor[:3], vobj.Transparency / 100.0
+    color = colors.get(obj.Name)
+    if color:
+        return color[:3], 0
+    return None
+
+
+def writeStyle(ifcbin, product, color):
+    """applies a color given by getColor to the geometry of a product.
+    Products of the same color share one surface style"""
+
+    if not color or not product.Representation:
+        return
+    style = ifcbin.createSurfaceStyle(*color)
+    for rep in product.Representation.Representations:
+        for item in rep.Items:
+            ifcbin.createStyledItem(item, style)
+
+
+def getEntityLine(entity):
+    """returns the STEP line of an IFC entity, its non-ASCII text encoded
+    as ISO-10303-21 requires"""
+
+    data = getattr(entity, "wrapped_data", entity)
+    if hasattr(data, "to_string"):
+        line = data.to_string()
+    else:
+        line = data.toString()  # older versions of IfcOpenShell
+    eid, data = line.split("=", 1)
+    name, args = data.split("(", 1)
+    return eid + "=" + name.upper() + "(" + args + ";"
+
+
+def writePatch(source, filename, changed, created):
+    """copies the source IFC file to filename, replacing the lines of the
+    changed entities and adding the created ones at the end of the data"""
+
+    lines = {}
+    for eid, entity in changed.items():
+        lines[eid] = getEntityLine(entity).encode("utf8")
+    newlines = [getEntityLine(e).encode("utf8") for e in created]
+    eol = b"\n"
+    indata = False
+    statement = b""
+    with open(source, "rb") as src, openOutput(filename) as dst:
+        for line in src:
+            if not indata:
+                dst.write(line)
+                if line.strip() == b"DATA;":
+                    indata = True
+                    eol = b"\r\n" if line.endswith(b"\r\n") else b"\n"
+                continue
+            # statements can span several lines, and strings contain ;
+            statement += line
+            if not statement.rstrip().endswith(b";"):
+                continue
+            if statement.count(b"'") % 2:
+                continue
+            stripped = statement.lstrip()
+            if stripped.startswith(b"ENDSEC;"):
+                for newline in newlines:
+                    dst.write(newline + eol)
+                indata = False
+            elif stripped.startswith(b"#"):
+                eid = int(stripped[1 : stripped.index(b"=")])
+                if eid in lines:
+                    statement = lines.pop(eid) + eol
+            dst.write(statement)
+            statement = b""
+
+
+def getFileText(ifcfile):
+    """returns the STEP text of an IFC file"""
+
+    if hasattr(ifcfile, "to_string"):
+        return ifcfile.to_string()
+    return ifcfile.wrapped_data.to_string()
+
+
+def getCompression(filename):
+    """returns the compression to use for a file, None, "gzip" or "ifczip" """
+
+    if filename.lower().endswith(".ifczip"):
+        return "ifczip"
+    if filename.lower().endswith(".gz"):
+        return "gzip"
+    return COMPRESSION
+
+
+def openOutput(filename):
+    """opens the given file for binary writing, compressed or not"""
+
+    compression = getCompression(filename)
+    if compression == "ifczip":
+        if not filename.lower().endswith(".ifczip"):
+            filename = os.path.splitext(filename)[0] + ".ifczip"
+        return ZipOutput(filename)
+    if compression == "gzip":
+        if not filename.lower().endswith(".gz"):
+            filename += ".gz"
+        return gzip.open(filename, "wb")
+    return open(filename, "wb")
+
+
+class ZipOutput:
+
+    """A writable file inside an IFCZIP archive"""
+
+    def __init__(self, filename):
+        name = os.path.splitext(os.path.basename(filename))[0] + ".ifc"
+        self.zip = zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED)
+        self.file = self.zip.open(name, "w", force_zip64=True)
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def getChunks(objectslist):
+    """splits a list of objects by storey, keeping their order, in chunks
+    of at most CHUNKSIZE objects. Objects outside any storey come first"""
+
+    storeys = {"": []}
+    for obj in objectslist:
+        storey = getStorey(obj)
+        storeys.setdefault(storey.Name if storey else "", []).append(obj)
+    chunks = []
+    for storey in storeys.values():
+        for i in range(0, len(storey), CHUNKSIZE):
+            chunks.append(storey[i : i + CHUNKSIZE])
+    return chunks
+
+
+def getStorey(obj, done=None):
+    """returns the storey containing an object, or None"""
+
+    if done is None:
+        done = set()
+    for parent in obj.InList:
+        if parent.Name in done:
+            continue
+        done.add(parent.Name)
+        if getIfcType(parent) == "IfcBuildingStorey":
+            return parent
+        storey = getStorey(parent, done)
+        if storey:
+            return storey
+    return None
+
+
+class StreamWriter:
+
+    """Writes an IFC file by chunks. Each chunk is made in an IFC file of
+    its own, written then dropped, so the memory used is bounded by the
+    size of a chunk. The entities of the main file used by a chunk (owner
+    history, contexts) are copied in it, and the ids of each chunk are
+    renumbered to follow the ones already written"""
+
+    def __init__(self, ifcfile, filename):
+        self.ifcfile = ifcfile
+        self.file = openOutput(filename)
+        self.lastid = max([entity.id() for entity in ifcfile] or [0])
+        self.chunk = None
+        self.copies = {}  # chunk id : main file id
+        header = getFileText(ifcfile).split("DATA;")[0]
+        self.file.write((header + "DATA;\n").encode("utf8"))
+
+    def start(self, *entities):
+        """starts a new chunk, copies the given entities of the main file
+        in it, and returns the chunk file followed by the copies"""
+
+        import ifcopenshell
+
+        self.chunk = ifcopenshell.file(schema=self.ifcfile.schema)
+        self.copies = {}
+        result = [self.chunk]
+        for entity in entities:
+            copy = self.chunk.add(entity)
+            children = zip(self.ifcfile.traverse(entity), self.chunk.traverse(copy))
+            for original, child in children:
+                self.copies[child.id()] = original.id()
+            result.append(copy)
+        return result
+
+    def flush(self):
+        """writes the entities of the current chunk, except the copies,
+        and drops the chunk"""
+
+        import re
+
+        offset = self.lastid
+
+        def renumber(match):
+            if not match.group(1):
+                return match.group(0)  # a string
+            eid = int(match.group(1))
+            return "#" + str(self.copies.get(eid, eid + offset))
+
+        text = getFileText(self.chunk)
+        text = text.split("DATA;", 1)[1].rsplit("ENDSEC;", 1)[0]
+        lines = []
+        for line in text.strip().splitlines():
+            eid = int(line[1 : line.index("=")])
+            if not eid in self.copies:
+                lines.append(line)
+                self.lastid = max(self.lastid, eid + offset)
+        text = re.sub(r"'(?:[^']|'')*'|#(\d+)", renumber, "\n".join(lines))
+        self.file.write((text + "\n").encode("utf8"))
+        self.chunk = None
+        self.copies = {}
+
+    def close(self):
+        """writes the entities of the main file and closes the file"""
+
+        for entity in self.ifcfile:
+            self.file.write((getEntityLine(entity) + "\n").encode("utf8"))
+        self.file.write(b"ENDSEC;\nEND-ISO-10303-21;\n")
+        self.file.close()
+
+
+def writeObject(obj, ifcbin, data, history, context, scaling):
+    """writes a FreeCAD object to the given IFC file. data is the shape
+    data of the object given by getShapesData, or None"""
+
+    # to integrate: structural models (EXPORT_MODEL "struct" or "hybrid"),
+    # see exportIFCStructuralTools.createStructuralMember()
+
+    # objects linked to an existing IFC file are handled by exportPatch()
 
     # generic data
     name = obj.Label
-    description = getattr(obj, "Description", "")
+    description = getattr(obj, "Description", "") or None
     uid = getUID(obj, ifcbin)
     ifctype = getIfcType(obj)
 
+    # placement and geometry
+    axis = writeAxisPlacement(ifcbin, obj.Placement, scaling)
+    placement = ifcbin.createLocalPlacement(None, axis)
+    shape = None
+    if data:
+        shape = writeShape(ifcbin, data, context)
+
+    args = [uid, history, name, description, None, placement, shape]
+    try:
+        product = ifcbin.create(ifctype, *args)
+    except RuntimeError:
+        product = ifcbin.create("IfcBuildingElementProxy", *args)
+    return product
+
 
 def writeProperties(obj, ifcfile):
     """writes the properties of a FreeCAD object to the given IFC file"""
@@ -258,12 +918,17 @@ def writeProperties(obj, ifcfile):
 def getUID(obj, ifcbin):
     """gets or creates an UUID for an object"""
 
+    import ifcopenshell
+
     uid = None
     if hasattr(obj, " IfcData"):
         if "IfcUID" in obj.IfcData.keys():
             uid = str(obj.IfcData["IfcUID"])
-            if uid in ifcbin.uids:  # get UIDs
-                uid = None
+            try:
+                ifcbin.file.by_guid(uid)
+                uid = None  # already used in the file
+            except RuntimeError:
+                pass
     if not uid:
         uid = ifcopenshell.guid.new()
         if hasattr(obj, "IfcData"):
@@ -284,7 +949,7 @@ def getIfcType(obj):
     ) != "Undefined":
         ifctype = "IfcBuildingStorey"
     elif hasattr(obj, "IfcType"):
-        ifctype = obj.IfcType.replace(" ", "")
+        ifctype = "Ifc" + obj.IfcType.replace(" ", "")
     elif dtype in ["App::Part", "Part::Compound"]:
         ifctype = "IfcElementAssembly"
     elif dtype in ["App::DocumentObjectGroup"]:
@@ -26,6 +26,7 @@ import time
 import os
 import builtins
 import hashlib
+import json
 
 import FreeCAD
 import Draft
@@ -33,6 +34,7 @@ import Arch
 import importIFCHelper
 from FreeCAD import Base
 import ArchIFC
+import BimIfcCache
 
 # to resolve later...
 import importIFC
@@ -43,6 +45,12 @@ EXCLUDELIST = ["IfcOpeningElement"]  # temporary
 PROPERTYMODE = "new"  # new = IFC properties become FreeCAD properties,
 # old is 0.20, hybrid is: Pset* are old-style,
 # others are new-style
+BATCHSIZE = 100  # max number of products created at once by the document writer
+CACHE = True  # keep a cache of product shapes beside the IFC file
+CACHESIZE = 500  # max size of the shapes cache, in Mb
+INSTANCING = True  # products sharing a mapped representation become clones
+PROFILE = True  # write a json report of the import timings beside the document
+DEFERRED = True  # suspend recomputes and undo, fill groups once at the end
 
 # global dicts to store ifc object/freecad object relationships
 layers = {}  # ifcid : Draft_Layer
@@ -51,6 +59,14 @@ objects = {}  # ifcid : Arch_Component
 subs = {}  # host_ifcid: [child_ifcid,...]
 adds = {}  # host_ifcid: [child_ifcid,...]
 colors = {}  # objname : (r,g,b)
+ifcfile = None  # the IFC file being imported
+index = {}  # relationship : {ifcid : [related entities]}, see buildIndex()
+psets = {}  # pset ifcid : [(name, group, type, value, ifctype),...]
+entityhashes = {}  # ifcid : hash, see BimIfcCache.getEntitiesHash()
+timings = {}  # stage : seconds
+classtimings = {}  # ifc class : [seconds, count]
+groups = {}  # group objname : [group, [child objects]], see addToGroup()
+shapecache = None  # the BimIfcCache.ShapeCache of the current import, if any
 
 
 def open(filename):
@@ -59,8 +75,23 @@ def open(filename):
     return insert(filename)
 
 
-def insert(filename, docname=None):
-    """imports the contents of an IFC file in the given document"""
+def insert(
+    filename,
+    docname=None,
+    classes=None,
+    containers=None,
+    guids=None,
+    boundbox=None,
+    cores=None,
+):
+    """imports the contents of an IFC file in the given document.
+    The imported products can be restricted to:
+    - classes: a list of IFC classes, ex. ["IfcBeam", "IfcColumn"]
+    - containers: a list of spatial elements (names, GlobalIds or ids)
+    - guids: a list of GlobalIds
+    - boundbox: a FreeCAD.BoundBox, in mm, products must intersect
+    cores is the number of threads of the geometry iterator, by default
+    the ifcMulticore preference"""
 
     import ifcopenshell
     from ifcopenshell import geom
@@ -71,11 +102,19 @@ def insert(filename, docname=None):
     global objects
     global adds
     global subs
+    global ifcfile
+    global timings
+    global classtimings
+    global groups
+    global shapecache
     layers = {}
     materials = {}
     objects = {}
     adds = {}
     subs = {}
+    timings = {}
+    classtimings = {}
+    groups = {}
 
     # BIM WB header (temporary)
     print("BIM Workbench IFC importer")
@@ -88,22 +127,14 @@ def insert(filename, docname=None):
 
     # setup ifcopenshell
     params = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Arch")
-    settings = ifcopenshell.geom.settings()
-    settings.set(settings.USE_BREP_DATA, True)
-    settings.set(settings.SEW_SHELLS, True)
-    settings.set(settings.USE_WORLD_COORDS, True)
-    # TODO: Treat openings
-    # if preferences['SEPARATE_OPENINGS']:
-    #    settings.set(settings.DISABLE_OPENING_SUBTRACTIONS,True)
-    settings.set(settings.DISABLE_OPENING_SUBTRACTIONS, False)
-    # TODO: Treat layers
-    # if preferences['SPLIT_LAYERS'] and hasattr(settings,"APPLY_LAYERSETS"):
-    settings.set(settings.APPLY_LAYERSETS, True)
+    settings = getSettings()
 
     # setup document
+    newdoc = False
     if FreeCAD.ActiveDocument:
         doc = FreeCAD.ActiveDocument
     else:
+        newdoc = True
         if not docname:
             docname = os.path.splitext(os.path.basename(filename))[0]
         doc = FreeCAD.newDocument(docname)
@@ -112,48 +143,109 @@ def insert(filename, docname=None):
 
     # store IFC data
     if IFCINCLUDE == "full":
-        fobj = doc.addObject("App::TextDocument", "IfcFileData")
+        # the file is included as is, and compressed, in the FCStd file
+        fobj = doc.addObject("App::FeaturePython", "IfcFileData")
         fobj.Label = "IFC file data"
-        f = builtins.open(filename)
-        ifcdata = f.read()
-        f.close()
-        fobj.Text = ifcdata
+        fobj.addProperty("App::PropertyFileIncluded", "IfcFile", "IfcLink")
+        fobj.IfcFile = filename
     elif IFCINCLUDE == "link":
         ifcdata = "file://" + filename + ";;hash:"
         hasher = hashlib.md5()
         with builtins.open(filename, "rb") as f:
-            buf = f.read()
-            hasher.update(buf)
+            for buf in iter(lambda: f.read(1048576), b""):
+                hasher.update(buf)
         ifcdata += hasher.hexdigest()
         m = doc.Meta
         m["IfcFileLink"] = ifcdata
         doc.Meta = m
 
+    setFilters(doc, classes, containers, guids, boundbox)
+
     # open the file
-    ifcfile = ifcopenshell.open(filename)
+    t = time.time()
+    ifcfile = openFile(filename)
+    addTiming("file open", t)
+    t = time.time()
+    buildIndex(ifcfile)
+    addTiming("relationships index", t)
     progressbar = Base.ProgressIndicator()
     productscount = len(ifcfile.by_type("IfcProduct"))
+    products = None  # None means all products
+    if classes or containers or guids or boundbox:
+        products = filterProducts(
+            ifcfile, getProducts(ifcfile), classes, containers, guids, boundbox
+        )
+        productscount = len(products)
     progressbar.start("Importing " + str(productscount) + " products...", productscount)
-    cores = params.GetInt("ifcMulticore", 0)
-    iterator = ifcopenshell.geom.iterator(settings, ifcfile, cores)
-    iterator.initialize()
+    if cores is None:
+        cores = params.GetInt("ifcMulticore", 0)
+    cache = None
+    if CACHE:
+        cache = BimIfcCache.ShapeCache(filename, ifcfile, CACHESIZE, settings)
+    shapecache = cache
     count = 0
+    instances = {}
+    if INSTANCING:
+        candidates = products
+        if candidates is None:
+            candidates = getProducts(ifcfile)
+        t = time.time()
+        instances = getInstances(ifcfile, candidates)
+        addTiming("instances detection", t)
+        if instances:
+            products = [p for p in candidates if not p.id() in instances]
 
     # process objects
-    while True:
-        item = iterator.get()
-        if item:
-            ifcproduct = ifcfile.by_id(item.guid)
-            if not ifcproduct.is_a() in EXCLUDELIST:
-                brep = item.geometry.brep_data
-                obj = createProduct(ifcproduct, brep)
+    state = suspendDocument(doc, newdoc)
+    try:
+        for batch in importProducts(ifcfile, settings, cores, products, cache):
+            for i in range(len(batch)):
                 progressbar.next(True)
-                writeProgress(count, productscount, starttime)
-                count += 1
-        if not iterator.next():
-            break
+            count += len(batch)
+            writeProgress(count, productscount, starttime)
+        if instances:
+            orphans = []
+            ifcscale = importIFCHelper.getScaling(ifcfile)
+            bases = {}
+            for ifcproduct, base in instances.values():
+                if base.id() in objects:
+                    bases[objects[base.id()].Name] = objects[base.id()]
+            doc.recompute(list(bases.values()), True)  # so clones don't recompute
+            for ifcproduct, base in instances.values():
+                if base.id() in objects:
+                    t = time.time()
+                    createInstance(ifcproduct, objects[base.id()], base, ifcscale)
+                    addTiming("object creation", t, ifcproduct)
+                    progressbar.next(True)
+                    count += 1
+                else:
+                    orphans.append(ifcproduct)  # the base failed, import normally
+            if orphans:
+                for batch in importProducts(ifcfile, settings, cores, orphans, cache):
+                    count += len(batch)
+            writeProgress(count, productscount, starttime)
+            print(
+                "\nInstancing:",
+                len(instances) - len(orphans),
+                "clones of",
+                len(bases),
+                "shared shapes",
+            )
+        t = time.time()
+        writeGroups()
+        addTiming("groups", t)
+    finally:
+        resumeDocument(doc, state)
+    if cache:
+        t = time.time()
+        cache.save()
+        addTiming("cache save", t)
+        print("\nShapes cache:", cache.hits, "reused,", cache.misses, "computed")
+        if cache.error:
+            FreeCAD.Console.PrintWarning("Shapes cache error: " + cache.error + "\n")
 
     # process 2D annotations
+    t = time.time()
     annotations = ifcfile.by_type("IfcAnnotation")
     if annotations:
         print("Processing", str(len(annotations)), "annotations...")
@@ -164,23 +256,263 @@ def insert(filename, docname=None):
             anno = importIFCHelper.createAnnotation(annotation, doc, ifcscale, p)
             if anno:
                 gr.addObject(anno)
+    addTiming("annotations", t)
 
     # post-processing
+    t = time.time()
     processRelationships()
+    addTiming("relationships", t)
     storeColorDict()
 
     # finished
     progressbar.stop()
+    t = time.time()
     FreeCAD.ActiveDocument.recompute()
-    endtime = round(time.time() - starttime, 1)
+    addTiming("recompute", t)
+    setContainerHashes()
+    total = time.time() - starttime
+    endtime = round(total, 1)
     fs = round(filesize, 1)
     ratio = int(endtime / filesize)
+    rate = count
+    if endtime:
+        rate = int(count / endtime)
     endtime = "%02d:%02d" % (divmod(endtime, 60))
     writeProgress()  # this cleans the line
     print("Finished importing", fs, "Mb in", endtime, "s, or", ratio, "s/Mb")
+    print("Created", count, "products,", rate, "products/s, using", cores, "cores")
+    peak = getPeakMemory()
+    if peak:
+        print("Peak memory usage:", peak, "Mb")
+    if PROFILE:
+        stats = {
+            "file": filename,
+            "size": filesize,
+            "products": count,
+            "cores": cores,
+            "total": total,
+            "peakmemory": peak,
+        }
+        report = writeProfile(doc, filename, stats)
+        print("Import profile written to", report)
     return FreeCAD.ActiveDocument
 
 
+def update(doc=None, filename=None):
+    """updates a document previously imported from an IFC file, by default
+    from its linked IFC file. Products are matched by GlobalId and only
+    the objects whose attributes, properties or geometry changed are
+    touched. New products are created and deleted ones removed"""
+
+    global layers
+    global materials
+    global objects
+    global adds
+    global subs
+    global ifcfile
+    global groups
+    global shapecache
+    layers = {}
+    materials = {}
+    objects = {}
+    adds = {}
+    subs = {}
+    groups = {}
+
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    if not filename:
+        if not "IfcFileLink" in doc.Meta:
+            msg = "This document is not linked to an IFC file\n"
+            FreeCAD.Console.PrintError(msg)
+            return
+        filename = doc.Meta["IfcFileLink"].split(";;")[0].replace("file://", "")
+    starttime = time.time()
+    print("Updating", doc.Label, "from", filename)
+    ifcfile = openFile(filename)
+    buildIndex(ifcfile)
+    FreeCAD.setActiveDocument(doc.Name)
+    settings = getSettings()
+    cache = None
+    if CACHE:
+        cache = BimIfcCache.ShapeCache(filename, ifcfile, CACHESIZE, settings)
+    shapecache = cache
+
+    # match existing objects
+    existing = {}
+    for obj in doc.Objects:
+        if hasattr(obj, "IfcID") and getattr(obj, "GlobalId", None):
+            existing[obj.GlobalId] = obj
+    for obj in doc.Objects:
+        if Draft.getType(obj) == "Material":
+            for material in ifcfile.by_type("IfcMaterial"):
+                if material.Name == obj.Label:
+                    materials[material.id()] = obj
+        elif Draft.getType(obj) == "Layer":
+            for layer in ifcfile.by_type("IfcPresentationLayerAssignment"):
+                if layer.Name == obj.Label:
+                    layers[layer.id()] = obj
+    new = []
+    changed = []
+    updated = 0
+    for ifcproduct in ifcfile.by_type("IfcProject") + ifcfile.by_type("IfcProduct"):
+        obj = existing.pop(ifcproduct.GlobalId, None)
+        if not obj:
+            if getattr(ifcproduct, "Representation", None):
+                if not ifcproduct.is_a() in EXCLUDELIST:
+                    new.append(ifcproduct)
+            continue
+        objects[ifcproduct.id()] = obj
+        hashes = getHashes(ifcproduct)
+        old = list(getattr(obj, "IfcHashes", [])) + ["", "", ""]
+        if hashes[:2] != old[:2]:
+            setAttributes(obj, ifcproduct)
+            setProperties(obj, ifcproduct)
+            updated += 1
+        elif hashes[2] != old[2]:
+            setAttributes(obj, ifcproduct)
+        if hashes[2] != old[2] and getattr(ifcproduct, "Representation", None):
+            changed.append(ifcproduct)
+
+    # products left out by the filters of the import are not new
+    filters = getFilters(doc)
+    if new and filters:
+        new = filterProducts(ifcfile, new, **filters)
+
+    # update shapes and create new objects
+    cores = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Arch").GetInt(
+        "ifcMulticore", 0
+    )
+    state = suspendDocument(doc)
+    try:
+        if changed:
+            for batch in importProducts(
+                ifcfile, settings, cores, changed, cache, writer=updateShapes
+            ):
+                pass
+        if new:
+            for batch in importProducts(ifcfile, settings, cores, new, cache):
+                pass
+            writeGroups()
+            processRelationships()
+    finally:
+        resumeDocument(doc, state)
+    if cache:
+        cache.save()
+        if cache.error:
+            FreeCAD.Console.PrintWarning("Shapes cache error: " + cache.error + "\n")
+
+    # remove deleted objects
+    for obj in existing.values():
+        doc.removeObject(obj.Name)
+
+    doc.recompute()
+    setContainerHashes()
+    endtime = "%02d:%02d" % (divmod(round(time.time() - starttime, 1), 60))
+    print(
+        "Updated in",
+        endtime,
+        "s:",
+        len(new),
+        "created,",
+        updated,
+        "updated,",
+        len(changed),
+        "reshaped,",
+        len(existing),
+        "deleted",
+    )
+    return doc
+
+
+def updateShapes(batch):
+    """sets the shapes of existing objects from a list of
+    (ifcproduct, shape) tuples"""
+
+    result = []
+    for ifcproduct, shape in batch:
+        obj = objects[ifcproduct.id()]
+        if getattr(obj, "CloneOf", None):
+            obj.CloneOf = None  # or the next recompute restores the old shape
+        obj.Shape = shape
+        if hasattr(obj, "ShapeHashes"):
+            obj.ShapeHashes = getShapeHashes(obj)
+        result.append(obj)
+    return result
+
+
+def buildIndex(ifcfile):
+    """indexes the relationships of an IFC file once, so they don't need
+    to be looked up for each product:
+    psets: product id : [property definitions]
+    materials: product id : [materials]
+    layers: representation id : [layers]
+    containers: element id : [spatial containers]
+    aggregates: object id : [aggregating objects]"""
+
+    global index
+    global psets
+    global entityhashes
+
+    psets = {}
+    entityhashes = {}
+    index = {}
+    for key in ["psets", "materials", "layers", "containers", "aggregates"]:
+        index[key] = {}
+    for rel in ifcfile.by_type("IfcRelDefinesByProperties"):
+        definitions = rel.RelatingPropertyDefinition
+        if not isinstance(definitions, tuple):
+            definitions = [definitions]
+        for obj in rel.RelatedObjects:
+            index["psets"].setdefault(obj.id(), []).extend(definitions)
+    for rel in ifcfile.by_type("IfcRelAssociatesMaterial"):
+        for obj in rel.RelatedObjects:
+            index["materials"].setdefault(obj.id(), []).append(rel.RelatingMaterial)
+    for layer in ifcfile.by_type("IfcPresentationLayerAssignment"):
+        for item in layer.AssignedItems:
+            index["layers"].setdefault(item.id(), []).append(layer)
+    for rel in ifcfile.by_type("IfcRelContainedInSpatialStructure"):
+        for obj in rel.RelatedElements:
+            index["containers"].setdefault(obj.id(), []).append(rel.RelatingStructure)
+    for rel in ifcfile.by_type("IfcRelAggregates"):
+        for obj in rel.RelatedObjects:
+            index["aggregates"].setdefault(obj.id(), []).append(rel.RelatingObject)
+
+
+def getRelated(relationship, entity):
+    """returns the entities related to the given one in the index"""
+
+    return index.get(relationship, {}).get(entity.id(), [])
+
+
+def getParents(ifcobj):
+    """returns the parent containers of an IFC object"""
+
+    if hasattr(ifcobj, "ContainedInStructure"):
+        return getRelated("containers", ifcobj)
+    return getRelated("aggregates", ifcobj)
+
+
+def getSettings():
+    """returns the ifcopenshell geometry settings used by the importer"""
+
+    import ifcopenshell
+    from ifcopenshell import geom
+
+    settings = ifcopenshell.geom.settings()
+    settings.set(settings.USE_BREP_DATA, True)
+    settings.set(settings.SEW_SHELLS, True)
+    settings.set(settings.USE_WORLD_COORDS, True)
+    # TODO: Treat openings
+    # if preferences['SEPARATE_OPENINGS']:
+    #    settings.set(settings.DISABLE_OPENING_SUBTRACTIONS,True)
+    settings.set(settings.DISABLE_OPENING_SUBTRACTIONS, False)
+    # TODO: Treat layers
+    # if preferences['SPLIT_LAYERS'] and hasattr(settings,"APPLY_LAYERSETS"):
+    settings.set(settings.APPLY_LAYERSETS, True)
+    return settings
+
+
 def writeProgress(count=None, total=None, starttime=None):
     """write progress to console"""
 
@@ -195,19 +527,430 @@ def writeProgress(count=None, total=None, starttime=None):
             eta = "%02d:%02d" % (divmod(rest, 60))
         else:
             eta = "--:--"
+        if elapsed:
+            rate = str(int(count / elapsed))
+        else:
+            rate = "--"
         hashes = "#" * int(r * 10) + " " * int(10 - r * 10)
-        fstring = "\rImporting " + str(total) + " products [{0}] {1}%, ETA: {2}"
-        sys.stdout.write(fstring.format(hashes, int(r * 100), eta))
+        fstring = "\rImporting " + str(total) + " products [{0}] {1}%, {2}/s, ETA: {3}"
+        sys.stdout.write(fstring.format(hashes, int(r * 100), rate, eta))
+
+
+def suspendDocument(doc, new=False):
+    """freezes the recomputes of a document, if DEFERRED is set. The undo
+    is disabled in a new document, while an existing document gets all
+    the changes in one transaction, to keep its undo history. Returns the
+    previous state, to give to resumeDocument"""
+
+    if not DEFERRED:
+        return None
+    state = (getattr(doc, "RecomputesFrozen", False), doc.UndoMode, new)
+    if hasattr(doc, "RecomputesFrozen"):
+        doc.RecomputesFrozen = True
+    if new:
+        doc.UndoMode = 0
+    else:
+        doc.openTransaction("IFC import")
+    return state
 
 
-def createProduct(ifcproduct, brep):
-    """creates an Arch object from an IFC product"""
+def resumeDocument(doc, state):
+    """restores the state of a document frozen by suspendDocument"""
+
+    if not state:
+        return
+    if hasattr(doc, "RecomputesFrozen"):
+        doc.RecomputesFrozen = state[0]
+    if state[2]:
+        doc.UndoMode = state[1]
+    else:
+        doc.commitTransaction()
+
+
+def addToGroup(group, obj):
+    """adds an object to a group (layer or container). If DEFERRED is set,
+    the object is only stored, and all the groups are written at once by
+    writeGroups(), instead of rewriting the group contents for each object"""
+
+    global groups
+
+    if not DEFERRED:
+        group.Proxy.addObject(group, obj)
+        return
+    if not group.Name in groups:
+        groups[group.Name] = [group, []]
+    groups[group.Name][1].append(obj)
+
+
+def writeGroups():
+    """writes the contents of the groups filled by addToGroup()"""
+
+    global groups
+
+    for group, children in groups.values():
+        contents = group.Group
+        names = set([o.Name for o in contents])
+        for child in children:
+            if not child.Name in names:
+                names.add(child.Name)
+                contents.append(child)
+        group.Group = contents
+    groups = {}
+
+
+def addTiming(stage, starttime, ifcproduct=None):
+    """adds the time elapsed since starttime to the given import stage,
+    and to the class of the given IFC product if any"""
+
+    elapsed = time.time() - starttime
+    timings[stage] = timings.get(stage, 0) + elapsed
+    if ifcproduct:
+        ct = classtimings.setdefault(ifcproduct.is_a(), [0, 0])
+        ct[0] += elapsed
+        if stage == "object creation":
+            ct[1] += 1
+
+
+def writeProfile(doc, filename, stats):
+    """writes the import timings as json beside the document, or beside
+    the IFC file if the document was never saved. Returns the file path"""
+
+    if doc.FileName:
+        path = os.path.splitext(doc.FileName)[0]
+    else:
+        path = os.path.splitext(filename)[0]
+    path += ".profile.json"
+    profile = dict(stats)
+    profile["stages"] = dict(
+        sorted(timings.items(), key=lambda item: item[1], reverse=True)
+    )
+    profile["classes"] = {}
+    for ifcclass, (seconds, count) in sorted(
+        classtimings.items(), key=lambda item: item[1][0], reverse=True
+    ):
+        profile["classes"][ifcclass] = {"time": seconds, "count": count}
+    with builtins.open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+    return path
+
+
+def openFile(filename):
+    """opens an IFC file. If the installed ifcopenshell supports it, the
+    file is opened lazily: it is indexed in one pass, and the attributes
+    of an entity are only parsed when first read"""
+
+    import inspect
+    import ifcopenshell
+
+    if "lazy" in inspect.signature(ifcopenshell.open).parameters:
+        return ifcopenshell.open(filename, lazy=True)
+    return ifcopenshell.open(filename)
+
+
+def getPeakMemory():
+    """returns the peak memory (resident set size) of this process in Mb,
+    or None if not available on this platform"""
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return int(peak / 1048576)  # bytes
+    return int(peak / 1024)  # kilobytes
+
+
+def importProducts(ifcfile, settings, cores, products=None, cache=None, writer=None):
+    """creates Arch objects for the given IFC products (or for all the
+    products of the file if None) and yields them by batches of BATCHSIZE.
+    An alternative writer function can be given, that receives lists of
+    (ifcproduct, shape) tuples. Multiple cores are only used by the
+    geometry iterator (see the ifcMulticore preference)"""
+
+    if not writer:
+        writer = createProducts
+    batch = []
+    for item in readShapes(ifcfile, settings, cores, products, cache):
+        batch.append(item)
+        if len(batch) >= BATCHSIZE:
+            yield writer(batch)
+            batch = []
+    if batch:
+        yield writer(batch)
+
+
+def readShapes(ifcfile, settings, cores, products=None, cache=None):
+    """yields (ifcproduct, shape) tuples for the given IFC products (or for
+    all the products of the file if None). Shapes are read from the given
+    cache when possible, the others are computed by the geometry iterator
+    and stored in the cache"""
 
     import Part
 
-    shape = Part.Shape()
-    shape.importBrepFromString(brep, False)
-    shape.scale(1000.0)  # IfcOpenShell outputs in meters
+    cached = []
+    if cache:
+        if products is None:
+            candidates = getProducts(ifcfile)
+        else:
+            candidates = products
+        for ifcproduct in candidates:
+            if cache.contains(ifcproduct):
+                t = time.time()
+                shape = cache.getShape(ifcproduct)
+                addTiming("cache read", t, ifcproduct)
+                if shape:  # unreadable shapes are computed again
+                    cached.append(ifcproduct)
+                    yield ifcproduct, shape
+    iterator = getIterator(ifcfile, settings, cores, products, cached)
+    t = time.time()
+    if iterator and iterator.initialize():
+        addTiming("iterator init", t)
+        while True:
+            t = time.time()
+            item = iterator.get()
+            if item:
+                ifcproduct = ifcfile.by_id(item.guid)
+                addTiming("geometry", t, ifcproduct)
+                if not ifcproduct.is_a() in EXCLUDELIST:
+                    t = time.time()
+                    shape = Part.Shape()
+                    shape.importBrepFromString(item.geometry.brep_data, False)
+                    shape.scale(1000.0)  # IfcOpenShell outputs in meters
+                    addTiming("brep parse", t, ifcproduct)
+                    if cache:
+                        t = time.time()
+                        cache.misses += 1
+                        cache.putShape(ifcproduct, shape)
+                        addTiming("cache write", t, ifcproduct)
+                    yield ifcproduct, shape
+            t = time.time()
+            if not iterator.next():
+                break
+            addTiming("geometry", t)
+
+
+def getIterator(ifcfile, settings, cores, products=None, exclude=[]):
+    """returns a geometry iterator over the given IFC products (or all the
+    products of the file if None) except the excluded ones, or None if
+    there is nothing to iterate"""
+
+    import ifcopenshell
+    from ifcopenshell import geom
+
+    if products is not None:
+        ids = set([p.id() for p in exclude])
+        include = [p for p in products if not p.id() in ids]
+        if not include:
+            return None
+        return geom.iterator(settings, ifcfile, cores, include=include)
+    elif exclude:
+        return geom.iterator(settings, ifcfile, cores, exclude=exclude)
+    return geom.iterator(settings, ifcfile, cores)
+
+
+def getProducts(ifcfile):
+    """returns the IFC products of a file that have a geometry to import"""
+
+    return [
+        p
+        for p in ifcfile.by_type("IfcProduct")
+        if p.Representation and not p.is_a() in EXCLUDELIST
+    ]
+
+
+def filterProducts(
+    ifcfile, products, classes=None, containers=None, guids=None, boundbox=None
+):
+    """returns the given IFC products that match all the given filters,
+    see insert() for their meaning"""
+
+    if classes:
+        products = [p for p in products if any([p.is_a(c) for c in classes])]
+    if guids:
+        guids = set(guids)
+        products = [p for p in products if p.GlobalId in guids]
+    if containers:
+        ids = set()
+        for element in ifcfile.by_type("IfcSpatialStructureElement"):
+            if element.id() in ids:
+                continue
+            for c in containers:
+                if c in [element.id(), element.GlobalId, element.Name]:
+                    ids.update([e.id() for e in getSpatialChildren(element)])
+                    break
+        products = [p for p in products if getContainer(p) in ids]
+    if boundbox:
+        scaling = importIFCHelper.getScaling(ifcfile)
+        result = []
+        for p in products:
+            bb = getBoundBox(p, scaling)
+            if bb is None:
+                msg = "Unsupported placement, not filtered: " + p.GlobalId + "\n"
+                FreeCAD.Console.PrintWarning(msg)
+                result.append(p)
+            elif boundbox.intersect(bb):
+                result.append(p)
+        products = result
+    return products
+
+
+def setFilters(doc, classes=None, containers=None, guids=None, boundbox=None):
+    """stores the filters of an import in the document, so an update
+    applies the same ones. See insert() for their meaning"""
+
+    filters = {}
+    if classes:
+        filters["classes"] = list(classes)
+    if containers:
+        filters["containers"] = list(containers)
+    if guids:
+        filters["guids"] = list(guids)
+    if boundbox:
+        bb = boundbox
+        filters["boundbox"] = [bb.XMin, bb.YMin, bb.ZMin, bb.XMax, bb.YMax, bb.ZMax]
+    m = doc.Meta
+    if filters:
+        m["IfcImportFilters"] = json.dumps(filters)
+    elif "IfcImportFilters" in m:
+        del m["IfcImportFilters"]
+    doc.Meta = m
+
+
+def getFilters(doc):
+    """returns the filters stored by setFilters() as a dict of
+    filterProducts() arguments"""
+
+    if not "IfcImportFilters" in doc.Meta:
+        return {}
+    filters = json.loads(doc.Meta["IfcImportFilters"])
+    if "boundbox" in filters:
+        filters["boundbox"] = FreeCAD.BoundBox(*filters["boundbox"])
+    return filters
+
+
+def getSpatialChildren(element):
+    """returns a spatial element and all the spatial elements it contains"""
+
+    children = [element]
+    for rel in getattr(element, "IsDecomposedBy", []) or []:
+        for child in rel.RelatedObjects:
+            if child.is_a("IfcSpatialStructureElement"):
+                children.extend(getSpatialChildren(child))
+    return children
+
+
+def getBoundBox(ifcproduct, scaling):
+    """returns an approximate bounding box of an IFC product, in mm, without
+    computing its geometry: its Box representation if any, or the origin
+    point of its placement. Returns None if the placement is not supported,
+    ex. IfcGridPlacement"""
+
+    pl = FreeCAD.Placement()
+    if ifcproduct.ObjectPlacement:
+        pl = importIFCHelper.getPlacement(ifcproduct.ObjectPlacement, scaling)
+        if pl is None:
+            return None
+    bb = FreeCAD.BoundBox()
+    bb.add(pl.Base)
+    if ifcproduct.Representation:
+        for rep in ifcproduct.Representation.Representations:
+            for item in rep.Items:
+                if item.is_a("IfcBoundingBox"):
+                    corner = importIFCHelper.getVector(item.Corner, scaling)
+                    dims = [item.XDim, item.YDim, item.ZDim]
+                    dims = [d * scaling for d in dims]
+                    for x in [0, dims[0]]:
+                        for y in [0, dims[1]]:
+                            for z in [0, dims[2]]:
+                                v = corner.add(FreeCAD.Vector(x, y, z))
+                                bb.add(pl.multVec(v))
+    return bb
+
+
+def getContainer(ifcproduct):
+    """returns the id of the spatial container of an IFC product, or None"""
+
+    obj = ifcproduct
+    while obj:
+        for container in getRelated("containers", obj):
+            return container.id()
+        parent = None
+        for parent in getRelated("aggregates", obj):
+            break
+        if parent and parent.is_a("IfcSpatialStructureElement"):
+            return parent.id()
+        obj = parent
+    return None
+
+
+def createProducts(batch):
+    """creates Arch objects from a list of (ifcproduct, shape) tuples"""
+
+    return [createProduct(ifcproduct, shape) for ifcproduct, shape in batch]
+
+
+def getInstances(ifcfile, products):
+    """returns a {product id: (product, base product)} dict of products
+    that share the same mapped representation (IfcRepresentationMap) with
+    a first, base product. Only the base products need their geometry
+    computed, the others can be created as clones"""
+
+    groups = {}
+    for ifcproduct in products:
+        key = getMappingKey(ifcfile, ifcproduct)
+        if key:
+            groups.setdefault(key, []).append(ifcproduct)
+    instances = {}
+    for group in groups.values():
+        for ifcproduct in group[1:]:
+            instances[ifcproduct.id()] = (ifcproduct, group[0])
+    return instances
+
+
+def getMappingKey(ifcfile, ifcproduct):
+    """returns a key identifying the shape of an IFC product if its body
+    is made of a single mapped item, or None. Products with the same key
+    only differ by their placement"""
+
+    if not ifcproduct.Representation or not ifcproduct.ObjectPlacement:
+        return None
+    if ifcproduct.is_a("IfcSpace") or getattr(ifcproduct, "HasOpenings", None):
+        return None
+    items = []
+    for rep in ifcproduct.Representation.Representations:
+        if rep.RepresentationIdentifier == "Body":
+            items.extend(rep.Items)
+    if (len(items) != 1) or (not items[0].is_a("IfcMappedItem")):
+        return None
+    key = [str(items[0].MappingSource.id())]
+    target = items[0].MappingTarget
+    key.append(BimIfcCache.getEntitiesHash(ifcfile, [target], entityhashes))
+    key.extend([str(m.id()) for m in getRelated("materials", ifcproduct)])
+    return ";".join(key)
+
+
+def createInstance(ifcproduct, baseobj, baseproduct, scaling):
+    """creates an Arch clone of the given base object for an IFC product
+    that shares its mapped representation"""
+
+    basepl = importIFCHelper.getPlacement(baseproduct.ObjectPlacement, scaling)
+    pl = importIFCHelper.getPlacement(ifcproduct.ObjectPlacement, scaling)
+    pl = pl.multiply(basepl.inverse())
+    obj = Arch.makeComponent()
+    obj.CloneOf = baseobj
+    shape = baseobj.Shape.copy(False)  # the geometry is shared, not copied
+    shape.Placement = pl.multiply(shape.Placement)
+    obj.Shape = shape
+    setData(obj, ifcproduct)
+    obj.purgeTouched()  # the shape is already correct, no need to recompute
+    return obj
+
+
+def createProduct(ifcproduct, shape):
+    """creates an Arch object from an IFC product and its Part shape"""
+
+    t = time.time()
     if ifcproduct.is_a("IfcSpace"):
         obj = Arch.makeSpace()
         # TODO Temp workaround against layer causing appearance change
@@ -216,17 +959,29 @@ def createProduct(ifcproduct, brep):
     else:
         obj = Arch.makeComponent()
     obj.Shape = shape
-    objects[ifcproduct.id()] = obj
-    setAttributes(obj, ifcproduct)
-    setProperties(obj, ifcproduct)
-    createLayer(obj, ifcproduct)
-    createMaterial(obj, ifcproduct)
-    createModelStructure(obj, ifcproduct)
-    setRelationships(obj, ifcproduct)
-    setColor(obj, ifcproduct)
+    addTiming("object creation", t, ifcproduct)
+    setData(obj, ifcproduct)
     return obj
 
 
+def setData(obj, ifcproduct):
+    """sets the IFC data and relationships of a newly created object"""
+
+    objects[ifcproduct.id()] = obj
+    for stage, func in [
+        ("attributes", setAttributes),
+        ("properties", setProperties),
+        ("layers", createLayer),
+        ("materials", createMaterial),
+        ("structure", createModelStructure),
+        ("relationships", setRelationships),
+        ("colors", setColor),
+    ]:
+        t = time.time()
+        func(obj, ifcproduct)
+        addTiming(stage, t, ifcproduct)
+
+
 def setAttributes(obj, ifcproduct):
     """sets the IFC attributes of a component"""
 
@@ -245,45 +1000,147 @@ def setAttributes(obj, ifcproduct):
                     pass
 
     # register IFC data
-    obj.addProperty("App::PropertyInteger", "IfcID", "IfcLink")
-    obj.addProperty("App::PropertyBool", "Modified", "IfcLink")
+    for prop, proptype in [
+        ("IfcID", "App::PropertyInteger"),
+        ("Modified", "App::PropertyBool"),
+        ("IfcHashes", "App::PropertyStringList"),
+        ("ShapeHashes", "App::PropertyStringList"),
+        ("GlobalId", "App::PropertyString"),
+    ]:
+        if not prop in obj.PropertiesList:
+            obj.addProperty(proptype, prop, "IfcLink")
+            obj.setEditorMode(prop, 2)
     obj.IfcID = ifcproduct.id()
+    obj.GlobalId = ifcproduct.GlobalId
     obj.Modified = False
-    obj.setEditorMode("IfcID", 2)
-    obj.setEditorMode("Modified", 2)
+    obj.IfcHashes = getHashes(ifcproduct)
+    if hasattr(obj, "Shape"):
+        obj.ShapeHashes = getShapeHashes(obj)
+
+
+def getHashes(ifcproduct):
+    """returns the attributes, properties and representation hashes
+    of an IFC product, used to detect changes on update"""
+
+    attrs = ifcproduct.get_info(recursive=False, include_identifier=False)
+    attrs = [
+        k + "=" + str(v)
+        for k, v in sorted(attrs.items())
+        if not hasattr(v, "is_a")
+        and not (isinstance(v, tuple) and v and hasattr(v[0], "is_a"))
+    ]
+    attrs = hashlib.md5(";".join(attrs).encode("utf8")).hexdigest()
+    defs = getRelated("psets", ifcproduct) + getRelated("materials", ifcproduct)
+    props = BimIfcCache.getEntitiesHash(ifcfile, defs, entityhashes)
+    rep = ""
+    if getattr(ifcproduct, "Representation", None):
+        if shapecache:
+            rep = shapecache.getHash(ifcproduct)  # shared with the cache key
+        else:
+            rep = BimIfcCache.getRepresentationHash(ifcfile, ifcproduct, entityhashes)
+    return [attrs, props, rep]
+
+
+def getShapeHashes(obj):
+    """returns a hash of the geometry of an object, its placement as a
+    string, and a hash of its label and description, used by the exporter
+    to detect objects modified in FreeCAD. Only cheap values are hashed:
+    the bounding box of the geometry and the number of its elements"""
+
+    shape = obj.Shape
+    geom = "0"
+    if not shape.isNull():
+        shape = shape.copy(False)  # shares the geometry
+        shape.Placement = FreeCAD.Placement()  # the placement is hashed apart
+        bb = shape.BoundBox
+        values = [bb.XMin, bb.YMin, bb.ZMin, bb.XMax, bb.YMax, bb.ZMax]
+        values = ["%.2f" % v for v in values] + [shape.ShapeType]
+        for element in ["Solid", "Face", "Edge", "Vertex"]:
+            if hasattr(shape, "countElement"):
+                values.append(str(shape.countElement(element)))
+            else:
+                values.append(str(len(getattr(shape, element + "s"))))
+        geom = ";".join(values)
+    geom = hashlib.md5(geom.encode("utf8")).hexdigest()
+    values = list(obj.Placement.Base) + list(obj.Placement.Rotation.Q)
+    attrs = obj.Label + ";" + getattr(obj, "Description", "")
+    attrs = hashlib.md5(attrs.encode("utf8")).hexdigest()
+    return [geom, ";".join(["%.6f" % v for v in values]), attrs]
+
+
+def setContainerHashes():
+    """stores again the shape hashes of the containers, whose shape is only
+    made of their children at recompute, after setAttributes() has hashed
+    their empty shape"""
+
+    for obj in objects.values():
+        if getattr(obj, "Group", None) and hasattr(obj, "Shape"):
+            obj.ShapeHashes = getShapeHashes(obj)
 
 
 def setProperties(obj, ifcproduct):
-    """sets the IFC properties of a component"""
+    """sets the IFC properties of a component. The names of the properties
+    set from IFC are kept in IfcPropertyNames, so the properties removed
+    from the IFC file can be removed on update"""
 
     props = obj.IfcProperties
-    for prel in ifcproduct.IsDefinedBy:
-        if prel.is_a("IfcRelDefinesByProperties"):
-            pset = prel.RelatingPropertyDefinition
-            if pset.is_a("IfcPropertySet"):
-                for prop in pset.HasProperties:
-                    if hasattr(prop, "NominalValue"):
-                        propname = cleanName(prop.Name)
-                        propgroup = cleanName(pset.Name)
-                        proptype, propvalue, ifctype = getPropertyValue(
-                            prop.NominalValue
-                        )
-                        # if pset.Name.startswith("Ifc"):
-                        if (PROPERTYMODE == "new") or (
-                            (PROPERTYMODE == "hybrid")
-                            and not (propgroup.lower().startswith("pset"))
-                        ):
-                            # creating FreeCAD property
-                            while propname in obj.PropertiesList:
-                                propname = propname + "_"
-                            obj.addProperty(proptype, propname, propgroup)
-                            setattr(obj, propname, propvalue)
-                        else:
-                            # storing in IfcProperties (0.20 behaviour)
-                            propname = propname + ";;" + propgroup
-                            propvalue = ifctype + ";;" + propvalue
-                            props[propname] = propvalue
+    done = []  # names of the properties set here
+    for pset in getRelated("psets", ifcproduct):
+        for propname, propgroup, proptype, propvalue, ifctype in getPset(pset):
+            # if pset.Name.startswith("Ifc"):
+            if (PROPERTYMODE == "new") or (
+                (PROPERTYMODE == "hybrid")
+                and not (propgroup.lower().startswith("pset"))
+            ):
+                # creating FreeCAD property, or reusing the existing one when
+                # updating. Names already taken by another group or by
+                # another IFC property of the same name once cleaned get a _
+                while (propname in obj.PropertiesList) and (
+                    obj.getGroupOfProperty(propname) != propgroup or propname in done
+                ):
+                    propname = propname + "_"
+                if not propname in obj.PropertiesList:
+                    obj.addProperty(proptype, propname, propgroup)
+                setattr(obj, propname, propvalue)
+            else:
+                # storing in IfcProperties (0.20 behaviour)
+                propname = propname + ";;" + propgroup
+                props[propname] = ifctype + ";;" + str(propvalue)
+            done.append(propname)
+
+    # remove the properties that are not in the IFC file anymore
+    for propname in getattr(obj, "IfcPropertyNames", []):
+        if propname in done:
+            continue
+        if propname in props:
+            del props[propname]
+        elif propname in obj.PropertiesList:
+            obj.removeProperty(propname)
     obj.IfcProperties = props
+    if done or hasattr(obj, "IfcPropertyNames"):
+        if not "IfcPropertyNames" in obj.PropertiesList:
+            obj.addProperty("App::PropertyStringList", "IfcPropertyNames", "IfcLink")
+            obj.setEditorMode("IfcPropertyNames", 2)
+        obj.IfcPropertyNames = done
+
+
+def getPset(pset):
+    """returns a list of (name, group, type, value, ifctype) tuples from
+    an IFC property set. Each property set is only parsed once"""
+
+    global psets
+
+    if not pset.id() in psets:
+        result = []
+        if pset.is_a("IfcPropertySet"):
+            for prop in pset.HasProperties:
+                if hasattr(prop, "NominalValue"):
+                    propname = cleanName(prop.Name)
+                    propgroup = cleanName(pset.Name)
+                    proptype, propvalue, ifctype = getPropertyValue(prop.NominalValue)
+                    result.append((propname, propgroup, proptype, propvalue, ifctype))
+        psets[pset.id()] = result
+    return psets[pset.id()]
 
 
 def cleanName(txt):
@@ -338,7 +1195,7 @@ def createLayer(obj, ifcproduct):
 
     if ifcproduct.Representation:
         for rep in ifcproduct.Representation.Representations:
-            for layer in rep.LayerAssignments:
+            for layer in getRelated("layers", rep):
                 if not layer.id() in layers:
                     l = Draft.make_layer(layer.Name)
                     # TODO: read layer properties
@@ -346,7 +1203,7 @@ def createLayer(obj, ifcproduct):
                         l.ViewObject.OverrideLineColorChildren = False
                         l.ViewObject.OverrideShapeColorChildren = False
                     layers[layer.id()] = l
-                layers[layer.id()].Proxy.addObject(layers[layer.id()], obj)
+                addToGroup(layers[layer.id()], obj)
 
 
 def createMaterial(obj, ifcproduct):
@@ -354,18 +1211,14 @@ def createMaterial(obj, ifcproduct):
 
     global materials
 
-    for association in ifcproduct.HasAssociations:
-        if association.is_a("IfcRelAssociatesMaterial"):
-            material = association.RelatingMaterial
-            if material.is_a("IfcMaterialList"):
-                material = material.Materials[0]  # take the first one for now...
-            if material.is_a("IfcMaterial"):
-                if not material.id() in materials:
-                    color = importIFCHelper.getColorFromMaterial(material)
-                    materials[material.id()] = Arch.makeMaterial(
-                        material.Name, color=color
-                    )
-                obj.Material = materials[material.id()]
+    for material in getRelated("materials", ifcproduct):
+        if material.is_a("IfcMaterialList"):
+            material = material.Materials[0]  # take the first one for now...
+        if material.is_a("IfcMaterial"):
+            if not material.id() in materials:
+                color = importIFCHelper.getColorFromMaterial(material)
+                materials[material.id()] = Arch.makeMaterial(material.Name, color=color)
+            obj.Material = materials[material.id()]
 
 
 def createModelStructure(obj, ifcobj):
@@ -373,7 +1226,7 @@ def createModelStructure(obj, ifcobj):
 
     global objects
 
-    for parent in importIFCHelper.getParents(ifcobj):
+    for parent in getParents(ifcobj):
         if not parent.id() in objects:
             if parent.is_a("IfcProject"):
                 parentobj = Arch.makeProject()
@@ -386,7 +1239,7 @@ def createModelStructure(obj, ifcobj):
             createModelStructure(parentobj, parent)
             objects[parent.id()] = parentobj
         if hasattr(objects[parent.id()].Proxy, "addObject"):
-            objects[parent.id()].Proxy.addObject(objects[parent.id()], obj)
+            addToGroup(objects[parent.id()], obj)
 
 
 def setRelationships(obj, ifcobj):
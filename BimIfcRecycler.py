@@ -0,0 +1,213 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+"""Entity recycler for the BIM IFC exporter.
+
+Small entities that are often identical (points, directions, placements,
+colors, styles) are looked up in hash tables before being
+created, so each distinct one is written only once. Coordinates are
+quantized with a tolerance, so values that differ only by floating-point
+noise are also merged. The tables can be filled from the entities already
+present in the file, or only from the ones used by some products, so a
+re-export reuses the existing instances.
+"""
+
+
+TOLERANCE = 1e-6  # coordinates closer than this (in file units) are merged
+SEEDTYPES = [
+    "IfcCartesianPoint",
+    "IfcDirection",
+    "IfcAxis2Placement3D",
+    "IfcLocalPlacement",
+    "IfcColourRgb",
+]  # the types added to the tables by seed()
+
+
+class Recycler:
+
+    """Creates IFC entities, reusing identical existing ones"""
+
+    def __init__(self, ifcfile, seed=False, tolerance=TOLERANCE):
+        """if seed is True, the recyclable entities already in the
+        file are added to the tables"""
+
+        self.file = ifcfile
+        self.tolerance = tolerance
+        self.created = []  # new entities, in creation order
+        self.tables = {}  # ifctype : {key : entity}
+        self.stats = {}  # ifctype : [hits, misses]
+        self.hits = 0
+        self.misses = 0
+        if seed:
+            self.seed()
+
+    def seed(self, entities=None):
+        """adds recyclable entities to the tables: the given entities and
+        all the entities they reference, or, if None, all the recyclable
+        entities of the file"""
+
+        if entities is None:
+            for ifctype in SEEDTYPES:
+                for entity in self.file.by_type(ifctype):
+                    self.seedEntity(entity)
+            return
+        done = set()
+        for entity in entities:
+            for child in self.file.traverse(entity):
+                if child.id() and not child.id() in done:
+                    done.add(child.id())
+                    if child.is_a() in SEEDTYPES:
+                        self.seedEntity(child)
+
+    def seedEntity(self, entity):
+        """adds an entity of one of the SEEDTYPES to the tables"""
+
+        key = self.getEntityKey(entity)
+        if key is not None:
+            self.store(entity.is_a(), key, entity)
+
+    def getEntityKey(self, entity):
+        """returns the table key of an entity of one of the SEEDTYPES,
+        or None for other types"""
+
+        ifctype = entity.is_a()
+        if ifctype == "IfcCartesianPoint":
+            return self.getCoordsKey(entity.Coordinates)
+        elif ifctype == "IfcDirection":
+            return self.getCoordsKey(entity.DirectionRatios)
+        elif ifctype == "IfcAxis2Placement3D":
+            return self.getRefsKey(entity.Location, entity.Axis, entity.RefDirection)
+        elif ifctype == "IfcLocalPlacement":
+            return self.getRefsKey(entity.PlacementRelTo, entity.RelativePlacement)
+        elif ifctype == "IfcColourRgb":
+            color = [entity.Red, entity.Green, entity.Blue]
+            return (entity.Name,) + self.getCoordsKey(color)
+        return None
+
+    def modify(self, entity, **attributes):
+        """changes attributes of an existing entity, and moves it to its
+        new key, so it is not reused for its former values"""
+
+        key = self.getEntityKey(entity)
+        table = self.tables.get(entity.is_a(), {})
+        if key is not None and table.get(key) == entity:
+            del table[key]
+        for name, value in attributes.items():
+            setattr(entity, name, value)
+        self.seedEntity(entity)
+
+    def getCoordsKey(self, values):
+        """returns a hashable key for a list of floats, with tolerance"""
+
+        return tuple([int(round(v / self.tolerance)) for v in values])
+
+    def getRefsKey(self, *entities):
+        """returns a hashable key for a list of entities or None"""
+
+        return tuple([e.id() if e else 0 for e in entities])
+
+    def store(self, ifctype, key, entity):
+        """adds an entity to the table of its type, if not there yet"""
+
+        table = self.tables.setdefault(ifctype, {})
+        if not key in table:
+            table[key] = entity
+
+    def get(self, ifctype, key, *args):
+        """returns the entity of the given type and key, or creates it
+        from the given arguments"""
+
+        table = self.tables.setdefault(ifctype, {})
+        stats = self.stats.setdefault(ifctype, [0, 0])
+        if key in table:
+            self.hits += 1
+            stats[0] += 1
+            return table[key]
+        self.misses += 1
+        stats[1] += 1
+        entity = self.create(ifctype, *args)
+        table[key] = entity
+        return entity
+
+    def create(self, ifctype, *args):
+        """creates a new entity, without recycling"""
+
+        entity = self.file.create_entity(ifctype, *args)
+        self.created.append(entity)
+        return entity
+
+    def createPoint(self, coords):
+        """returns an IfcCartesianPoint"""
+
+        coords = [float(c) for c in coords]
+        key = self.getCoordsKey(coords)
+        return self.get("IfcCartesianPoint", key, coords)
+
+    def createDirection(self, ratios):
+        """returns an IfcDirection"""
+
+        ratios = [float(r) for r in ratios]
+        key = self.getCoordsKey(ratios)
+        return self.get("IfcDirection", key, ratios)
+
+    def createAxis2Placement(self, location, axis=None, refdirection=None):
+        """returns an IfcAxis2Placement3D from a point and two directions"""
+
+        key = self.getRefsKey(location, axis, refdirection)
+        return self.get("IfcAxis2Placement3D", key, location, axis, refdirection)
+
+    def createLocalPlacement(self, relto, placement):
+        """returns an IfcLocalPlacement"""
+
+        key = self.getRefsKey(relto, placement)
+        return self.get("IfcLocalPlacement", key, relto, placement)
+
+    def createColor(self, color, name=None):
+        """returns an IfcColourRgb from a (r, g, b) tuple of 0-1 floats"""
+
+        color = [float(c) for c in color[:3]]
+        key = (name,) + self.getCoordsKey(color)
+        return self.get("IfcColourRgb", key, name, *color)
+
+    def createSurfaceStyle(self, color, transparency=0, name=None):
+        """returns an IfcSurfaceStyle of the given color and transparency"""
+
+        colour = self.createColor(color)
+        key = (name, colour.id(), round(transparency, 2))
+        table = self.tables.setdefault("IfcSurfaceStyle", {})
+        if key in table:
+            return self.get("IfcSurfaceStyle", key)
+        if self.file.schema == "IFC2X3":
+            shading = self.create("IfcSurfaceStyleShading", colour)
+        else:
+            shading = self.create("IfcSurfaceStyleShading", colour, transparency)
+        return self.get("IfcSurfaceStyle", key, name, "BOTH", [shading])
+
+    def createStyledItem(self, item, style):
+        """returns an IfcStyledItem applying a surface style to an item"""
+
+        styles = [style]
+        if self.file.schema == "IFC2X3":
+            # one assignment per style, shared by all the items using it
+            key = self.getRefsKey(style)
+            styles = [self.get("IfcPresentationStyleAssignment", key, [style])]
+        key = self.getRefsKey(item, style)
+        return self.get("IfcStyledItem", key, item, styles, None)
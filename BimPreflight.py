@@ -24,6 +24,9 @@
 
 
 import os
+import time
+import json
+import hashlib
 import FreeCAD
 from BimTranslateUtils import *
 import importlib
@@ -49,6 +52,829 @@ tests = [
     "testTinyLines",
     "testRectangleProfileDef",
 ]
+MINLENGTH = 0.79376  # min 1/32", the smallest line size that Revit accepts
+TINYBINS = [0.01, 0.1, 0.25, 0.5]  # upper bounds of the tiny lines histogram
+PARALLEL = True  # run the geometry checks in other processes when possible
+CHUNKSIZE = 50  # number of shapes sent to a process at once
+MAXPENDING = 2  # batches waiting per process, the next ones are built later
+CACHE = True  # keep the verdicts of the cachedchecks in the document
+CHECKVERSION = "2"  # change to discard the cached verdicts of all documents
+EXCLUDETYPES = ["DraftText", "Material", "MaterialContainer", "WorkingPlaneProxy"]
+psetdefinitions = {}  # pset name : [property, type, property, type...]
+commonpsets = []  # IFC types that have a common pset, ex. "Building Storey"
+
+
+def getTargetObjects(objs):
+    """returns the objects the checks apply to, out of the given ones"""
+
+    import Draft
+    import Arch
+
+    # classify everything in one pass instead of one list per filter
+    objs = Draft.get_group_contents(objs, walls=True, addgroups=True)
+    result = []
+    for obj in objs:
+        if obj.isDerivedFrom("Part::Part2DObject"):
+            continue
+        if obj.isDerivedFrom("App::Annotation"):
+            continue
+        shape = getattr(obj, "Shape", None)
+        if not shape or (shape.Edges and not shape.Faces):
+            continue
+        result.append(obj)
+    result = Arch.pruneIncluded(result)
+    return [
+        obj
+        for obj in result
+        if not obj.isDerivedFrom("App::DocumentObjectGroup")
+        and Draft.getType(obj) not in EXCLUDETYPES
+    ]
+
+
+def getPsetDefinitions():
+    """returns the common property sets definitions, read only once"""
+
+    import csv
+
+    if not psetdefinitions:
+        psetspath = os.path.join(
+            FreeCAD.getResourceDir(), "Mod", "Arch", "Presets", "pset_definitions.csv"
+        )
+        if os.path.exists(psetspath):
+            with open(psetspath, "r") as csvfile:
+                reader = csv.reader(csvfile, delimiter=";")
+                for row in reader:
+                    if "Common" in row[0]:
+                        psetdefinitions[row[0]] = row[1:]
+    return psetdefinitions
+
+
+def getCommonPsets():
+    """returns the IFC types that have a common property set"""
+
+    if not commonpsets:
+        for pset in getPsetDefinitions():
+            name = pset[5:-6]
+            name = "".join(map(lambda x: x if x.islower() else " " + x, name))
+            commonpsets.append(name.strip())
+    return commonpsets
+
+
+def isRole(obj, role, drafttype=False):
+    """returns True if the IFC type or role of an object is the given one,
+    or its Draft type if drafttype is True"""
+
+    import Draft
+
+    if drafttype and Draft.getType(obj) == role:
+        return True
+    if getattr(obj, "IfcRole", None) == role:
+        return True
+    return getattr(obj, "IfcType", None) == role
+
+
+# Checks. Each one is given an object and returns None if the object passes,
+# or a verdict (a string or a list) describing why it fails. Checks must not
+# touch the GUI, so they can run without it
+
+
+def checkSites(obj):
+    """checks that buildings are inside a site"""
+
+    if isRole(obj, "Building", True):
+        for parent in obj.InList:
+            if isRole(parent, "Site", True):
+                if hasattr(parent, "Group") and parent.Group:
+                    if obj in parent.Group:
+                        return None
+        return "not in a site"
+    return None
+
+
+def checkBuildings(obj):
+    """checks that storeys are inside a building"""
+
+    if isRole(obj, "Building Storey"):
+        for parent in obj.InList:
+            if isRole(parent, "Building"):
+                if hasattr(parent, "Group") and parent.Group:
+                    if obj in parent.Group:
+                        return None
+        return "not in a building"
+    return None
+
+
+def checkStoreys(obj):
+    """checks that BIM objects are inside a storey"""
+
+    spatial = ["Building", "Building Storey", "Site"]
+    if (hasattr(obj, "IfcRole") and (not obj.IfcRole in spatial)) or (
+        hasattr(obj, "IfcType") and (not obj.IfcType in spatial)
+    ):
+        for parent in obj.InListRecursive:
+            # just check if any of the ancestors is a Building Storey for now
+            if isRole(parent, "Building Storey"):
+                return None
+        return "not in a building storey"
+    return None
+
+
+def checkUndefined(obj):
+    """checks that objects are BIM objects of a defined type"""
+
+    if hasattr(obj, "IfcType"):
+        if obj.IfcType == "Undefined":
+            return "undefined"
+    elif hasattr(obj, "IfcRole"):
+        if obj.IfcRole == "Undefined":
+            return "undefined"
+    else:
+        return "not BIM"
+    return None
+
+
+def checkSolid(obj):
+    """checks that shapes are valid solids"""
+
+    if obj.isDerivedFrom("Part::Feature") and not obj.Shape.isNull():
+        return checkShapeSolid(obj.Shape)
+    return None
+
+
+def checkShapeSolid(shape):
+    """checks that a shape is a valid solid"""
+
+    if not shape.isValid():
+        return "invalid"
+    if not shape.Solids:
+        return "not solid"
+    return None
+
+
+def checkQuantities(obj):
+    """checks that dimensions are exported as quantities"""
+
+    import Draft
+
+    if hasattr(obj, "IfcAttributes") and (Draft.getType(obj) != "BuildingPart"):
+        for prop in ["Length", "Width", "Height"]:
+            if prop in obj.PropertiesList:
+                if (not "Export" + prop in obj.IfcAttributes) or (
+                    obj.IfcAttributes["Export" + prop] == "False"
+                ):
+                    return prop
+    return None
+
+
+def checkCommonPsets(obj):
+    """checks that typed objects have their common property set"""
+
+    if hasattr(obj, "IfcProperties") and isinstance(obj.IfcProperties, dict):
+        r = None
+        if hasattr(obj, "IfcType"):
+            r = obj.IfcType
+        if hasattr(obj, "IfcRole"):
+            r = obj.IfcRole
+        if r and (r in getCommonPsets()):
+            pset = "Pset_" + r.replace(" ", "") + "Common"
+            if not pset in ",".join(obj.IfcProperties.values()):
+                return pset
+    return None
+
+
+def checkPsets(obj):
+    """checks that common property sets have all their properties"""
+
+    if hasattr(obj, "IfcProperties") and isinstance(obj.IfcProperties, dict):
+        r = None
+        if hasattr(obj, "IfcType"):
+            r = obj.IfcType
+        elif hasattr(obj, "IfcRole"):
+            r = obj.IfcRole
+        if r and (r != "Undefined"):
+            psets = getPsetDefinitions()
+            found = None
+            for pset in psets.keys():
+                for val in obj.IfcProperties.values():
+                    if pset in val:
+                        found = pset
+                        break
+            if found:
+                for i in range(int(len(psets[found]) / 2)):
+                    p = psets[found][i * 2]
+                    t = psets[found][i * 2 + 1]
+                    if p in obj.IfcProperties:
+                        if (not found in obj.IfcProperties[p]) or (
+                            not t in obj.IfcProperties[p]
+                        ):
+                            return found
+                    else:
+                        return found
+    return None
+
+
+def checkMaterials(obj):
+    """checks that objects have a material"""
+
+    if "Material" in obj.PropertiesList:
+        if not obj.Material:
+            return "no material"
+    return None
+
+
+def checkStandards(obj):
+    """checks that objects and their material have a standard code.
+    Returns the names of the failing objects"""
+
+    names = []
+    if "StandardCode" in obj.PropertiesList:
+        if not obj.StandardCode:
+            names.append(obj.Name)
+    if "Material" in obj.PropertiesList:
+        if obj.Material:
+            if "StandardCode" in obj.Material.PropertiesList:
+                if not obj.Material.StandardCode:
+                    names.append(obj.Material.Name)
+    return names or None
+
+
+def checkExtrusions(obj):
+    """checks that objects are exported as extrusions"""
+
+    if hasattr(obj, "Proxy"):
+        if (
+            hasattr(obj, "IfcAttributes")
+            and ("FlagForceBrep" in obj.IfcAttributes.keys())
+            and (obj.IfcAttributes["FlagForceBrep"] == "True")
+        ):
+            return "forced brep"
+        elif hasattr(obj.Proxy, "getExtrusionData") and not obj.Proxy.getExtrusionData(
+            obj
+        ):
+            return "not an extrusion"
+    elif obj.isDerivedFrom("Part::Extrusion"):
+        pass
+    elif obj.isDerivedFrom("App::DocumentObjectGroup"):
+        pass
+    elif obj.isDerivedFrom("App::MaterialObject"):
+        pass
+    else:
+        return "not an extrusion"
+    return None
+
+
+def checkStandardCases(obj):
+    """checks that walls and structures are standard cases"""
+
+    import Draft
+
+    if Draft.getType(obj) == "Wall":
+        if obj.Base and (len(obj.Base.Shape.Edges) != 1):
+            return "base is not a single line"
+    elif Draft.getType(obj) == "Structure":
+        if obj.Base and (
+            (len(obj.Base.Shape.Wires) != 1) or (not obj.Base.Shape.Wires[0].isClosed())
+        ):
+            return "base is not a single closed wire"
+    return None
+
+
+def checkTinyLines(obj):
+    """checks that shapes have no edge shorter than MINLENGTH. Returns
+    the number of tiny edges and their histogram"""
+
+    if obj.isDerivedFrom("Part::Feature") and obj.Shape:
+        return checkShapeTinyLines(obj.Shape)
+    return None
+
+
+def checkShapeTinyLines(shape):
+    """checks that a shape has no edge shorter than MINLENGTH. Returns the
+    number of tiny edges and their histogram (see getTinyLines). Only the
+    counts are returned, so cached verdicts stay small"""
+
+    # Part has no call returning all the edge lengths at once, so they are
+    # read one edge at a time, and the shape is searched only once
+    indices, histogram = getTinyLines([e.Length for e in shape.Edges])
+    if indices:
+        return {"count": len(indices), "histogram": histogram}
+    return None
+
+
+def getTinyEdges(shape):
+    """returns the edges of a shape shorter than MINLENGTH"""
+
+    edges = shape.Edges
+    indices, histogram = getTinyLines([e.Length for e in edges])
+    return [edges[i] for i in indices]
+
+
+def getTinyLines(lengths):
+    """returns the indices of the lengths up to MINLENGTH, and a histogram
+    of them: the number of lengths up to each of TINYBINS, then up to
+    MINLENGTH"""
+
+    import bisect
+
+    bounds = TINYBINS + [MINLENGTH]
+    indices = [i for i, length in enumerate(lengths) if length <= MINLENGTH]
+    histogram = [0] * len(bounds)
+    for i in indices:
+        histogram[bisect.bisect_left(bounds, lengths[i])] += 1
+    return indices, histogram
+
+
+checks = {
+    "testSites": checkSites,
+    "testBuildings": checkBuildings,
+    "testStoreys": checkStoreys,
+    "testUndefined": checkUndefined,
+    "testSolid": checkSolid,
+    "testQuantities": checkQuantities,
+    "testCommonPsets": checkCommonPsets,
+    "testPsets": checkPsets,
+    "testMaterials": checkMaterials,
+    "testStandards": checkStandards,
+    "testExtrusions": checkExtrusions,
+    "testStandardCases": checkStandardCases,
+    "testTinyLines": checkTinyLines,
+}
+
+
+# Checks of the whole model. Each one is given the list of objects and
+# returns None if the model passes, or a verdict describing why it fails
+
+
+def checkHierarchy(objs):
+    """checks that the model has a site, a building and a building storey.
+    Returns the missing types"""
+
+    types = ["Site", "Building", "Building Storey"]
+    missing = list(types)
+    for obj in objs:
+        for t in types:
+            # only sites and buildings can be Draft types
+            if t in missing and isRole(obj, t, t != "Building Storey"):
+                missing.remove(t)
+        if not missing:
+            return None
+    return missing
+
+
+modelchecks = {
+    "testHierarchy": checkHierarchy,
+}
+
+
+# Checks of the setup. They take no argument, and return None if the setup
+# passes, or a text describing why it fails
+
+
+def checkIFC4():
+    """checks that ifcopenshell is available and writes IFC4"""
+
+    try:
+        import ifcopenshell
+    except ImportError:
+        return translate(
+            "BIM",
+            "ifcopenshell is not installed on your system or not available to FreeCAD. This library is responsible for IFC support in FreeCAD, and therefore IFC support is currently disabled. Check https://www.freecadweb.org/wiki/Extra_python_modules#IfcOpenShell to obtain more information.",
+        )
+    schema = getattr(ifcopenshell, "schema_identifier", "")
+    if schema.startswith("IFC4"):
+        return None
+    version = getattr(ifcopenshell, "version", "")
+    if version:
+        # prebuilt versions look like v0.7.0-<GIT_COMMIT_ID>
+        numbers = version.split("-")[0].strip("v").split(".")
+        try:
+            if [int(n) for n in numbers[:2]] >= [0, 6]:
+                return None
+        except ValueError:
+            return (
+                translate(
+                    "BIM",
+                    "The version of ifcopenshell installed on your system could not be parsed",
+                )
+                + ": "
+                + version
+            )
+    msg = (
+        translate(
+            "BIM",
+            "The version of ifcopenshell installed on your system will produce files with this schema version:",
+        )
+        + "\n\n"
+    )
+    return msg + (schema or "Unable to retrieve schemas information from ifcopenshell")
+
+
+def checkRectangleProfileDef():
+    """checks that IfcRectangleProfileDef export is disabled"""
+
+    p = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Arch")
+    if p.GetBool("DisableIfcRectangleProfileDef", False):
+        return None
+    return translate("BIM", "IfcRectangleProfileDef export is enabled")
+
+
+setupchecks = {
+    "testIFC4": checkIFC4,
+    "testRectangleProfileDef": checkRectangleProfileDef,
+}
+
+
+# checks that only need the shape of the objects, which can therefore
+# run on BREP strings in other processes
+shapechecks = {
+    "testSolid": checkShapeSolid,
+    "testTinyLines": checkShapeTinyLines,
+}
+
+
+# checks whose verdicts can be cached: the shape checks, and the checks
+# that depend on the shape and on the type and IFC attributes of objects
+cachedchecks = list(shapechecks) + ["testExtrusions"]
+
+
+def hasShape(obj):
+    """returns True if the shape checks apply to this object"""
+
+    return obj.isDerivedFrom("Part::Feature") and not obj.Shape.isNull()
+
+
+def checkBreps(args):
+    """runs a shape check on a list of BREP strings, and returns the list of
+    verdicts. args is a (test, [brep, ...]) tuple. Uses no document data,
+    so it can run in another process"""
+
+    import Part
+
+    test, breps = args
+    verdicts = []
+    for brep in breps:
+        shape = Part.Shape()
+        shape.importBrepFromString(brep)
+        try:
+            verdicts.append(shapechecks[test](shape))
+        except Exception as e:
+            verdicts.append("error: " + str(e))
+    return verdicts
+
+
+def getExecutor():
+    """returns a process pool to run the shape checks, or None if the
+    checks must run in this process"""
+
+    import BimProcesses
+
+    if not PARALLEL:
+        return None
+    return BimProcesses.getExecutor(os.cpu_count() or 1)
+
+
+def submitBatches(executor, test, objs, futures, start=0):
+    """sends the BREP strings of objs, from the start index, in batches of
+    CHUNKSIZE to a process pool running a shape check, as long as fewer
+    than MAXPENDING batches per process are waiting. Each batch is freed
+    once sent. Appends the futures to the given list, and returns the index
+    of the next object to send"""
+
+    limit = MAXPENDING * (os.cpu_count() or 1)
+    while start < len(objs):
+        if len([f for f in futures if not f.done()]) >= limit:
+            break
+        batch = objs[start : start + CHUNKSIZE]
+        breps = [obj.Shape.exportBrepToString() for obj in batch]
+        futures.append(executor.submit(checkBreps, (test, breps)))
+        start += len(batch)
+    return start
+
+
+def runPoolCheck(executor, test, objs):
+    """runs a shape check on objects in a process pool, and returns the list
+    of verdicts, in the order of the objects"""
+
+    import concurrent.futures
+
+    futures = []
+    start = submitBatches(executor, test, objs, futures)
+    while start < len(objs):
+        waiting = [f for f in futures if not f.done()]
+        concurrent.futures.wait(waiting, return_when="FIRST_COMPLETED")
+        start = submitBatches(executor, test, objs, futures, start)
+    verdicts = []
+    for future in futures:
+        verdicts.extend(future.result())
+    return verdicts
+
+
+def getCustomTests():
+    """returns the custom tests found in the BIM/Preflight user folder, as
+    a list of (module name, [(test name, function), ...]) tuples"""
+
+    import sys
+
+    result = []
+    customModulePath = os.path.join(FreeCAD.getUserAppDataDir(), "BIM", "Preflight")
+    if not os.path.exists(customModulePath):
+        return result
+    customModules = [m[:-3] for m in os.listdir(customModulePath) if m.endswith(".py")]
+    if customModules and not customModulePath in sys.path:
+        sys.path.append(customModulePath)
+    for customModule in customModules:
+        mod = importlib.import_module(customModule)
+        if not "Preflight" in mod.__file__:
+            # prevent from using other modules with same name
+            FreeCAD.Console.PrintLog(
+                "Preflight: loaded wrong module - skipping: "
+                + customModule
+                + " "
+                + str(mod)
+                + "\n"
+            )
+            continue
+        FreeCAD.Console.PrintLog(
+            "Preflight: found custom module: " + customModule + " " + str(mod) + "\n"
+        )
+        functions = []
+        for funcname, func in inspect.getmembers(mod):
+            if inspect.isfunction(func):
+                FreeCAD.Console.PrintLog(
+                    "Preflight: found custom test: " + funcname + "\n"
+                )
+                functions.append(("Custom_" + customModule + "_" + funcname, func))
+        if functions:
+            result.append((customModule, functions))
+    return result
+
+
+def isVisitor(func):
+    """returns True if a custom test checks one object at a time. Other
+    custom tests take no argument and check the whole document"""
+
+    return len(inspect.signature(func).parameters) == 1
+
+
+def runChecks(objs, checklist, timings=None):
+    """runs a {test: check} dict over the objects in one single pass. Returns
+    a {test: [(object, verdict), ...]} dict of the failing objects, in
+    the order of the objects. A check returning True also passes, so
+    custom checks can use the same convention as custom tests. If a timings
+    dict is given, the time spent in each check is added to it"""
+
+    results = dict([(test, []) for test in checklist])
+    if timings is not None:
+        for test in checklist:
+            timings.setdefault(test, 0.0)
+    for obj in objs:
+        for test, check in checklist.items():
+            if timings is not None:
+                starttime = time.perf_counter()
+            try:
+                verdict = check(obj)
+            except Exception as e:
+                verdict = "error: " + str(e)
+            if timings is not None:
+                timings[test] += time.perf_counter() - starttime
+            if (verdict is not None) and (verdict is not True):
+                results[test].append((obj, verdict))
+    return results
+
+
+def runCachedChecks(objs, checklist, cache, timings=None, executor=None):
+    """like runChecks, but the cachedchecks are only run on the objects
+    that changed since the last run, and their verdicts are taken from the
+    given VerdictCache for the others. If a process pool is given, the
+    shape checks run in it"""
+
+    if cache:
+        tests = cachedchecks
+    else:
+        tests = shapechecks if executor else []
+    cached = dict([(t, c) for t, c in checklist.items() if t in tests])
+    others = dict([(t, c) for t, c in checklist.items() if not t in tests])
+    results = runChecks(objs, others, timings)
+    for test, check in cached.items():
+        if cache:
+            verdicts, dirty = cache.split(test, check, objs)
+        else:
+            verdicts, dirty = {}, [obj for obj in objs if hasShape(obj)]
+        failed = None
+        if executor and (test in shapechecks):
+            starttime = time.perf_counter()
+            try:
+                shapeverdicts = runPoolCheck(executor, test, dirty)
+            except Exception as e:
+                # the pool is broken, do this test and the next ones here
+                FreeCAD.Console.PrintWarning(
+                    "Preflight: process pool failed: " + str(e) + "\n"
+                )
+                executor = None
+            else:
+                failed = [
+                    (obj, verdict)
+                    for obj, verdict in zip(dirty, shapeverdicts)
+                    if (verdict is not None) and (verdict is not True)
+                ]
+                if timings is not None:
+                    timings[test] = time.perf_counter() - starttime
+        if failed is None:
+            failed = runChecks(dirty, {test: check}, timings)[test]
+        if cache:
+            verdicts.update(cache.update(test, dirty, failed))
+        else:
+            verdicts.update(dict([(obj.Name, v) for obj, v in failed]))
+        results[test] = [
+            (obj, verdicts[obj.Name]) for obj in objs if verdicts.get(obj.Name)
+        ]
+    return results
+
+
+class VerdictCache:
+
+    """The verdicts of the shape checks of a document, stored in its Meta
+    data or in a json file, with a token of the shape they were computed
+    on, so they can be reused as long as the shape doesn't change"""
+
+    def __init__(self, doc, filename=None):
+        """if a filename is given, the cache is stored in that json file
+        instead of the document"""
+
+        self.doc = doc
+        self.filename = filename
+        self.tables = {}  # test : {version, verdicts: {name : [token, verdict]}}
+        self.tokens = {}  # object name : token, computed once per run
+        self.hits = 0
+        self.misses = 0
+        data = self.read()
+        if data:
+            try:
+                self.tables = json.loads(data)
+            except ValueError:
+                self.tables = {}
+
+    def getVersion(self, check):
+        """returns the version of a check, which changes with its code, the
+        code of the functions of its module it calls, and the values of the
+        constants they use, such as MINLENGTH"""
+
+        data = [CHECKVERSION]
+        todo = [check.__code__]
+        done = []
+        while todo:
+            code = todo.pop()
+            if code in done:
+                continue
+            done.append(code)
+            data.append(code.co_code.hex())
+            for const in code.co_consts:
+                if inspect.iscode(const):
+                    todo.append(const)  # nested functions and comprehensions
+                else:
+                    data.append(repr(const))
+            for name in code.co_names:
+                value = check.__globals__.get(name)
+                if inspect.isfunction(value) and value.__module__ == __name__:
+                    todo.append(value.__code__)
+                elif isinstance(value, (bool, int, float, str, list, tuple)):
+                    data.append(name + "=" + repr(value))
+        digest = hashlib.md5("".join(data).encode("utf8")).hexdigest()
+        return CHECKVERSION + ":" + digest[:8]
+
+    def getToken(self, obj):
+        """returns a token of the shape of an object, that persists between
+        sessions and changes when the shape changes. Made of the numbers of
+        subshapes, the bounding box, and the total length of the edges, area
+        and volume at full precision, so it costs much less than the checks
+        but still changes when an edit keeps the bounding box"""
+
+        if not obj.Name in self.tokens:
+            shape = obj.Shape
+            values = [shape.countElement(t) for t in ["Vertex", "Edge", "Face"]]
+            values += [len(shape.Solids), shape.BoundBox]
+            values += [repr(shape.Length), repr(shape.Area), repr(shape.Volume)]
+            token = ";".join([str(v) for v in values])
+            self.tokens[obj.Name] = hashlib.md5(token.encode("utf8")).hexdigest()[:16]
+        return self.tokens[obj.Name]
+
+    def getKey(self, test, obj):
+        """returns the token an object's verdict of a test is stored with.
+        Checks that are not shape checks also depend on the type and IFC
+        attributes of the object"""
+
+        token = self.getToken(obj)
+        if test in shapechecks:
+            return token
+        import Draft
+
+        attributes = getattr(obj, "IfcAttributes", None) or {}
+        attributes = sorted(attributes.items())
+        return token + ";" + Draft.getType(obj) + ";" + str(attributes)
+
+    def clearTokens(self):
+        """forgets the tokens, when the shapes may have changed"""
+
+        self.tokens = {}
+
+    def split(self, test, check, objs):
+        """returns the cached verdicts of a check as a {name: verdict} dict,
+        and the list of objects to check again"""
+
+        version = self.getVersion(check)
+        table = self.tables.get(test)
+        if (not table) or (table.get("version") != version):
+            table = {"version": version, "verdicts": {}}
+            self.tables[test] = table
+        verdicts = {}
+        dirty = []
+        for obj in objs:
+            if not hasShape(obj):
+                if not test in shapechecks:
+                    dirty.append(obj)  # no token, always checked
+                continue  # shape checks always pass these
+            entry = table["verdicts"].get(obj.Name)
+            if entry and entry[0] == self.getKey(test, obj):
+                verdicts[obj.Name] = entry[1]
+                self.hits += 1
+            else:
+                dirty.append(obj)
+                self.misses += 1
+        return verdicts, dirty
+
+    def update(self, test, objs, failed):
+        """stores the verdicts of a check on the given objects, failed
+        being the list of failing (object, verdict) pairs. Returns the
+        verdicts as a {name: verdict} dict"""
+
+        verdicts = dict([(obj.Name, None) for obj in objs])
+        verdicts.update(dict([(obj.Name, verdict) for obj, verdict in failed]))
+        table = self.tables[test]["verdicts"]
+        for obj in objs:
+            if hasShape(obj):
+                table[obj.Name] = [self.getKey(test, obj), verdicts[obj.Name]]
+        return verdicts
+
+    def read(self):
+        """returns the cache data stored in the file or the document"""
+
+        if not self.filename:
+            return self.doc.Meta.get("BimPreflight")
+        try:
+            with open(self.filename, "r") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def save(self):
+        """writes the cache to the file or the document, without deleted
+        objects"""
+
+        names = set([obj.Name for obj in self.doc.Objects])
+        for table in self.tables.values():
+            for name in list(table["verdicts"].keys()):
+                if not name in names:
+                    del table["verdicts"][name]
+        data = json.dumps(self.tables, separators=(",", ":"))
+        self.clearTokens()
+        if self.read() == data:
+            return
+        if self.filename:
+            with open(self.filename, "w") as f:
+                f.write(data)
+        else:
+            meta = self.doc.Meta
+            meta["BimPreflight"] = data
+            self.doc.Meta = meta
+
+
+caches = {}  # document name : VerdictCache, see getCache()
+observer = []  # the CacheObserver, once added
+
+
+def getCache(doc):
+    """returns the verdicts cache of a document. It is kept for the session,
+    and written into the document only when it is saved, so running the
+    checks doesn't mark the document as modified"""
+
+    if not observer:
+        observer.append(CacheObserver())
+        FreeCAD.addDocumentObserver(observer[0])
+    if not doc.Name in caches:
+        caches[doc.Name] = VerdictCache(doc)
+    return caches[doc.Name]
+
+
+class CacheObserver:
+
+    """Writes the verdicts caches into the documents being saved"""
+
+    def slotStartSaveDocument(self, doc, filename):
+        if doc.Name in caches:
+            caches[doc.Name].save()
+
+    def slotDeletedDocument(self, doc):
+        caches.pop(doc.Name, None)
 
 
 class BIM_Preflight:
@@ -73,13 +899,21 @@ class BIM_Preflight:
 
 class BIM_Preflight_TaskPanel:
     def __init__(self):
-        import sys
         import FreeCADGui
         from PySide import QtCore, QtGui
 
         self.results = {}  # to store the result message
         self.culprits = {}  # to store objects to highlight
         self.rform = None  # to store the results dialog
+        self.verdicts = None  # to store the results of a single-pass run
+        self.snapshot = None  # to store the target objects during a run
+        self.executor = None  # to store the process pool of the shape checks
+        self.nopool = False  # True once the pool failed, for the panel's life
+        self.pending = {}  # test : [objs, dirty, {name : verdict}, [futures], sent]
+        self.cache = None  # to store the cached verdicts of the document
+        self.timer = QtCore.QTimer()
+        self.timer.setInterval(100)
+        self.timer.timeout.connect(self.poll)
         self.form = FreeCADGui.PySideUic.loadUi(
             os.path.join(os.path.dirname(__file__), "dialogPreflight.ui")
         )
@@ -100,61 +934,34 @@ class BIM_Preflight_TaskPanel:
 
         # setup custom tests
         self.customTests = {}
-        customModulePath = os.path.join(FreeCAD.getUserAppDataDir(), "BIM", "Preflight")
-        if os.path.exists(customModulePath):
-            customModules = [
-                m[:-3] for m in os.listdir(customModulePath) if m.endswith(".py")
-            ]
-            if customModules:
-                sys.path.append(customModulePath)
-                for customModule in customModules:
-                    mod = importlib.import_module(customModule)
-                    if not "Preflight" in mod.__file__:
-                        # prevent from using other modules with same name
-                        FreeCAD.Console.PrintLog(
-                            "Preflight: loaded wrong module - skipping: "
-                            + customModule
-                            + " "
-                            + str(mod)
-                            + "\n"
-                        )
-                        continue
-                    FreeCAD.Console.PrintLog(
-                        "Preflight: found custom module: "
-                        + customModule
-                        + " "
-                        + str(mod)
-                        + "\n"
-                    )
-                    functions = [
-                        o[0]
-                        for o in inspect.getmembers(mod)
-                        if inspect.isfunction(o[1])
-                    ]
-                    if functions:
-                        box = QtGui.QGroupBox(customModule)
-                        lay = QtGui.QGridLayout(box)
-                        self.form.layout().addWidget(box)
-                        for funcname in functions:
-                            FreeCAD.Console.PrintLog(
-                                "Preflight: found custom test: " + funcname + "\n"
-                            )
-                            func = getattr(mod, funcname)
-                            descr = func.__doc__
-                            if not descr:
-                                descr = "Undefined"
-                            lab = QtGui.QLabel(descr)
-                            lab.setWordWrap(True)
-                            but = QtGui.QPushButton()
-                            butname = "Custom_" + customModule + "_" + funcname
-                            but.setObjectName(butname)
-                            setattr(self.form, butname, but)
-                            self.reset(butname)
-                            row = lay.rowCount()
-                            lay.addWidget(lab, row, 0)
-                            lay.addWidget(but, row, 1)
-                            but.clicked.connect(lambda: self.testCustom(butname))
-                            self.customTests[butname] = func
+        self.customVisitors = {}  # custom tests that check one object
+        for customModule, functions in getCustomTests():
+            box = QtGui.QGroupBox(customModule)
+            box.setToolTip(
+                translate(
+                    "BIM",
+                    "Custom tests found in the BIM/Preflight folder of the user data folder. A test function that takes one argument is run on each object, and returns None or True if the object passes, or a text describing why it fails. A test function without argument checks the whole model, and returns True if it passes, or a text describing why it fails.",
+                )
+            )
+            lay = QtGui.QGridLayout(box)
+            self.form.layout().addWidget(box)
+            for butname, func in functions:
+                descr = func.__doc__
+                if not descr:
+                    descr = "Undefined"
+                lab = QtGui.QLabel(descr)
+                lab.setWordWrap(True)
+                but = QtGui.QPushButton()
+                but.setObjectName(butname)
+                setattr(self.form, butname, but)
+                self.reset(butname)
+                row = lay.rowCount()
+                lay.addWidget(lab, row, 0)
+                lay.addWidget(but, row, 1)
+                but.clicked.connect(lambda checked=False, n=butname: self.testCustom(n))
+                self.customTests[butname] = func
+                if isVisitor(func):
+                    self.customVisitors[butname] = func
 
     def getStandardButtons(self):
         from PySide import QtCore, QtGui
@@ -166,6 +973,13 @@ class BIM_Preflight_TaskPanel:
         from PySide import QtCore, QtGui
 
         QtGui.QApplication.restoreOverrideCursor()
+        self.timer.stop()
+        if self.executor:
+            for objs, dirty, cached, futures, sent in self.pending.values():
+                for future in futures:
+                    future.cancel()
+            self.executor.shutdown(wait=False)
+            self.executor = None
         FreeCADGui.Control.closeDialog()
         FreeCAD.ActiveDocument.recompute()
 
@@ -247,9 +1061,9 @@ class BIM_Preflight_TaskPanel:
         "selects target objects"
 
         import FreeCADGui
-        import Draft
-        import Arch
 
+        if self.snapshot is not None:
+            return self.snapshot
         objs = []
         if self.form.getAll.isChecked():
             objs = FreeCAD.ActiveDocument.Objects
@@ -261,30 +1075,7 @@ class BIM_Preflight_TaskPanel:
             ]
         else:
             objs = FreeCADGui.Selection.getSelection()
-        # clean objects list of unwanted types
-        objs = Draft.get_group_contents(objs, walls=True, addgroups=True)
-        objs = [obj for obj in objs if not obj.isDerivedFrom("Part::Part2DObject")]
-        objs = [obj for obj in objs if not obj.isDerivedFrom("App::Annotation")]
-        objs = [
-            obj
-            for obj in objs
-            if (
-                hasattr(obj, "Shape")
-                and obj.Shape
-                and not (obj.Shape.Edges and (not obj.Shape.Faces))
-            )
-        ]
-        objs = Arch.pruneIncluded(objs)
-        objs = [
-            obj for obj in objs if not obj.isDerivedFrom("App::DocumentObjectGroup")
-        ]
-        objs = [
-            obj
-            for obj in objs
-            if Draft.getType(obj)
-            not in ["DraftText", "Material", "MaterialContainer", "WorkingPlaneProxy"]
-        ]
-        return objs
+        return getTargetObjects(objs)
 
     def getToolTip(self, test):
         "gets the toolTip text from the ui file"
@@ -297,21 +1088,157 @@ class BIM_Preflight_TaskPanel:
         tooltip = re.sub("<.*?>", "", tooltip)  # strip html tags
         return tooltip
 
+    def getVerdicts(self, test):
+        "returns the failing (object, verdict) pairs of a test"
+
+        if self.verdicts is not None and test in self.verdicts:
+            # computed by testAll, in the same pass as the other tests
+            return self.verdicts[test]
+        if test in checks:
+            check = checks[test]
+        else:
+            check = self.customVisitors[test]
+        return self.runChecks(self.getObjects(), {test: check})[test]
+
+    def getCache(self):
+        "returns the verdicts cache of the active document, or None"
+
+        if not CACHE:
+            return None
+        self.cache = getCache(FreeCAD.ActiveDocument)
+        if not self.pending:
+            self.cache.clearTokens()  # shapes may have changed since then
+        return self.cache
+
+    def runChecks(self, objs, checklist):
+        "runs checks on objects, reusing the cached verdicts if possible"
+
+        cache = self.getCache()
+        if not cache:
+            return runChecks(objs, checklist)
+        return runCachedChecks(objs, checklist, cache)
+
+    def getExecutor(self):
+        "returns the process pool of the shape checks, or None"
+
+        if not self.executor and not self.nopool:
+            self.executor = getExecutor()
+        return self.executor
+
+    def startShapeCheck(self, test):
+        """starts a shape check in the process pool. Returns False if the
+        check must run here instead"""
+
+        if self.verdicts is not None and test in self.verdicts:
+            return False
+        if test in self.pending:
+            return True
+        executor = self.getExecutor()
+        if not executor:
+            return False
+        objs = self.getObjects()
+        cache = self.getCache()
+        if cache:
+            # only the objects that changed since the last run are sent
+            cached, dirty = cache.split(test, checks[test], objs)
+        else:
+            cached, dirty = {}, [obj for obj in objs if hasShape(obj)]
+        # the next batches are sent by poll(), as the processes take them
+        futures = []
+        sent = submitBatches(executor, test, dirty, futures)
+        self.pending[test] = [objs, dirty, cached, futures, sent]
+        getattr(self.form, test).setText("0%")
+        self.timer.start()
+        return True
+
+    def poll(self):
+        "updates the buttons of the running shape checks"
+
+        for test in list(self.pending.keys()):
+            entry = self.pending[test]
+            objs, dirty, cached, futures, sent = entry
+            try:
+                if sent < len(dirty):
+                    entry[4] = submitBatches(self.executor, test, dirty, futures, sent)
+                done = len([f for f in futures if f.done()])
+                if (entry[4] < len(dirty)) or (done < len(futures)):
+                    batches = -(-len(dirty) // CHUNKSIZE)
+                    progress = int(100 * done / batches)
+                    getattr(self.form, test).setText(str(progress) + "%")
+                    continue
+                results = []
+                for future in futures:
+                    results.extend(future.result())
+            except Exception as e:
+                # the pool is broken, do this test and the next ones here
+                del self.pending[test]
+                FreeCAD.Console.PrintWarning(
+                    "Preflight: process pool failed: " + str(e) + "\n"
+                )
+                if self.executor:
+                    self.executor.shutdown(wait=False)
+                    self.executor = None
+                self.nopool = True
+                self.verdicts = self.runChecks(objs, {test: checks[test]})
+            else:
+                # verdicts come back in the order of the dirty objects
+                del self.pending[test]
+                failed = [
+                    (obj, verdict)
+                    for obj, verdict in zip(dirty, results)
+                    if (verdict is not None) and (verdict is not True)
+                ]
+                verdicts = dict(cached)
+                if self.cache:
+                    verdicts.update(self.cache.update(test, dirty, failed))
+                else:
+                    verdicts.update(dict([(o.Name, v) for o, v in failed]))
+                failed = [(o, verdicts[o.Name]) for o in objs if verdicts.get(o.Name)]
+                self.verdicts = {test: failed}
+            try:
+                self.reset(test)
+                getattr(self, test)()
+            finally:
+                self.verdicts = None
+        if not self.pending:
+            self.timer.stop()
+
     def testAll(self):
         "runs all tests"
 
         import FreeCADGui
         from PySide import QtCore, QtGui
-        from DraftGui import todo
 
         for test in tests:
             if test != "testAll":
-                QtGui.QApplication.processEvents()
                 self.reset(test)
-                if hasattr(self, test):
-                    todo.delay(getattr(self, test), None)
         for customTest in self.customTests.keys():
-            todo.delay(self.testCustom, customTest)
+            self.reset(customTest)
+        QtGui.QApplication.processEvents()
+
+        # collect the objects and run all the object checks once. The
+        # shape checks are left to the process pool, if there is one
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        checklist = dict(checks)
+        checklist.update(self.customVisitors)
+        if self.getExecutor():
+            for test in shapechecks:
+                del checklist[test]
+        try:
+            self.snapshot = self.getObjects()
+            self.verdicts = self.runChecks(self.snapshot, checklist)
+        finally:
+            QtGui.QApplication.restoreOverrideCursor()
+        try:
+            for test in tests:
+                if test != "testAll" and hasattr(self, test):
+                    getattr(self, test)()
+                    QtGui.QApplication.processEvents()
+            for customTest in self.customTests.keys():
+                self.testCustom(customTest)
+        finally:
+            self.verdicts = None
+            self.snapshot = None
         FreeCADGui.BIMPreflightDone = True
 
     def testIFC4(self):
@@ -325,66 +1252,17 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = None
             msg = None
-            try:
-                import ifcopenshell
-            except ImportError:
-                msg = (
-                    translate(
-                        "BIM",
-                        "ifcopenshell is not installed on your system or not available to FreeCAD. This library is responsible for IFC support in FreeCAD, and therefore IFC support is currently disabled. Check https://www.freecadweb.org/wiki/Extra_python_modules#IfcOpenShell to obtain more information.",
-                    )
-                    + " "
-                )
+            verdict = checkIFC4()
+            if verdict:
+                msg = self.getToolTip(test) + verdict + "\n\n"
                 self.failed(test)
             else:
-                if hasattr(
-                    ifcopenshell, "schema_identifier"
-                ) and ifcopenshell.schema_identifier.startswith("IFC4"):
-                    self.passed(test)
-                elif hasattr(ifcopenshell, "version"):
-                    try:
-                        from packaging import version
-                        cur_version = version.parse(ifcopenshell.version)
-                        min_version = version.parse("0.6")
-                        if type(cur_version) == version.LegacyVersion:
-                            # Prebuild version have a version like 'v0.7.0-<GIT_COMMIT_ID>,
-                            # trying to remove the commit id.
-                            cur_version = version.parse(ifcopenshell.version.split('-')[0])
-                        if cur_version >= min_version:
-                            self.passed(test)
-                        else:
-                            msg = self.getToolTip(test)
-                            msg = (
-                                translate(
-                                    "BIM",
-                                    "The version of ifcopenshell installed on your system could not be parsed",
-                                )
-                                + " "
-                            )
-                            self.failed(test)
-                    except Exception as e:
-                        self.failed(test)
-                else:
-                    msg = self.getToolTip(test)
-                    msg += (
-                        translate(
-                            "BIM",
-                            "The version of ifcopenshell installed on your system will produce files with this schema version:",
-                        )
-                        + "\n\n"
-                    )
-                    if hasattr(ifcopenshell, "schema_identifier"):
-                        msg += ifcopenshell.schema_identifier + "\n\n"
-                    else:
-                        msg += "Unable to retrieve schemas information from ifcopenshell\n\n"
-                    self.failed(test)
+                self.passed(test)
             self.results[test] = msg
 
     def testHierarchy(self):
         "tests for project hierarchy support"
 
-        import FreeCADGui
-        import Draft
         from PySide import QtCore, QtGui
 
         test = "testHierarchy"
@@ -396,27 +1274,8 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = []
             msg = None
-            sites = False
-            buildings = False
-            storeys = False
-            for obj in self.getObjects():
-                if (
-                    (Draft.getType(obj) == "Site")
-                    or (hasattr(obj, "IfcRole") and (obj.IfcRole == "Site"))
-                    or (hasattr(obj, "IfcType") and (obj.IfcType == "Site"))
-                ):
-                    sites = True
-                elif (
-                    (Draft.getType(obj) == "Building")
-                    or (hasattr(obj, "IfcRole") and (obj.IfcRole == "Building"))
-                    or (hasattr(obj, "IfcType") and (obj.IfcType == "Building"))
-                ):
-                    buildings = True
-                elif (
-                    hasattr(obj, "IfcRole") and (obj.IfcRole == "Building Storey")
-                ) or (hasattr(obj, "IfcType") and (obj.IfcType == "Building Storey")):
-                    storeys = True
-            if (not sites) or (not buildings) or (not storeys):
+            missing = checkHierarchy(self.getObjects())
+            if missing:
                 msg = self.getToolTip(test)
                 msg += (
                     translate(
@@ -424,12 +1283,8 @@ class BIM_Preflight_TaskPanel:
                     )
                     + "\n"
                 )
-                if not sites:
-                    msg += "\nSite"
-                if not buildings:
-                    msg += "\nBuilding"
-                if not storeys:
-                    msg += "\nBuilding Storey"
+                for t in missing:
+                    msg += "\n" + t
             if msg:
                 self.failed(test)
             else:
@@ -440,8 +1295,6 @@ class BIM_Preflight_TaskPanel:
     def testSites(self):
         "tests for Sites support"
 
-        import FreeCADGui
-        import Draft
         from PySide import QtCore, QtGui
 
         test = "testSites"
@@ -453,41 +1306,18 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = []
             msg = None
-            for obj in self.getObjects():
-                if (
-                    (Draft.getType(obj) == "Building")
-                    or (hasattr(obj, "IfcRole") and (obj.IfcRole == "Building"))
-                    or (hasattr(obj, "IfcType") and (obj.IfcType == "Building"))
-                ):
-                    ok = False
-                    for parent in obj.InList:
-                        if (
-                            (Draft.getType(parent) == "Site")
-                            or (
-                                hasattr(parent, "IfcRole")
-                                and (parent.IfcRole == "Site")
-                            )
-                            or (
-                                hasattr(parent, "IfcType")
-                                and (parent.IfcType == "Site")
-                            )
-                        ):
-                            if hasattr(parent, "Group") and parent.Group:
-                                if obj in parent.Group:
-                                    ok = True
-                                    break
-                    if not ok:
-                        self.culprits[test].append(obj)
-                        if not msg:
-                            msg = self.getToolTip(test)
-                            msg += (
-                                translate(
-                                    "BIM",
-                                    "The following Building objects have been found to not be included in any Site. You can resolve the situation by creating a Site object, if none is present in your model, and drag and drop the Building objects into it in the tree view:",
-                                )
-                                + "\n\n"
-                            )
-                        msg += obj.Label + "\n"
+            for obj, verdict in self.getVerdicts(test):
+                self.culprits[test].append(obj)
+                if not msg:
+                    msg = self.getToolTip(test)
+                    msg += (
+                        translate(
+                            "BIM",
+                            "The following Building objects have been found to not be included in any Site. You can resolve the situation by creating a Site object, if none is present in your model, and drag and drop the Building objects into it in the tree view:",
+                        )
+                        + "\n\n"
+                    )
+                msg += obj.Label + "\n"
             if msg:
                 self.failed(test)
             else:
@@ -509,35 +1339,18 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = []
             msg = None
-            for obj in self.getObjects():
-                if (hasattr(obj, "IfcRole") and (obj.IfcRole == "Building Storey")) or (
-                    hasattr(obj, "IfcType") and (obj.IfcType == "Building Storey")
-                ):
-                    ok = False
-                    for parent in obj.InList:
-                        if (
-                            hasattr(parent, "IfcRole")
-                            and (parent.IfcRole == "Building")
-                        ) or (
-                            hasattr(parent, "IfcType")
-                            and (parent.IfcType == "Building")
-                        ):
-                            if hasattr(parent, "Group") and parent.Group:
-                                if obj in parent.Group:
-                                    ok = True
-                                    break
-                    if not ok:
-                        self.culprits[test].append(obj)
-                        if not msg:
-                            msg = self.getToolTip(test)
-                            msg += (
-                                translate(
-                                    "BIM",
-                                    'The following Building Storey (BuildingParts with their IFC role set as "Building Storey") objects have been found to not be included in any Building. You can resolve the situation by creating a Building object, if none is present in your model, and drag and drop the Building Storey objects into it in the tree view:',
-                                )
-                                + "\n\n"
-                            )
-                        msg += obj.Label + "\n"
+            for obj, verdict in self.getVerdicts(test):
+                self.culprits[test].append(obj)
+                if not msg:
+                    msg = self.getToolTip(test)
+                    msg += (
+                        translate(
+                            "BIM",
+                            'The following Building Storey (BuildingParts with their IFC role set as "Building Storey") objects have been found to not be included in any Building. You can resolve the situation by creating a Building object, if none is present in your model, and drag and drop the Building Storey objects into it in the tree view:',
+                        )
+                        + "\n\n"
+                    )
+                msg += obj.Label + "\n"
             if msg:
                 self.failed(test)
             else:
@@ -559,38 +1372,18 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = []
             msg = None
-            for obj in self.getObjects():
-                if (
-                    hasattr(obj, "IfcRole")
-                    and (not obj.IfcRole in ["Building", "Building Storey", "Site"])
-                ) or (
-                    hasattr(obj, "IfcType")
-                    and (not obj.IfcType in ["Building", "Building Storey", "Site"])
-                ):
-                    ok = False
-                    for parent in obj.InListRecursive:
-                        # just check if any of the ancestors is a Building Storey for now. Don't check any further...
-                        if (
-                            hasattr(parent, "IfcRole")
-                            and (parent.IfcRole == "Building Storey")
-                        ) or (
-                            hasattr(parent, "IfcType")
-                            and (parent.IfcType == "Building Storey")
-                        ):
-                            ok = True
-                            break
-                    if not ok:
-                        self.culprits[test].append(obj)
-                        if not msg:
-                            msg = self.getToolTip(test)
-                            msg += (
-                                translate(
-                                    "BIM",
-                                    'The following BIM objects have been found to not be included in any Building Storey (BuildingParts with their IFC role set as "Building Storey"). You can resolve the situation by creating a Building Storey object, if none is present in your model, and drag and drop these objects into it in the tree view:',
-                                )
-                                + "\n\n"
-                            )
-                        msg += obj.Label + "\n"
+            for obj, verdict in self.getVerdicts(test):
+                self.culprits[test].append(obj)
+                if not msg:
+                    msg = self.getToolTip(test)
+                    msg += (
+                        translate(
+                            "BIM",
+                            'The following BIM objects have been found to not be included in any Building Storey (BuildingParts with their IFC role set as "Building Storey"). You can resolve the situation by creating a Building Storey object, if none is present in your model, and drag and drop these objects into it in the tree view:',
+                        )
+                        + "\n\n"
+                    )
+                msg += obj.Label + "\n"
             if msg:
                 self.failed(test)
             else:
@@ -615,17 +1408,11 @@ class BIM_Preflight_TaskPanel:
             notbim = []
             msg = None
 
-            for obj in self.getObjects():
-                if hasattr(obj, "IfcType"):
-                    if obj.IfcType == "Undefined":
-                        self.culprits[test].append(obj)
-                        undefined.append(obj)
-                elif hasattr(obj, "IfcRole"):
-                    if obj.IfcRole == "Undefined":
-                        self.culprits[test].append(obj)
-                        undefined.append(obj)
+            for obj, verdict in self.getVerdicts(test):
+                self.culprits[test].append(obj)
+                if verdict == "undefined":
+                    undefined.append(obj)
                 else:
-                    self.culprits[test].append(obj)
                     notbim.append(obj)
             if undefined or notbim:
                 msg = self.getToolTip(test)
@@ -665,6 +1452,8 @@ class BIM_Preflight_TaskPanel:
         test = "testSolid"
         if getattr(self.form, test).text() == "Failed":
             self.show(test)
+        elif self.startShapeCheck(test):
+            pass  # the button is updated by poll() when the results arrive
         else:
             QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
             self.reset(test)
@@ -672,12 +1461,8 @@ class BIM_Preflight_TaskPanel:
             self.culprits[test] = []
             msg = None
 
-            for obj in self.getObjects():
-                if obj.isDerivedFrom("Part::Feature"):
-                    if (not obj.Shape.isNull()) and (
-                        (not obj.Shape.isValid()) or (not obj.Shape.Solids)
-                    ):
-                        self.culprits[test].append(obj)
+            for obj, verdict in self.getVerdicts(test):
+                self.culprits[test].append(obj)
             if self.culprits[test]:
                 msg = self.getToolTip(test)
                 msg += (
@@ -711,17 +1496,8 @@ class BIM_Preflight_TaskPanel:
             self.culprits[test] = []
             msg = None
 
-            for obj in self.getObjects():
-                if hasattr(obj, "IfcAttributes") and (
-                    Draft.getType(obj) != "BuildingPart"
-                ):
-                    for prop in ["Length", "Width", "Height"]:
-                        if prop in obj.PropertiesList:
-                            if (not "Export" + prop in obj.IfcAttributes) or (
-                                obj.IfcAttributes["Export" + prop] == "False"
-                            ):
-                                self.culprits[test].append(obj)
-                                break
+            for obj, verdict in self.getVerdicts(test):
+                self.culprits[test].append(obj)
             if self.culprits[test]:
                 msg = self.getToolTip(test)
                 msg += (
@@ -748,7 +1524,6 @@ class BIM_Preflight_TaskPanel:
         "tests for common property sets"
 
         from PySide import QtCore, QtGui
-        import csv
 
         test = "testCommonPsets"
         if getattr(self.form, test).text() == "Failed":
@@ -759,45 +1534,8 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = []
             msg = None
-            psets = []
-            psetspath = os.path.join(
-                FreeCAD.getResourceDir(),
-                "Mod",
-                "Arch",
-                "Presets",
-                "pset_definitions.csv",
-            )
-            if os.path.exists(psetspath):
-                with open(psetspath, "r") as csvfile:
-                    reader = csv.reader(csvfile, delimiter=";")
-                    for row in reader:
-                        if "Common" in row[0]:
-                            psets.append(row[0][5:-6])
-            psets = [
-                "".join(map(lambda x: x if x.islower() else " " + x, p)) for p in psets
-            ]
-            psets = [pset.strip() for pset in psets]
-            # print(psets)
-
-            for obj in self.getObjects():
-                ok = True
-                if hasattr(obj, "IfcProperties") and isinstance(
-                    obj.IfcProperties, dict
-                ):
-                    r = None
-                    if hasattr(obj, "IfcType"):
-                        r = obj.IfcType
-                    if hasattr(obj, "IfcRole"):
-                        r = obj.IfcRole
-                    if r and (r in psets):
-                        ok = False
-                        if "Pset_" + r.replace(" ", "") + "Common" in ",".join(
-                            obj.IfcProperties.values()
-                        ):
-                            ok = True
-                if not ok:
-                    self.culprits[test].append(obj)
-
+            for obj, verdict in self.getVerdicts(test):
+                self.culprits[test].append(obj)
             if self.culprits[test]:
                 msg = self.getToolTip(test)
                 msg += (
@@ -824,7 +1562,6 @@ class BIM_Preflight_TaskPanel:
         "tests for property sets integrity"
 
         from PySide import QtCore, QtGui
-        import csv
 
         test = "testPsets"
         if getattr(self.form, test).text() == "Failed":
@@ -835,53 +1572,8 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = []
             msg = None
-            psets = {}
-            psetspath = os.path.join(
-                FreeCAD.getResourceDir(),
-                "Mod",
-                "Arch",
-                "Presets",
-                "pset_definitions.csv",
-            )
-            if os.path.exists(psetspath):
-                with open(psetspath, "r") as csvfile:
-                    reader = csv.reader(csvfile, delimiter=";")
-                    for row in reader:
-                        if "Common" in row[0]:
-                            psets[row[0]] = row[1:]
-
-            for obj in self.getObjects():
-                ok = True
-                if hasattr(obj, "IfcProperties") and isinstance(
-                    obj.IfcProperties, dict
-                ):
-                    r = None
-                    if hasattr(obj, "IfcType"):
-                        r = obj.IfcType
-                    elif hasattr(obj, "IfcRole"):
-                        r = obj.IfcRole
-                    if r and (r != "Undefined"):
-                        found = None
-                        for pset in psets.keys():
-                            for val in obj.IfcProperties.values():
-                                if pset in val:
-                                    found = pset
-                                    break
-                        if found:
-                            for i in range(int(len(psets[found]) / 2)):
-                                p = psets[found][i * 2]
-                                t = psets[found][i * 2 + 1]
-                                # print("testing for ",p,t,found," in ",obj.IfcProperties)
-                                if p in obj.IfcProperties:
-                                    if (not found in obj.IfcProperties[p]) or (
-                                        not t in obj.IfcProperties[p]
-                                    ):
-                                        ok = False
-                                else:
-                                    ok = False
-                if not ok:
-                    self.culprits[test].append(obj)
-
+            for obj, verdict in self.getVerdicts(test):
+                self.culprits[test].append(obj)
             if self.culprits[test]:
                 msg = self.getToolTip(test)
                 msg += (
@@ -926,10 +1618,8 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = []
             msg = None
-            for obj in self.getObjects():
-                if "Material" in obj.PropertiesList:
-                    if not obj.Material:
-                        self.culprits[test].append(obj)
+            for obj, verdict in self.getVerdicts(test):
+                self.culprits[test].append(obj)
             if self.culprits[test]:
                 msg = self.getToolTip(test)
                 msg += (
@@ -961,15 +1651,9 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = []
             msg = None
-            for obj in self.getObjects():
-                if "StandardCode" in obj.PropertiesList:
-                    if not obj.StandardCode:
-                        self.culprits[test].append(obj)
-                if "Material" in obj.PropertiesList:
-                    if obj.Material:
-                        if "StandardCode" in obj.Material.PropertiesList:
-                            if not obj.Material.StandardCode:
-                                self.culprits[test].append(obj.Material)
+            for obj, verdict in self.getVerdicts(test):
+                for name in verdict:
+                    self.culprits[test].append(obj.Document.getObject(name))
             if self.culprits[test]:
                 msg = self.getToolTip(test)
                 msg += (
@@ -992,7 +1676,6 @@ class BIM_Preflight_TaskPanel:
         "tests is all objects are extrusions"
 
         from PySide import QtCore, QtGui
-        import Draft
 
         test = "testExtrusions"
         if getattr(self.form, test).text() == "Failed":
@@ -1003,28 +1686,8 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = []
             msg = None
-            for obj in self.getObjects():
-                if hasattr(obj, "Proxy"):
-                    if (
-                        hasattr(obj, "IfcAttributes")
-                        and ("FlagForceBrep" in obj.IfcAttributes.keys())
-                        and (obj.IfcAttributes["FlagForceBrep"] == "True")
-                    ):
-                        self.culprits[test].append(obj)
-                    elif hasattr(
-                        obj.Proxy, "getExtrusionData"
-                    ) and not obj.Proxy.getExtrusionData(obj):
-                        self.culprits[test].append(obj)
-                    elif Draft.getType(obj) == "BuildingPart":
-                        pass
-                elif obj.isDerivedFrom("Part::Extrusion"):
-                    pass
-                elif obj.isDerivedFrom("App::DocumentObjectGroup"):
-                    pass
-                elif obj.isDerivedFrom("App::MaterialObject"):
-                    pass
-                else:
-                    self.culprits[test].append(obj)
+            for obj, verdict in self.getVerdicts(test):
+                self.culprits[test].append(obj)
             if self.culprits[test]:
                 msg = self.getToolTip(test)
                 msg += (
@@ -1043,7 +1706,6 @@ class BIM_Preflight_TaskPanel:
     def testStandardCases(self):
         "tests for structs and wall standard cases"
 
-        import Draft
         from PySide import QtCore, QtGui
 
         test = "testStandardCases"
@@ -1055,16 +1717,8 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = []
             msg = None
-            for obj in self.getObjects():
-                if Draft.getType(obj) == "Wall":
-                    if obj.Base and (len(obj.Base.Shape.Edges) != 1):
-                        self.culprits[test].append(obj)
-                elif Draft.getType(obj) == "Structure":
-                    if obj.Base and (
-                        (len(obj.Base.Shape.Wires) != 1)
-                        or (not obj.Base.Shape.Wires[0].isClosed())
-                    ):
-                        self.culprits[test].append(obj)
+            for obj, verdict in self.getVerdicts(test):
+                self.culprits[test].append(obj)
             if self.culprits[test]:
                 msg = self.getToolTip(test)
                 msg += (
@@ -1090,31 +1744,20 @@ class BIM_Preflight_TaskPanel:
         test = "testTinyLines"
         if getattr(self.form, test).text() == "Failed":
             self.show(test)
+        elif self.startShapeCheck(test):
+            pass  # the button is updated by poll() when the results arrive
         else:
             QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
             self.reset(test)
             self.results[test] = None
             self.culprits[test] = []
             msg = None
-            minl = 0.79376  # min 1/32"
-            edges = []
-            objs = []
-            for obj in self.getObjects():
-                if obj.isDerivedFrom("Part::Feature"):
-                    if obj.Shape:
-                        for e in obj.Shape.Edges:
-                            if e.Length <= minl:
-                                edges.append(e)
-                                if not obj in objs:
-                                    objs.append(obj)
-            if edges:
-                import Part
-                result = FreeCAD.ActiveDocument.addObject(
-                    "Part::Feature", "TinyLinesResult"
-                )
-                result.Shape = Part.makeCompound(edges)
-                result.ViewObject.LineWidth = 5
-                self.culprits[test] = [result]
+            failed = self.getVerdicts(test)
+            histogram = [0] * (len(TINYBINS) + 1)
+            for obj, verdict in failed:
+                self.culprits[test].append(obj)
+                histogram = [a + b for a, b in zip(histogram, verdict["histogram"])]
+            if failed:
                 msg = self.getToolTip(test)
                 msg += (
                     translate(
@@ -1123,20 +1766,43 @@ class BIM_Preflight_TaskPanel:
                     )
                     + "\n\n"
                 )
-                for obj in objs:
-                    msg += obj.Label + "\n"
+                for obj, verdict in failed:
+                    msg += obj.Label + " (" + str(verdict["count"]) + ")\n"
                 msg += (
                     "\n"
-                    + translate(
-                        "BIM",
-                        'An additional object, called "TinyLinesResult" has been added to this model, and selected. It contains all the tiny lines found, so you can inspect them and fix the needed objects. Be sure to delete the TinyLinesResult object when you are done!',
-                    )
+                    + translate("BIM", "Number of tiny lines by length (mm):")
                     + "\n\n"
                 )
-                msg += translate(
-                    "BIM",
-                    "Tip: The results are best viewed in Wireframe mode (menu Views -> Draw Style -> Wireframe)",
-                )
+                lower = 0
+                for bound, count in zip(TINYBINS + [MINLENGTH], histogram):
+                    msg += str(lower) + " - " + str(bound) + ": " + str(count) + "\n"
+                    lower = bound
+                p = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM")
+                if p.GetBool("PreflightTinyLinesResult", True):
+                    import Part
+
+                    # only the failing shapes are searched again
+                    edges = []
+                    for obj, verdict in failed:
+                        edges.extend(getTinyEdges(obj.Shape))
+                    result = FreeCAD.ActiveDocument.addObject(
+                        "Part::Feature", "TinyLinesResult"
+                    )
+                    result.Shape = Part.makeCompound(edges)
+                    result.ViewObject.LineWidth = 5
+                    self.culprits[test] = [result]
+                    msg += (
+                        "\n"
+                        + translate(
+                            "BIM",
+                            'An additional object, called "TinyLinesResult" has been added to this model, and selected. It contains all the tiny lines found, so you can inspect them and fix the needed objects. Be sure to delete the TinyLinesResult object when you are done!',
+                        )
+                        + "\n\n"
+                    )
+                    msg += translate(
+                        "BIM",
+                        "Tip: The results are best viewed in Wireframe mode (menu Views -> Draw Style -> Wireframe)",
+                    )
             if msg:
                 self.failed(test)
             else:
@@ -1155,13 +1821,11 @@ class BIM_Preflight_TaskPanel:
             self.results[test] = None
             self.culprits[test] = None
             msg = None
-            if FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Arch").GetBool(
-                "DisableIfcRectangleProfileDef", False
-            ):
-                self.passed(test)
-            else:
+            if checkRectangleProfileDef():
                 msg = self.getToolTip(test)
                 self.failed(test)
+            else:
+                self.passed(test)
             self.results[test] = msg
 
     def testCustom(self, test):
@@ -1170,6 +1834,22 @@ class BIM_Preflight_TaskPanel:
         if test in self.customTests:
             if getattr(self.form, test).text() == "Failed":
                 self.show(test)
+            elif test in self.customVisitors:
+                self.reset(test)
+                self.results[test] = None
+                self.culprits[test] = []
+                msg = None
+                for obj, verdict in self.getVerdicts(test):
+                    self.culprits[test].append(obj)
+                    if not msg:
+                        msg = self.customTests[test].__doc__ or ""
+                        msg += "\n\n"
+                    msg += obj.Label + ": " + str(verdict) + "\n"
+                if msg:
+                    self.failed(test)
+                else:
+                    self.passed(test)
+                self.results[test] = msg
             else:
                 self.reset(test)
                 self.results[test] = None
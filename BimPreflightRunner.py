@@ -0,0 +1,263 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+"""
+Runs the BIM preflight checks on FreeCAD or IFC files, without the GUI.
+
+USAGE:
+
+python BimPreflightRunner.py [options] file [file ...]
+
+Each .FCStd or .ifc file is opened, all the objects of the document are
+checked, and the results are printed. Results and the time spent in each
+check can also be written as json and as JUnit XML, so a CI job can show
+and gate on them. The exit code is 1 if any check failed.
+
+By default all the checks run, including the custom ones found in the
+BIM/Preflight user folder. Use --checks to run only some of them, and
+--list to see their names. A custom test function that takes one argument
+is run on each object, and returns None or True if the object passes.
+One without argument checks the whole model, and returns True if it
+passes. Otherwise, both return a text describing the failure.
+
+With --cache, the verdicts of the shape checks are stored next to each
+checked file, in a file of the same name ending with .preflight.json, and
+reused by the next runs for the objects whose shape didn't change. The
+checked files themselves are never modified.
+
+The FreeCAD lib folder must be importable, either because this script runs
+with the FreeCAD python, or by giving its path with --freecad.
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import traceback
+
+
+def getChecks():
+    """returns the object checks and the document checks available, as
+    two {test name: function} dicts"""
+
+    import BimPreflight
+
+    objectchecks = dict(BimPreflight.checks)
+    docchecks = dict(BimPreflight.setupchecks)
+    docchecks.update(BimPreflight.modelchecks)
+    for module, functions in BimPreflight.getCustomTests():
+        for name, func in functions:
+            if BimPreflight.isVisitor(func):
+                objectchecks[name] = func
+            else:
+                docchecks[name] = func
+    return objectchecks, docchecks
+
+
+def loadDocument(filename):
+    """opens a FCStd or IFC file and returns its document"""
+
+    import FreeCAD
+
+    if filename.lower().endswith(".fcstd"):
+        return FreeCAD.openDocument(filename)
+    import BimIfcImport
+
+    name = os.path.splitext(os.path.basename(filename))[0]
+    docname = "".join([c if c.isalnum() else "_" for c in name])
+    return BimIfcImport.insert(filename, docname)
+
+
+def getCacheFile(filename):
+    """returns the file where the verdicts of a checked file are cached"""
+
+    return filename + ".preflight.json"
+
+
+def getFailures(test, failed):
+    """returns a list of json-friendly dicts from the failing (object,
+    verdict) pairs of a check"""
+
+    result = []
+    for obj, verdict in failed:
+        result.append({"object": obj.Name, "label": obj.Label, "verdict": verdict})
+    return result
+
+
+def runFile(filename, objectchecks, docchecks, cache=False, executor=None):
+    """runs the given checks (see getChecks) on a file and returns a dict
+    of results. If cache is True, the verdicts are cached in a file next to
+    it (see getCacheFile). If a process pool is given, the shape checks run
+    in it"""
+
+    import FreeCAD
+    import BimPreflight
+
+    result = {"file": filename, "error": None, "checks": []}
+    starttime = time.time()
+    doc = None
+    try:
+        doc = loadDocument(filename)
+        objs = BimPreflight.getTargetObjects(doc.Objects)
+        result["objects"] = len(objs)
+        timings = {}
+        verdictcache = None
+        if cache:
+            verdictcache = BimPreflight.VerdictCache(doc, getCacheFile(filename))
+        verdicts = BimPreflight.runCachedChecks(
+            objs, objectchecks, verdictcache, timings, executor
+        )
+        if verdictcache:
+            verdictcache.save()
+            result["cache"] = [verdictcache.hits, verdictcache.misses]
+        for test in objectchecks:
+            failures = getFailures(test, verdicts[test])
+            check = {"name": test, "time": round(timings[test], 3)}
+            check["passed"] = not failures
+            check["failures"] = failures
+            result["checks"].append(check)
+        for test, func in docchecks.items():
+            checktime = time.perf_counter()
+            try:
+                if test in BimPreflight.modelchecks:
+                    verdict = func(objs)
+                else:
+                    verdict = func()
+            except Exception as e:
+                verdict = "error: " + str(e)
+            check = {"name": test, "time": round(time.perf_counter() - checktime, 3)}
+            # custom tests return True when passed, built-in ones None
+            check["passed"] = (verdict is None) or (verdict is True)
+            check["failures"] = [] if check["passed"] else [{"verdict": verdict}]
+            result["checks"].append(check)
+    except Exception:
+        result["error"] = traceback.format_exc()
+    finally:
+        if doc:
+            FreeCAD.closeDocument(doc.Name)
+    result["time"] = round(time.time() - starttime, 3)
+    return result
+
+
+def printResult(result):
+    """prints the results of a file"""
+
+    if result["error"]:
+        print("ERROR", result["file"])
+        print(result["error"])
+        return
+    print(result["file"], "(" + str(result.get("objects", 0)) + " objects)")
+    for check in result["checks"]:
+        status = "passed" if check["passed"] else "FAILED"
+        print("  " + check["name"] + ":", status, "(" + str(check["time"]) + "s)")
+        for failure in check["failures"]:
+            print("    " + ", ".join([str(v) for v in failure.values()]))
+
+
+def writeJUnit(results, filename):
+    """writes the results as a JUnit XML file, one test suite per file"""
+
+    import xml.etree.ElementTree as ET
+
+    root = ET.Element("testsuites")
+    for result in results:
+        suite = ET.SubElement(root, "testsuite", name=result["file"])
+        suite.set("time", str(result["time"]))
+        suite.set("tests", str(len(result["checks"])))
+        failures = [c for c in result["checks"] if not c["passed"]]
+        suite.set("failures", str(len(failures)))
+        suite.set("errors", "1" if result["error"] else "0")
+        if result["error"]:
+            case = ET.SubElement(suite, "testcase", name="load", classname="preflight")
+            ET.SubElement(case, "error", message="Error").text = result["error"]
+        for check in result["checks"]:
+            case = ET.SubElement(suite, "testcase", name=check["name"])
+            case.set("classname", "preflight")
+            case.set("time", str(check["time"]))
+            if not check["passed"]:
+                message = str(len(check["failures"])) + " failures"
+                lines = [json.dumps(f, default=str) for f in check["failures"]]
+                text = "\n".join(lines)
+                ET.SubElement(case, "failure", message=message).text = text
+    ET.ElementTree(root).write(filename, encoding="utf-8", xml_declaration=True)
+
+
+if __name__ == "__main__":
+    "main thread"
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("files", nargs="*", help="FCStd or IFC files")
+    parser.add_argument("-c", "--checks", help="comma-separated checks to run")
+    parser.add_argument("-l", "--list", action="store_true", help="list the checks")
+    parser.add_argument("-r", "--report", help="json file to write the results")
+    parser.add_argument("-x", "--junit", help="JUnit XML file to write the results")
+    parser.add_argument(
+        "--cache", action="store_true", help="cache the verdicts next to the files"
+    )
+    parser.add_argument("--freecad", help="path to the FreeCAD lib folder")
+    args = parser.parse_args()
+
+    if args.freecad and args.freecad not in sys.path:
+        sys.path.append(args.freecad)
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    objectchecks, docchecks = getChecks()
+    if args.list:
+        for test in list(objectchecks) + list(docchecks):
+            print(test)
+        sys.exit(0)
+    if not args.files:
+        parser.error("no file to check")
+    if args.checks:
+        selected = [c.strip() for c in args.checks.split(",") if c.strip()]
+        unknown = [c for c in selected if not c in objectchecks and not c in docchecks]
+        if unknown:
+            parser.error("unknown checks: " + ", ".join(unknown))
+        objectchecks = dict([(c, f) for c, f in objectchecks.items() if c in selected])
+        docchecks = dict([(c, f) for c, f in docchecks.items() if c in selected])
+
+    import BimPreflight
+
+    executor = None
+    if [test for test in objectchecks if test in BimPreflight.shapechecks]:
+        executor = BimPreflight.getExecutor()
+    results = []
+    try:
+        for filename in args.files:
+            result = runFile(filename, objectchecks, docchecks, args.cache, executor)
+            printResult(result)
+            results.append(result)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    failed = [
+        r for r in results if r["error"] or [c for c in r["checks"] if not c["passed"]]
+    ]
+    print(len(results) - len(failed), "of", len(results), "files passed")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"results": results}, f, indent=2, default=str)
+    if args.junit:
+        writeJUnit(results, args.junit)
+    sys.exit(1 if failed else 0)
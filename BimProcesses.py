@@ -0,0 +1,110 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+"""Process pools for the BIM workbench.
+
+Heavy shape work, such as triangulating shapes for the IFC exporter or
+running the preflight shape checks, can run in other processes, the shapes
+being passed to them as BREP strings. Processes are spawned with a python
+interpreter able to import FreeCAD. Inside the GUI, sys.executable is
+FreeCAD itself, which would open new windows, so the interpreter shipped
+with FreeCAD is used instead, and nothing runs in parallel if there is none.
+"""
+
+import os
+import sys
+import multiprocessing.context
+import multiprocessing.spawn
+
+import FreeCAD
+
+
+class SpawnProcess(multiprocessing.context.SpawnProcess):
+
+    """A spawned process, started by the python interpreter of its context"""
+
+    python = None  # the interpreter, set by SpawnContext
+
+    @staticmethod
+    def _Popen(process_obj):
+        # the interpreter is only set while this process is started, so
+        # other pools and processes keep the default one
+        default = multiprocessing.spawn.get_executable()
+        multiprocessing.spawn.set_executable(process_obj.python)
+        try:
+            return multiprocessing.context.SpawnProcess._Popen(process_obj)
+        finally:
+            multiprocessing.spawn.set_executable(default)
+
+
+class SpawnContext(multiprocessing.context.SpawnContext):
+
+    """A multiprocessing context spawning processes with a given python
+    interpreter"""
+
+    def __init__(self, python):
+        self.python = python
+
+    def Process(self, *args, **kwargs):
+        process = SpawnProcess(*args, **kwargs)
+        process.python = self.python
+        return process
+
+
+def getPython():
+    """returns a python interpreter able to import FreeCAD, or None"""
+
+    if not FreeCAD.GuiUp:
+        return sys.executable
+    for name in ["python3", "python", "python.exe"]:
+        path = os.path.join(FreeCAD.getHomePath(), "bin", name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def getCores():
+    """returns the number of processes to use, from the ifcMulticore
+    preference, or the number of processors if not set"""
+
+    p = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Arch")
+    cores = p.GetInt("ifcMulticore", 0)
+    if cores <= 0:
+        cores = os.cpu_count() or 1
+    return cores
+
+
+def getExecutor(cores=None):
+    """returns a pool of the given number of processes (by default given
+    by getCores), or None if the work must run in this process"""
+
+    import concurrent.futures
+
+    if cores is None:
+        cores = getCores()
+    python = getPython()
+    if (cores < 2) or (not python):
+        return None
+    # spawned processes get the sys.path of this one, so they can import
+    # FreeCAD and the workbench modules
+    context = SpawnContext(python)
+    return concurrent.futures.ProcessPoolExecutor(cores, mp_context=context)
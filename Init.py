@@ -23,3 +23,6 @@
 # add import/export types
 # FreeCAD.addImportType("Industry Foundation Classes BIMWB (*.ifc)","BimIfcImport")
 # FreeCAD.addExportType("Industry Foundation Classes BIMWB (*.ifc)","BimIfcExport")
+
+# unit tests
+FreeCAD.__unit_test__ += ["TestBIM"]
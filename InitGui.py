@@ -167,6 +167,8 @@ static char * IFC_xpm[] = {
         FreeCADGui.addCommand("BIM_Preflight", BimPreflight.BIM_Preflight())
         FreeCADGui.addCommand("BIM_Diff", BimDiff.BIM_Diff())
         FreeCADGui.addCommand("BIM_IfcExplorer", BimIfcExplorer.BIM_IfcExplorer())
+        FreeCADGui.addCommand("BIM_IfcUpdate", BimCommands.BIM_IfcUpdate())
+        FreeCADGui.addCommand("BIM_IfcExportPatch", BimCommands.BIM_IfcExportPatch())
         FreeCADGui.addCommand("BIM_Layers", BimLayers.BIM_Layers())
         FreeCADGui.addCommand("BIM_Reextrude", BimReextrude.BIM_Reextrude())
         FreeCADGui.addCommand("BIM_Reorder", BimReorder.BIM_Reorder())
@@ -366,6 +368,8 @@ static char * IFC_xpm[] = {
             "Arch_Survey",
             "BIM_Diff",
             "BIM_IfcExplorer",
+            "BIM_IfcUpdate",
+            "BIM_IfcExportPatch",
         ]
 
         nudge = [
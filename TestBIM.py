@@ -0,0 +1,38 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+"""Unit tests of the BIM workbench, to run from FreeCAD:
+
+FreeCAD -t TestBIM
+
+or, for the tests that don't need FreeCAD, from the workbench folder:
+
+python -m unittest TestBIM"""
+
+from bimtests.TestIfcBatch import TestIfcBatch
+from bimtests.TestIfcCache import TestIfcCache
+from bimtests.TestIfcExplorer import TestIfcExplorer
+from bimtests.TestIfcExport import TestIfcExport, TestIfcPatch
+from bimtests.TestIfcImport import TestIfcImport
+from bimtests.TestIfcRecycler import TestIfcRecycler
+from bimtests.TestPreflight import TestPreflight
+from bimtests.TestProcesses import TestProcesses
@@ -0,0 +1,95 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+"""Unit tests of the BimIfcBatch module"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+
+def succeed(job):
+    """a conversion that works"""
+
+    return {"file": job[0], "output": job[0] + ".FCStd", "error": None}
+
+
+def hang(job):
+    """a conversion that never ends"""
+
+    time.sleep(60)
+
+
+def crash(job):
+    """a conversion that kills its process"""
+
+    os._exit(3)
+
+
+class TestIfcBatch(unittest.TestCase):
+    def testFiles(self):
+        """IFC files are found in folders, and saved beside them by default"""
+
+        import BimIfcBatch
+
+        folder = tempfile.mkdtemp()
+        try:
+            for name in ["b.ifc", "a.IFC", "c.txt"]:
+                open(os.path.join(folder, name), "w").close()
+            files = BimIfcBatch.getFiles([folder, os.path.join(folder, "d.ifc")])
+            names = [os.path.basename(f) for f in files]
+            self.assertEqual(names, ["a.IFC", "b.ifc"])
+        finally:
+            shutil.rmtree(folder)
+        output = BimIfcBatch.getOutputFile(os.path.join("x", "y.ifc"))
+        self.assertEqual(output, os.path.join("x", "y.FCStd"))
+        output = BimIfcBatch.getOutputFile(os.path.join("x", "y.ifc"), "z")
+        self.assertEqual(output, os.path.join("z", "y.FCStd"))
+
+    def testFailures(self):
+        """hanging and crashing jobs fail alone, each within the timeout"""
+
+        import BimIfcBatch
+
+        starttime = time.time()
+        results = {}
+        for function in [succeed, hang, crash]:
+            jobs = [(function.__name__, None, None, 1)]
+            result = BimIfcBatch.runJobs(jobs, 2, 2, function)
+            results[function.__name__] = result[0]
+        self.assertIsNone(results["succeed"]["error"])
+        self.assertIn("Timed out", results["hang"]["error"])
+        self.assertIn("exit code 3", results["crash"]["error"])
+        self.assertTrue(time.time() - starttime < 30)
+
+    def testCallback(self):
+        """all the jobs run, and their results are given to the callback"""
+
+        import BimIfcBatch
+
+        jobs = [(str(i), None, None, 1) for i in range(5)]
+        done = []
+        results = BimIfcBatch.runJobs(jobs, 2, 30, succeed, done.append)
+        self.assertEqual(sorted([r["file"] for r in results]), list("01234"))
+        self.assertEqual(done, results)
@@ -0,0 +1,205 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+"""Unit tests of the BimIfcCache module"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+try:
+    import ifcopenshell
+except ImportError:
+    ifcopenshell = None
+
+
+def makeFile(x=0.0, padding=0):
+    """returns an IFC file with one wall placed at x. Padding entities are
+    created first, so the wall entities get other ids"""
+
+    ifcfile = ifcopenshell.file(schema="IFC4")
+    for i in range(padding):
+        ifcfile.createIfcCartesianPoint((9.0, 9.0, 9.0))
+    origin = ifcfile.createIfcCartesianPoint((x, 0.0, 0.0))
+    axis = ifcfile.createIfcAxis2Placement3D(origin, None, None)
+    placement = ifcfile.createIfcLocalPlacement(None, axis)
+    profile = ifcfile.createIfcRectangleProfileDef("AREA", None, None, 1.0, 0.2)
+    direction = ifcfile.createIfcDirection((0.0, 0.0, 1.0))
+    solid = ifcfile.createIfcExtrudedAreaSolid(profile, None, direction, 3.0)
+    context = ifcfile.createIfcGeometricRepresentationContext(
+        None, "Model", 3, 1.0e-05, axis, None
+    )
+    rep = ifcfile.createIfcShapeRepresentation(context, "Body", "SweptSolid", [solid])
+    shape = ifcfile.createIfcProductDefinitionShape(None, None, [rep])
+    guid = "2O2Fr$t4X7Zf8NOew3FLOH"
+    ifcfile.createIfcWall(guid, None, "Wall", None, None, placement, shape)
+    return ifcfile
+
+
+def makeSettings(worldcoords):
+    """returns geometry settings with the given world coords setting"""
+
+    from ifcopenshell import geom
+
+    settings = geom.settings()
+    if hasattr(settings, "USE_WORLD_COORDS"):
+        settings.set(settings.USE_WORLD_COORDS, worldcoords)
+    else:
+        settings.set("use-world-coords", worldcoords)
+    return settings
+
+
+class FakeShape:
+    """a shape that fails to export, as in a read-only folder"""
+
+    def exportBrep(self, filename):
+        raise PermissionError("read-only folder")
+
+
+@unittest.skipUnless(ifcopenshell, "ifcopenshell is not available")
+class TestIfcCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, "test.ifc")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def testRenumbering(self):
+        """the hash of a product doesn't depend on the numbering of the file"""
+
+        import BimIfcCache
+
+        hashes = []
+        for ifcfile in [makeFile(), makeFile(padding=5), makeFile(x=1.0)]:
+            wall = ifcfile.by_type("IfcWall")[0]
+            hashes.append(BimIfcCache.getRepresentationHash(ifcfile, wall))
+        self.assertEqual(hashes[0], hashes[1])
+        self.assertNotEqual(hashes[0], hashes[2])
+
+    def testSettings(self):
+        """the cache key changes with the geometry settings"""
+
+        import BimIfcCache
+
+        ifcfile = makeFile()
+        wall = ifcfile.by_type("IfcWall")[0]
+        keys = []
+        for worldcoords in [True, True, False]:
+            settings = makeSettings(worldcoords)
+            cache = BimIfcCache.ShapeCache(self.filename, ifcfile, 1, settings)
+            keys.append(cache.getKey(wall))
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
+
+    def testWriteError(self):
+        """a cache that can't be written is disabled without raising"""
+
+        import BimIfcCache
+
+        ifcfile = makeFile()
+        wall = ifcfile.by_type("IfcWall")[0]
+        cache = BimIfcCache.ShapeCache(self.filename, ifcfile)
+        cache.putShape(wall, FakeShape())
+        self.assertTrue(cache.error)
+        self.assertFalse(cache.contains(wall))
+        cache.save()
+
+    def testEviction(self):
+        """the least recently used shapes are removed above the size limit"""
+
+        import BimIfcCache
+
+        cache = BimIfcCache.ShapeCache(self.filename, makeFile(), 1)
+        os.makedirs(cache.path)
+        for i, key in enumerate(["a", "b", "c"]):
+            with open(cache.getFile(key), "w") as f:
+                f.write("x")
+            cache.index[key] = [400000, 10 + i]
+        cache.index["a"][1] = 20  # used last
+        cache.save()
+        self.assertEqual(sorted(cache.index), ["a", "c"])
+        self.assertFalse(os.path.exists(cache.getFile("b")))
+        with open(os.path.join(cache.path, "index.json")) as f:
+            self.assertEqual(sorted(json.load(f)), ["a", "c"])
+
+    def testRemoveError(self):
+        """shapes that can't be removed don't stop the eviction"""
+
+        import BimIfcCache
+
+        cache = BimIfcCache.ShapeCache(self.filename, makeFile(), 1)
+        os.makedirs(cache.path)
+        for i, key in enumerate(["a", "b"]):
+            with open(cache.getFile(key), "w") as f:
+                f.write("x")
+            cache.index[key] = [800000, 10 + i]
+
+        def remove(path):
+            raise PermissionError("locked file")
+
+        default = BimIfcCache.os.remove
+        BimIfcCache.os.remove = remove
+        try:
+            cache.save()
+        finally:
+            BimIfcCache.os.remove = default
+        self.assertTrue(cache.error)
+        self.assertEqual(sorted(cache.index), ["b"])
+
+    def testSharedHashes(self):
+        """entities shared by several products are hashed once"""
+
+        import BimIfcCache
+
+        ifcfile = makeFile()
+        wall = ifcfile.by_type("IfcWall")[0]
+        origin = ifcfile.createIfcCartesianPoint((2.0, 0.0, 0.0))
+        axis = ifcfile.createIfcAxis2Placement3D(origin, None, None)
+        placement = ifcfile.createIfcLocalPlacement(None, axis)
+        other = ifcfile.createIfcWall(
+            "0Fq2Rp7ez3rBlf4aRpEjZ1", None, "Other", None, None, placement
+        )
+        other.Representation = wall.Representation
+        hashes = {}
+        first = BimIfcCache.getRepresentationHash(ifcfile, wall, hashes)
+        count = len(hashes)
+        second = BimIfcCache.getRepresentationHash(ifcfile, other, hashes)
+        # only the placement of the second wall is new
+        self.assertEqual(len(hashes), count + 3)
+        self.assertEqual(first, BimIfcCache.getRepresentationHash(ifcfile, wall))
+        self.assertEqual(second, BimIfcCache.getRepresentationHash(ifcfile, other))
+        self.assertNotEqual(first, second)
+
+    def testMisses(self):
+        """shapes not found in the cache are not counted as misses twice"""
+
+        import BimIfcCache
+
+        ifcfile = makeFile()
+        wall = ifcfile.by_type("IfcWall")[0]
+        cache = BimIfcCache.ShapeCache(self.filename, ifcfile)
+        self.assertFalse(cache.contains(wall))
+        self.assertIsNone(cache.getShape(wall))
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
@@ -0,0 +1,325 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+"""Unit tests of the BimIfcExplorer module"""
+
+import os
+import collections
+import queue
+import tempfile
+import threading
+import unittest
+
+try:
+    import FreeCAD
+except ImportError:
+    FreeCAD = None
+try:
+    import ifcopenshell
+except ImportError:
+    ifcopenshell = None
+
+
+def getMessages(q):
+    """returns the messages posted in a queue"""
+
+    messages = []
+    while not q.empty():
+        messages.append(q.get_nowait())
+    return messages
+
+
+def makeFile():
+    """returns an IFC file with a fire-rated wall type, two walls of that
+    type, one overriding the rating, and a door"""
+
+    ifcfile = ifcopenshell.file(schema="IFC4")
+
+    def makePset(owner, value):
+        prop = ifcfile.createIfcPropertySingleValue(
+            "FireRating", None, ifcfile.createIfcLabel(value), None
+        )
+        pset = ifcfile.createIfcPropertySet(
+            ifcopenshell.guid.new(), None, "Pset_WallCommon", None, [prop]
+        )
+        if owner:
+            ifcfile.createIfcRelDefinesByProperties(
+                ifcopenshell.guid.new(), None, None, None, [owner], pset
+            )
+        return pset
+
+    walltype = ifcfile.createIfcWallType(ifcopenshell.guid.new(), None, "WT01")
+    walltype.HasPropertySets = [makePset(None, "EI60")]
+    first = ifcfile.createIfcWall(ifcopenshell.guid.new(), None, "First wall")
+    second = ifcfile.createIfcWall(ifcopenshell.guid.new(), None, "Second wall")
+    ifcfile.createIfcRelDefinesByType(
+        ifcopenshell.guid.new(), None, None, None, [first, second], walltype
+    )
+    makePset(second, "EI90")
+    ifcfile.createIfcDoor(ifcopenshell.guid.new(), None, "D01")
+    return ifcfile
+
+
+def makeStructureFile():
+    """returns an IFC file with a site, a building and a storey holding
+    two walls, the first one with a representation, and a proxy placed
+    directly in the site"""
+
+    ifcfile = ifcopenshell.file(schema="IFC4")
+
+    def aggregate(parent, children):
+        ifcfile.createIfcRelAggregates(
+            ifcopenshell.guid.new(), None, None, None, parent, children
+        )
+
+    def contain(parent, children):
+        ifcfile.createIfcRelContainedInSpatialStructure(
+            ifcopenshell.guid.new(), None, None, None, children, parent
+        )
+
+    project = ifcfile.createIfcProject(ifcopenshell.guid.new(), None, "Project")
+    site = ifcfile.createIfcSite(ifcopenshell.guid.new(), None, "Site")
+    building = ifcfile.createIfcBuilding(ifcopenshell.guid.new(), None, "Building")
+    storey = ifcfile.createIfcBuildingStorey(ifcopenshell.guid.new(), None, "Level")
+    first = ifcfile.createIfcWall(ifcopenshell.guid.new(), None, "First wall")
+    second = ifcfile.createIfcWall(ifcopenshell.guid.new(), None, "Second wall")
+    proxy = ifcfile.createIfcBuildingElementProxy(ifcopenshell.guid.new(), None, "Tree")
+    aggregate(project, [site])
+    aggregate(site, [building])
+    aggregate(building, [storey])
+    contain(storey, [first, second])
+    contain(site, [proxy])
+    point = ifcfile.createIfcCartesianPoint((0.0, 0.0, 0.0))
+    rep = ifcfile.createIfcShapeRepresentation(None, "Body", "Point", [point])
+    first.Representation = ifcfile.createIfcProductDefinitionShape(None, None, [rep])
+    return ifcfile
+
+
+def getNames(entities):
+    """returns the names of a list of entities"""
+
+    return [e.Name for e in entities]
+
+
+@unittest.skipUnless(FreeCAD, "FreeCAD is not available")
+class TestIfcExplorer(unittest.TestCase):
+    def testReadError(self):
+        """a file that can't be read ends the task with its error"""
+
+        import BimIfcExplorer
+
+        explorer = BimIfcExplorer.BIM_IfcExplorer()
+        q = queue.Queue()
+        explorer.readFile(q, threading.Event(), "/nonexistent/file.ifc")
+        messages = getMessages(q)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0][0], "done")
+        self.assertTrue(messages[0][1])
+
+    @unittest.skipUnless(ifcopenshell, "ifcopenshell is not available")
+    def testReadFile(self):
+        """the file is posted before its indexes"""
+
+        import BimIfcExplorer
+
+        explorer = BimIfcExplorer.BIM_IfcExplorer()
+        q = queue.Queue()
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "structure.ifc")
+            makeStructureFile().write(filename)
+            explorer.readFile(q, threading.Event(), filename)
+        messages = getMessages(q)
+        self.assertEqual([m[0] for m in messages], ["file", "index", "done"])
+        ifcfile = messages[0][1]
+        descendants, index = messages[1][1:]
+        site = ifcfile.by_type("IfcSite")[0]
+        names = [ifcfile[i].Name for i in descendants[site.id()]]
+        self.assertEqual(
+            names, ["Building", "Level", "First wall", "Second wall", "Tree"]
+        )
+        self.assertEqual(len(index["values"]), 6)
+        self.assertIsNone(messages[2][1])
+
+    def testMeshesError(self):
+        """a failing tessellation ends the task with its error"""
+
+        import BimIfcExplorer
+
+        explorer = BimIfcExplorer.BIM_IfcExplorer()
+        q = queue.Queue()
+        explorer.readMeshes(q, threading.Event(), "/nonexistent/file.ifc", [[]], 1)
+        messages = getMessages(q)
+        self.assertEqual(messages[-1][0], "done")
+        self.assertTrue(messages[-1][1])
+
+    def getExplorer(self):
+        """returns an explorer with the test file loaded"""
+
+        import BimIfcExplorer
+
+        explorer = BimIfcExplorer.BIM_IfcExplorer()
+        explorer.ifc = makeFile()
+        explorer.index = explorer.buildSearchIndex(explorer.ifc)
+        return explorer
+
+    def getNames(self, explorer, query):
+        """returns the sorted names of the products found by a query"""
+
+        return sorted([explorer.ifc[i].Name for i in explorer.find(query)])
+
+    @unittest.skipUnless(ifcopenshell, "ifcopenshell is not available")
+    def testTypeProperties(self):
+        """properties of the types are found, unless overridden"""
+
+        explorer = self.getExplorer()
+        names = self.getNames(explorer, "IfcWall where FireRating=EI60")
+        self.assertEqual(names, ["First wall"])
+        names = self.getNames(explorer, "IfcWall where FireRating=EI90")
+        self.assertEqual(names, ["Second wall"])
+        names = self.getNames(explorer, "where firerating")
+        self.assertEqual(names, ["First wall", "Second wall"])
+
+    @unittest.skipUnless(ifcopenshell, "ifcopenshell is not available")
+    def testQuery(self):
+        """classes, words and conditions of a query are all matched"""
+
+        explorer = self.getExplorer()
+        self.assertEqual(
+            self.getNames(explorer, "IfcBuildingElement"),
+            ["D01", "First wall", "Second wall"],
+        )
+        self.assertEqual(self.getNames(explorer, "IfcDoor"), ["D01"])
+        self.assertEqual(self.getNames(explorer, "wall second"), ["Second wall"])
+        self.assertEqual(self.getNames(explorer, "sec"), ["Second wall"])
+        names = self.getNames(explorer, "IfcWall WHERE Name='First wall'")
+        self.assertEqual(names, ["First wall"])
+        self.assertEqual(self.getNames(explorer, "IfcDoor where FireRating"), [])
+        self.assertEqual(self.getNames(explorer, "nothing"), [])
+
+    def getStructureExplorer(self):
+        """returns an explorer with the structure file loaded"""
+
+        import BimIfcExplorer
+
+        explorer = BimIfcExplorer.BIM_IfcExplorer()
+        explorer.ifc = makeStructureFile()
+        explorer.descendants = {}
+        explorer.products = []
+        return explorer
+
+    @unittest.skipUnless(ifcopenshell, "ifcopenshell is not available")
+    def testNavigation(self):
+        """children and parents of the spatial structure and shapes"""
+
+        explorer = self.getStructureExplorer()
+        ifcfile = explorer.ifc
+        site = ifcfile.by_type("IfcSite")[0]
+        storey = ifcfile.by_type("IfcBuildingStorey")[0]
+        first, second = ifcfile.by_type("IfcWall")
+        children = explorer.getChildEntities(site)
+        self.assertEqual(getNames(children), ["Building", "Tree"])
+        children = explorer.getChildEntities(storey)
+        self.assertEqual(getNames(children), ["First wall", "Second wall"])
+        self.assertEqual(explorer.getChildEntities(second), [])
+        shape = explorer.getChildEntities(first)[0]
+        self.assertTrue(shape.is_a("IfcProductDefinitionShape"))
+        rep = explorer.getChildEntities(shape)[0]
+        point = explorer.getChildEntities(rep)[0]
+        self.assertTrue(point.is_a("IfcCartesianPoint"))
+        # each parent leads back to the entity above it in the tree
+        self.assertEqual(explorer.getParentEntity(point), rep)
+        self.assertEqual(explorer.getParentEntity(rep), shape)
+        self.assertEqual(explorer.getParentEntity(shape), first)
+        self.assertEqual(explorer.getParentEntity(first), storey)
+        self.assertEqual(explorer.getParentEntity(storey).Name, "Building")
+        project = ifcfile.by_type("IfcProject")[0]
+        self.assertEqual(explorer.getParentEntity(site), project)
+        self.assertIsNone(explorer.getParentEntity(project))
+
+    @unittest.skipUnless(ifcopenshell, "ifcopenshell is not available")
+    def testDescendants(self):
+        """products are indexed under all their ancestors and grouped by
+        storey"""
+
+        explorer = self.getStructureExplorer()
+        ifcfile = explorer.ifc
+        project = ifcfile.by_type("IfcProject")[0]
+        storey = ifcfile.by_type("IfcBuildingStorey")[0]
+        explorer.buildDescendants(project, explorer.descendants)
+        products = ["Site", "Building", "Level", "First wall", "Second wall", "Tree"]
+        names = [ifcfile[i].Name for i in explorer.descendants[project.id()]]
+        self.assertEqual(names, products)
+        names = [ifcfile[i].Name for i in explorer.descendants[storey.id()]]
+        self.assertEqual(names, ["First wall", "Second wall"])
+        # walls have no product below them, so they are not indexed
+        for wall in ifcfile.by_type("IfcWall"):
+            self.assertNotIn(wall.id(), explorer.descendants)
+        self.assertEqual(getNames(explorer.getProducts()), products)
+        groups = explorer.getStoreyGroups()
+        self.assertEqual(
+            [getNames(g) for g in groups],
+            [["Level", "First wall", "Second wall"], ["Site", "Building", "Tree"]],
+        )
+
+    @unittest.skipUnless(ifcopenshell, "ifcopenshell is not available")
+    def testViews(self):
+        """attributes and properties are listed, and only the last viewed
+        ones are kept"""
+
+        import BimIfcExplorer
+
+        explorer = BimIfcExplorer.BIM_IfcExplorer()
+        explorer.ifc = makeFile()
+        explorer.views = collections.OrderedDict()
+        second = explorer.ifc.by_type("IfcWall")[1]
+        rows = explorer.getAttributesView(second.id())
+        names = [r[0] for r in rows]
+        self.assertNotIn("GlobalId", names)
+        self.assertEqual(
+            rows[names.index("Name")], ("Name", "Second wall", False, None)
+        )
+        self.assertEqual(explorer.formatValue(None), ("None", False))
+        link = "#" + str(second.id()) + ": IfcWall"
+        self.assertEqual(explorer.formatValue(second), (link, True))
+        psets = explorer.getPropertiesView(second.id())
+        self.assertEqual(len(psets), 1)
+        self.assertEqual(psets[0][0], "Pset_WallCommon")
+        self.assertIn(("Name", "FireRating", False, None), psets[0][1][0])
+        calls = []
+
+        def makeView(eid):
+            calls.append(eid)
+            return []
+
+        # one cache entry per viewed entity, whatever its property count
+        explorer.getAttributesView = makeView
+        explorer.getPropertiesView = lambda eid: []
+        views = BimIfcExplorer.VIEWS
+        BimIfcExplorer.VIEWS = 2
+        try:
+            for eid in [1, 2, 1, 3, 1, 2]:
+                explorer.getView(eid)
+        finally:
+            BimIfcExplorer.VIEWS = views
+        # 2 is dropped when 3 comes, 1 being viewed more recently
+        self.assertEqual(calls, [1, 2, 3, 2])
+        self.assertEqual(list(explorer.views), [1, 2])
@@ -0,0 +1,387 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+"""Unit tests of the BimIfcExport module"""
+
+import os
+import unittest
+
+try:
+    import FreeCAD
+except ImportError:
+    FreeCAD = None
+try:
+    import ifcopenshell
+except ImportError:
+    ifcopenshell = None
+
+
+def makeModelFile():
+    """returns an IFC file with a site, a building and a storey containing
+    two walls, the first one with an opening placed relatively to it"""
+
+    def guid():
+        return ifcopenshell.guid.new()
+
+    ifcfile = ifcopenshell.file(schema="IFC4")
+    unit = ifcfile.createIfcSIUnit(None, "LENGTHUNIT", None, "METRE")
+    units = ifcfile.createIfcUnitAssignment([unit])
+    origin = ifcfile.createIfcCartesianPoint((0.0, 0.0, 0.0))
+    axis = ifcfile.createIfcAxis2Placement3D(origin, None, None)
+    context = ifcfile.createIfcGeometricRepresentationContext(
+        None, "Model", 3, 1.0e-05, axis, None
+    )
+    project = ifcfile.createIfcProject(guid(), None, "Project")
+    project.UnitsInContext = units
+    project.RepresentationContexts = [context]
+    parent = project
+    placement = None
+    for ifcclass in ["IfcSite", "IfcBuilding", "IfcBuildingStorey"]:
+        placement = ifcfile.createIfcLocalPlacement(placement, axis)
+        child = ifcfile.create_entity(
+            ifcclass, guid(), None, ifcclass[3:], None, None, placement
+        )
+        ifcfile.createIfcRelAggregates(guid(), None, None, None, parent, [child])
+        parent = child
+    direction = ifcfile.createIfcDirection((0.0, 0.0, 1.0))
+    walls = []
+    for i in range(2):
+        point = ifcfile.createIfcCartesianPoint((0.0, 2.0 * i, 0.0))
+        wallplacement = ifcfile.createIfcLocalPlacement(
+            placement, ifcfile.createIfcAxis2Placement3D(point, None, None)
+        )
+        profile = ifcfile.createIfcRectangleProfileDef("AREA", None, None, 4.0, 0.2)
+        solid = ifcfile.createIfcExtrudedAreaSolid(profile, axis, direction, 3.0)
+        body = ifcfile.createIfcShapeRepresentation(
+            context, "Body", "SweptSolid", [solid]
+        )
+        shape = ifcfile.createIfcProductDefinitionShape(None, None, [body])
+        wall = ifcfile.createIfcWall(
+            guid(), None, "Wall" + str(i), None, None, wallplacement, shape
+        )
+        walls.append(wall)
+    ifcfile.createIfcRelContainedInSpatialStructure(
+        guid(), None, None, None, walls, parent
+    )
+    profile = ifcfile.createIfcRectangleProfileDef("AREA", None, None, 1.0, 0.4)
+    solid = ifcfile.createIfcExtrudedAreaSolid(profile, axis, direction, 2.0)
+    body = ifcfile.createIfcShapeRepresentation(context, "Body", "SweptSolid", [solid])
+    shape = ifcfile.createIfcProductDefinitionShape(None, None, [body])
+    placement = ifcfile.createIfcLocalPlacement(walls[0].ObjectPlacement, axis)
+    opening = ifcfile.createIfcOpeningElement(
+        guid(), None, "Opening", None, None, placement, shape
+    )
+    ifcfile.createIfcRelVoidsElement(guid(), None, None, None, walls[0], opening)
+    return ifcfile
+
+
+@unittest.skipUnless(FreeCAD, "FreeCAD is not available")
+class TestIfcExport(unittest.TestCase):
+    def setUp(self):
+        self.doc = FreeCAD.newDocument("TestIfcExport")
+
+    def tearDown(self):
+        FreeCAD.closeDocument(self.doc.Name)
+
+    def makeObject(self, label):
+        """returns an object as the importer leaves it"""
+
+        import Part
+        import BimIfcImport
+
+        obj = self.doc.addObject("Part::Feature", "Box")
+        obj.Shape = Part.makeBox(1000, 200, 3000)
+        obj.Label = label
+        obj.addProperty("App::PropertyStringList", "ShapeHashes", "IfcLink")
+        obj.ShapeHashes = BimIfcImport.getShapeHashes(obj)
+        return obj
+
+    def testUnmodified(self):
+        """imported objects are not modified, even with a renamed label"""
+
+        import BimIfcExport
+
+        first = self.makeObject("Door")
+        second = self.makeObject("Door")  # gets another label
+        self.assertNotEqual(first.Label, second.Label)
+        for obj in [first, second]:
+            mods = BimIfcExport.getModifications(obj, None)
+            self.assertEqual(mods, (False, False, False))
+
+    def testModifications(self):
+        """label, placement and geometry changes are found apart"""
+
+        import Part
+        import BimIfcExport
+
+        obj = self.makeObject("Wall")
+        obj.Label = "Renamed wall"
+        self.assertEqual(BimIfcExport.getModifications(obj, None), (True, False, False))
+        obj = self.makeObject("Wall")
+        placement = obj.Placement
+        placement.Base = FreeCAD.Vector(0, 0, 1000)
+        obj.Placement = placement
+        self.assertEqual(BimIfcExport.getModifications(obj, None), (False, False, True))
+        obj = self.makeObject("Wall")
+        obj.Shape = Part.makeBox(1000, 300, 3000)
+        self.assertEqual(BimIfcExport.getModifications(obj, None), (False, True, False))
+
+    def testCategories(self):
+        """objects are sorted by category, which is kept until they change"""
+
+        import Part
+        import BimIfcExport
+
+        box = self.doc.addObject("Part::Feature", "Box")
+        box.Shape = Part.makeBox(1000, 200, 3000)
+        line = self.doc.addObject("Part::Feature", "Line")
+        line.Shape = Part.makeLine(FreeCAD.Vector(), FreeCAD.Vector(1000, 0, 0))
+        plane = self.doc.addObject("Part::Feature", "Plane")
+        plane.Shape = Part.makePlane(1000, 1000)
+        self.assertEqual(BimIfcExport.getCategory(box), "object")
+        self.assertEqual(BimIfcExport.getCategory(line), "annotation")
+        self.assertEqual(BimIfcExport.getCategory(plane), "annotation")
+        objects, annotations = BimIfcExport.buildExportLists([box, line, plane])
+        self.assertEqual(objects, [box])
+        self.assertEqual(annotations, [line, plane])
+        line.Shape = Part.makeBox(1000, 200, 3000)
+        self.assertEqual(BimIfcExport.getCategory(line), "object")
+        BimIfcExport.buildExportLists([box])
+        self.assertEqual(list(BimIfcExport.categories), [(self.doc.Name, box.Name)])
+
+    def testShapesData(self):
+        """shapes triangulated in other processes are the same as here"""
+
+        import Part
+        import BimIfcExport
+
+        jobs = []
+        for i in range(3):
+            shape = Part.makeBox(1000, 200 + i, 3000)
+            jobs.append(("Box" + str(i), shape, FreeCAD.Placement()))
+        data = BimIfcExport.getShapesData(jobs, 0.001)
+        self.assertEqual(sorted(data), ["Box0", "Box1", "Box2"])
+        for name, shape, placement in jobs:
+            pl = tuple(placement.Base) + tuple(placement.Rotation.Q)
+            args = (shape.exportBrepToString(), pl, 0.001, BimIfcExport.TESSELLATION)
+            self.assertEqual(data[name], BimIfcExport.getShapeData(args))
+
+    @unittest.skipUnless(ifcopenshell, "ifcopenshell is not available")
+    def testExport(self):
+        """objects are exported with their triangulated geometry"""
+
+        import tempfile
+        import Part
+        import BimIfcExport
+
+        for i in range(2):
+            obj = self.doc.addObject("Part::Feature", "Box")
+            obj.Shape = Part.makeBox(1000, 200, 3000)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "export.ifc")
+            BimIfcExport.export(self.doc.Objects, filename)
+            ifcfile = ifcopenshell.open(filename)
+        products = ifcfile.by_type("IfcBuildingElementProxy")
+        self.assertEqual(len(products), 2)
+        for product in products:
+            rep = product.Representation.Representations[0]
+            self.assertEqual(rep.Items[0].is_a(), "IfcFacetedBrep")
+
+    @unittest.skipUnless(ifcopenshell, "ifcopenshell is not available")
+    def testUnchangedPatch(self):
+        """the patch of an unchanged imported file rewrites nothing"""
+
+        import tempfile
+        import BimIfcImport
+        import BimIfcExport
+
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "model.ifc")
+            makeModelFile().write(source)
+            BimIfcImport.insert(source)
+            objectslist = BimIfcExport.buildExportLists(self.doc.Objects)[0]
+            filename = os.path.join(tmp, "patch.ifc")
+            BimIfcExport.exportPatch(self.doc, objectslist, filename)
+            with open(source, "rb") as f:
+                before = f.read()
+            with open(filename, "rb") as f:
+                after = f.read()
+        self.assertEqual(after, before)
+
+    @unittest.skipUnless(ifcopenshell, "ifcopenshell is not available")
+    def testMovedPlacement(self):
+        """a moved wall keeps its opening placed relatively to it"""
+
+        import tempfile
+        import BimIfcImport
+        import BimIfcExport
+
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "model.ifc")
+            makeModelFile().write(source)
+            BimIfcImport.insert(source)
+            wall = [o for o in self.doc.Objects if o.Label == "Wall0"][0]
+            placement = wall.Placement
+            placement.move(FreeCAD.Vector(1000, 0, 0))
+            wall.Placement = placement
+            objectslist = BimIfcExport.buildExportLists(self.doc.Objects)[0]
+            filename = os.path.join(tmp, "patch.ifc")
+            BimIfcExport.exportPatch(self.doc, objectslist, filename)
+            patched = ifcopenshell.open(filename)
+        wall = patched.by_guid(wall.GlobalId)
+        opening = patched.by_type("IfcOpeningElement")[0]
+        placement = wall.ObjectPlacement
+        self.assertEqual(opening.ObjectPlacement.PlacementRelTo, placement)
+        location = placement.RelativePlacement.Location.Coordinates
+        self.assertAlmostEqual(location[0], 1.0)
+
+
+SOURCE = """ISO-10303-21;
+HEADER;
+FILE_DESCRIPTION(('ViewDefinition [CoordinationView]'),'2;1');
+FILE_NAME('source.ifc','2022-01-01T00:00:00',(''),(''),'','','');
+FILE_SCHEMA(('IFC4'));
+ENDSEC;
+DATA;
+#1=IFCWALL('1111111111111111111111',$,'First wall',$,$,$,$,$,$);
+#2=IFCWALL('2222222222222222222222',$,'Second;wall',
+$,$,$,$,$,$);
+ENDSEC;
+END-ISO-10303-21;
+"""  # the second statement spans two lines and has a ; in a string
+
+
+@unittest.skipUnless(FreeCAD and ifcopenshell, "FreeCAD or ifcopenshell missing")
+class TestIfcPatch(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = self.tmp.name + "/source.ifc"
+        with open(self.source, "w") as f:
+            f.write(SOURCE)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def writePatch(self, filename):
+        """patches the first wall and adds a third one, with a name
+        that must be encoded"""
+
+        import BimIfcExport
+
+        ifcfile = ifcopenshell.open(self.source)
+        wall = ifcfile.by_id(1)
+        wall.Name = "Moved wall"
+        new = ifcfile.createIfcWall("0" * 22, None, "Café wall")
+        changed = {wall.id(): wall}
+        BimIfcExport.writePatch(self.source, filename, changed, [new])
+
+    def testPatch(self):
+        """only the changed lines differ, and new ones are added"""
+
+        filename = self.tmp.name + "/patch.ifc"
+        self.writePatch(filename)
+        with open(self.source, "rb") as f:
+            before = f.read().splitlines()
+        with open(filename, "rb") as f:
+            after = f.read().splitlines()
+        self.assertEqual(len(after), len(before) + 1)
+        line = b"#1=IFCWALL('1111111111111111111111',$,'Moved wall',$,$,$,$,$,$);"
+        self.assertEqual(after[7], line)
+        self.assertEqual(after[8:10], before[8:10])
+        self.assertIn(b"'Caf\\X2\\00E9\\X0\\ wall'", after[10])
+        for line in after:
+            line.decode("ascii")
+        patched = ifcopenshell.open(filename)
+        names = sorted([w.Name for w in patched.by_type("IfcWall")])
+        self.assertEqual(names, ["Café wall", "Moved wall", "Second;wall"])
+
+    def testCompression(self):
+        """gzip and ifczip outputs contain the same text as a plain one"""
+
+        import gzip
+        import zipfile
+
+        self.writePatch(self.tmp.name + "/plain.ifc")
+        with open(self.tmp.name + "/plain.ifc", "rb") as f:
+            text = f.read()
+        self.writePatch(self.tmp.name + "/patch.ifc.gz")
+        with gzip.open(self.tmp.name + "/patch.ifc.gz", "rb") as f:
+            self.assertEqual(f.read(), text)
+        self.writePatch(self.tmp.name + "/patch.ifczip")
+        with zipfile.ZipFile(self.tmp.name + "/patch.ifczip") as z:
+            self.assertEqual(z.namelist(), ["patch.ifc"])
+            self.assertEqual(z.read("patch.ifc"), text)
+
+    def testStreaming(self):
+        """chunks are renumbered after the main file, and refer to the
+        original of the entities copied in them"""
+
+        import BimIfcExport
+
+        ifcfile = ifcopenshell.open(self.source)
+        origin = ifcfile.createIfcCartesianPoint((0.0, 0.0, 0.0))
+        filename = self.tmp.name + "/stream.ifc"
+        writer = BimIfcExport.StreamWriter(ifcfile, filename)
+        for i in range(2):
+            chunk, point = writer.start(origin)
+            axis = chunk.createIfcAxis2Placement3D(point, None, None)
+            placement = chunk.createIfcLocalPlacement(None, axis)
+            name = "Wall '#" + str(i + 1) + "'"
+            chunk.createIfcWall(str(i) * 22, None, name, None, None, placement)
+            writer.flush()
+        writer.close()
+        streamed = ifcopenshell.open(filename)
+        walls = streamed.by_type("IfcWall")
+        names = sorted([w.Name for w in walls])
+        self.assertEqual(names[:2], ["First wall", "Second;wall"])
+        self.assertEqual(names[2:], ["Wall '#1'", "Wall '#2'"])
+        self.assertEqual(len(streamed.by_type("IfcCartesianPoint")), 1)
+        placements = set()
+        for wall in [w for w in walls if w.ObjectPlacement]:
+            axis = wall.ObjectPlacement.RelativePlacement
+            self.assertEqual(axis.Location.id(), origin.id())
+            placements.add(wall.ObjectPlacement.id())
+        self.assertEqual(len(placements), 2)
+
+    def testStyles(self):
+        """products of the same color share one surface style"""
+
+        import types
+        import BimIfcExport
+        import BimIfcRecycler
+
+        ifcfile = ifcopenshell.open(self.source)
+        ifcbin = BimIfcRecycler.Recycler(ifcfile)
+        colors = {"Wall": (1.0, 0.0, 0.0)}
+        color = BimIfcExport.getColor(types.SimpleNamespace(Name="Wall"), colors)
+        self.assertEqual(color, ((1.0, 0.0, 0.0), 0))
+        for wall in ifcfile.by_type("IfcWall"):
+            item = ifcfile.createIfcCartesianPoint((0.0, 0.0, 0.0))
+            rep = ifcfile.createIfcShapeRepresentation(None, "Body", "Brep", [item])
+            wall.Representation = ifcfile.createIfcProductDefinitionShape(
+                None, None, [rep]
+            )
+            BimIfcExport.writeStyle(ifcbin, wall, color)
+        self.assertEqual(len(ifcfile.by_type("IfcSurfaceStyle")), 1)
+        self.assertEqual(len(ifcfile.by_type("IfcStyledItem")), 2)
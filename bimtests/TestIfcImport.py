@@ -0,0 +1,484 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+"""Unit tests of the BimIfcImport module"""
+
+import os
+import json
+import time
+import tempfile
+import unittest
+
+try:
+    import FreeCAD
+except ImportError:
+    FreeCAD = None
+
+
+def makeFile(classes):
+    """returns an IFC file with one product of each of the given classes,
+    placed 1m apart along the X axis"""
+
+    import ifcopenshell
+
+    ifcfile = ifcopenshell.file(schema="IFC4")
+    for i, ifcclass in enumerate(classes):
+        origin = ifcfile.createIfcCartesianPoint((float(i), 0.0, 0.0))
+        axis = ifcfile.createIfcAxis2Placement3D(origin, None, None)
+        placement = ifcfile.createIfcLocalPlacement(None, axis)
+        guid = ifcopenshell.guid.new()
+        ifcfile.create_entity(
+            ifcclass, GlobalId=guid, Name=str(i), ObjectPlacement=placement
+        )
+    return ifcfile
+
+
+def makePsetFile(properties):
+    """returns an IFC file with one wall and a property set with the given
+    {name: text} properties"""
+
+    import ifcopenshell
+
+    ifcfile = ifcopenshell.file(schema="IFC4")
+    wall = ifcfile.createIfcWall(ifcopenshell.guid.new(), None, "Wall")
+    values = []
+    for name, text in properties.items():
+        value = ifcfile.createIfcLabel(text)
+        values.append(ifcfile.createIfcPropertySingleValue(name, None, value, None))
+    guid = ifcopenshell.guid.new()
+    pset = ifcfile.createIfcPropertySet(guid, None, "Pset_WallCommon", None, values)
+    guid = ifcopenshell.guid.new()
+    ifcfile.createIfcRelDefinesByProperties(guid, None, None, None, [wall], pset)
+    return ifcfile
+
+
+def makeStructureFile():
+    """returns an IFC file with a building, a storey and two walls in it,
+    sharing a property set, a material and a layer"""
+
+    import ifcopenshell
+
+    def guid():
+        return ifcopenshell.guid.new()
+
+    ifcfile = ifcopenshell.file(schema="IFC4")
+    building = ifcfile.createIfcBuilding(guid(), None, "Building")
+    storey = ifcfile.createIfcBuildingStorey(guid(), None, "Storey")
+    ifcfile.createIfcRelAggregates(guid(), None, None, None, building, [storey])
+    walls = [ifcfile.createIfcWall(guid(), None, str(i)) for i in range(2)]
+    ifcfile.createIfcRelContainedInSpatialStructure(
+        guid(), None, None, None, walls, storey
+    )
+    value = ifcfile.createIfcPropertySingleValue(
+        "Status", None, ifcfile.createIfcLabel("New"), None
+    )
+    pset = ifcfile.createIfcPropertySet(guid(), None, "Pset_Status", None, [value])
+    ifcfile.createIfcRelDefinesByProperties(guid(), None, None, None, walls, pset)
+    material = ifcfile.createIfcMaterial("Concrete")
+    ifcfile.createIfcRelAssociatesMaterial(guid(), None, None, None, walls, material)
+    item = ifcfile.createIfcCartesianPoint((0.0, 0.0, 0.0))
+    ifcfile.createIfcPresentationLayerAssignment("Layer", None, [item], None)
+    return ifcfile
+
+
+def makeMappedFile(count):
+    """returns an IFC file with count walls using the same mapped
+    representation, then one using it with a material, and one with its
+    own geometry"""
+
+    import ifcopenshell
+
+    def guid():
+        return ifcopenshell.guid.new()
+
+    ifcfile = ifcopenshell.file(schema="IFC4")
+    origin = ifcfile.createIfcCartesianPoint((0.0, 0.0, 0.0))
+    axis = ifcfile.createIfcAxis2Placement3D(origin, None, None)
+    context = ifcfile.createIfcGeometricRepresentationContext(
+        None, "Model", 3, 1.0e-05, axis, None
+    )
+    profile = ifcfile.createIfcRectangleProfileDef("AREA", None, None, 1.0, 0.2)
+    direction = ifcfile.createIfcDirection((0.0, 0.0, 1.0))
+    solid = ifcfile.createIfcExtrudedAreaSolid(profile, axis, direction, 3.0)
+    body = ifcfile.createIfcShapeRepresentation(context, "Body", "SweptSolid", [solid])
+    repmap = ifcfile.createIfcRepresentationMap(axis, body)
+    target = ifcfile.createIfcCartesianTransformationOperator3D(
+        None, None, origin, 1.0, None
+    )
+    for i in range(count + 2):
+        if i == count + 1:
+            items = [solid]
+        else:
+            items = [ifcfile.createIfcMappedItem(repmap, target)]
+        rep = ifcfile.createIfcShapeRepresentation(context, "Body", "Mapped", items)
+        shape = ifcfile.createIfcProductDefinitionShape(None, None, [rep])
+        point = ifcfile.createIfcCartesianPoint((float(i), 0.0, 0.0))
+        placement = ifcfile.createIfcLocalPlacement(
+            None, ifcfile.createIfcAxis2Placement3D(point, None, None)
+        )
+        wall = ifcfile.createIfcWall(guid(), None, str(i), None, None, placement)
+        wall.Representation = shape
+        if i == count:
+            material = ifcfile.createIfcMaterial("Steel")
+            ifcfile.createIfcRelAssociatesMaterial(
+                guid(), None, None, None, [wall], material
+            )
+    return ifcfile
+
+
+class FakeObject:
+    """a document object stand-in, with dynamic properties"""
+
+    def __init__(self):
+        self.groups = {}  # property name : group
+        self.IfcProperties = {}
+
+    @property
+    def PropertiesList(self):
+        return ["IfcProperties"] + list(self.groups)
+
+    def addProperty(self, proptype, name, group):
+        self.groups[name] = group
+        setattr(self, name, None)
+
+    def getGroupOfProperty(self, name):
+        return self.groups.get(name, "Base")
+
+    def removeProperty(self, name):
+        del self.groups[name]
+        delattr(self, name)
+
+    def setEditorMode(self, name, mode):
+        pass
+
+
+class FakeDocument:
+    """a document stand-in, that records its transactions"""
+
+    def __init__(self):
+        self.UndoMode = 1
+        self.RecomputesFrozen = False
+        self.transactions = []
+        self.Meta = {}
+
+    def openTransaction(self, name):
+        self.transactions.append("open")
+
+    def commitTransaction(self):
+        self.transactions.append("commit")
+
+
+class FakeProduct:
+    """an IFC product stand-in, with only an id and a class"""
+
+    def __init__(self, ifcid):
+        self.ifcid = ifcid
+
+    def id(self):
+        return self.ifcid
+
+    def is_a(self, ifcclass=None):
+        if ifcclass:
+            return ifcclass == "IfcWall"
+        return "IfcWall"
+
+
+class FakeCache:
+    """a shapes cache that contains every product"""
+
+    def contains(self, ifcproduct):
+        return True
+
+    def getShape(self, ifcproduct):
+        return "shape" + str(ifcproduct.id())
+
+
+class BrokenCache(FakeCache):
+    """a shapes cache that fails when read"""
+
+    def getShape(self, ifcproduct):
+        raise RuntimeError("broken cache")
+
+
+class PartialCache(FakeCache):
+    """a shapes cache where the shapes of odd products are unreadable"""
+
+    def getShape(self, ifcproduct):
+        if ifcproduct.id() % 2:
+            return None
+        return FakeCache.getShape(self, ifcproduct)
+
+
+@unittest.skipUnless(FreeCAD, "FreeCAD is not available")
+class TestIfcImport(unittest.TestCase):
+    def testReaderError(self):
+        """errors of the shapes reader stop the import"""
+
+        import BimIfcImport
+
+        products = [FakeProduct(i) for i in range(5)]
+        with self.assertRaises(RuntimeError):
+            for batch in BimIfcImport.importProducts(
+                None, None, 0, products, BrokenCache(), lambda b: b
+            ):
+                pass
+
+    def testBatches(self):
+        """all the shapes of the reader are given to the writer"""
+
+        import BimIfcImport
+
+        products = [FakeProduct(i) for i in range(250)]
+        result = []
+        for batch in BimIfcImport.importProducts(
+            None, None, 0, products, FakeCache(), lambda b: b
+        ):
+            self.assertTrue(len(batch) <= BimIfcImport.BATCHSIZE)
+            result.extend(batch)
+        self.assertEqual([p.id() for p, s in result], list(range(250)))
+
+    def testUnreadableCache(self):
+        """products whose cached shape can't be read are computed again"""
+
+        import BimIfcImport
+
+        excluded = []
+
+        def getIterator(ifcfile, settings, cores, products=None, exclude=[]):
+            excluded.extend(exclude)
+            return None
+
+        products = [FakeProduct(i) for i in range(10)]
+        default = BimIfcImport.getIterator
+        BimIfcImport.getIterator = getIterator
+        try:
+            shapes = list(
+                BimIfcImport.readShapes(None, None, 0, products, PartialCache())
+            )
+        finally:
+            BimIfcImport.getIterator = default
+        self.assertEqual([p.id() for p in excluded], [0, 2, 4, 6, 8])
+        self.assertEqual([p.id() for p, s in shapes], [0, 2, 4, 6, 8])
+
+    def testPeakMemory(self):
+        """the peak memory of the import is reported in Mb"""
+
+        import BimIfcImport
+
+        peak = BimIfcImport.getPeakMemory()
+        if peak is not None:
+            self.assertTrue(0 < peak < 1000000)
+
+    def testOpenFile(self):
+        """files opened lazily give the same entities"""
+
+        import BimIfcImport
+
+        ifcfile = makeFile(["IfcWall", "IfcColumn"])
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "model.ifc")
+            ifcfile.write(filename)
+            opened = BimIfcImport.openFile(filename)
+            names = sorted([p.Name for p in opened.by_type("IfcProduct")])
+            self.assertEqual(names, ["0", "1"])
+            column = opened.by_type("IfcColumn")[0]
+            self.assertEqual(opened.by_guid(column.GlobalId), column)
+
+    def testFilters(self):
+        """products can be filtered by class, GlobalId and bounding box"""
+
+        import BimIfcImport
+
+        ifcfile = makeFile(["IfcWall", "IfcColumn", "IfcWall"])
+        products = ifcfile.by_type("IfcProduct")
+        walls = BimIfcImport.filterProducts(ifcfile, products, classes=["IfcWall"])
+        self.assertEqual(sorted([p.Name for p in walls]), ["0", "2"])
+        guids = [p.GlobalId for p in products if p.Name == "1"]
+        columns = BimIfcImport.filterProducts(ifcfile, products, guids=guids)
+        self.assertEqual([p.Name for p in columns], ["1"])
+        bb = FreeCAD.BoundBox(500, -500, -500, 1500, 500, 500)
+        found = BimIfcImport.filterProducts(ifcfile, products, boundbox=bb)
+        self.assertEqual([p.Name for p in found], ["1"])
+
+    def testUnsupportedPlacement(self):
+        """products with an unsupported placement are not filtered out"""
+
+        import BimIfcImport
+        import importIFCHelper
+
+        ifcfile = makeFile(["IfcWall", "IfcWall"])
+        products = ifcfile.by_type("IfcProduct")
+        bb = FreeCAD.BoundBox(500, -500, -500, 1500, 500, 500)
+        getPlacement = importIFCHelper.getPlacement
+        importIFCHelper.getPlacement = lambda placement, scaling: None
+        try:
+            found = BimIfcImport.filterProducts(ifcfile, products, boundbox=bb)
+        finally:
+            importIFCHelper.getPlacement = getPlacement
+        self.assertEqual(len(found), 2)
+
+    def testStoredFilters(self):
+        """the filters of an import are stored for its updates"""
+
+        import BimIfcImport
+
+        doc = FakeDocument()
+        bb = FreeCAD.BoundBox(-500, -500, -500, 1500, 500, 500)
+        BimIfcImport.setFilters(doc, classes=["IfcWall"], boundbox=bb)
+        filters = BimIfcImport.getFilters(doc)
+        self.assertEqual(sorted(filters), ["boundbox", "classes"])
+        ifcfile = makeFile(["IfcWall", "IfcColumn", "IfcWall"])
+        products = ifcfile.by_type("IfcProduct")
+        found = BimIfcImport.filterProducts(ifcfile, products, **filters)
+        self.assertEqual([p.Name for p in found], ["0"])
+        BimIfcImport.setFilters(doc)
+        self.assertEqual(BimIfcImport.getFilters(doc), {})
+        self.assertEqual(doc.Meta, {})
+
+    def setProperties(self, obj, ifcfile):
+        """sets the properties of the wall of an IFC file on an object"""
+
+        import BimIfcImport
+
+        BimIfcImport.buildIndex(ifcfile)
+        BimIfcImport.psets = {}
+        BimIfcImport.setProperties(obj, ifcfile.by_type("IfcWall")[0])
+
+    def testPropertyNames(self):
+        """IFC properties with the same clean name don't overwrite each other"""
+
+        obj = FakeObject()
+        ifcfile = makePsetFile({"Fire Rating": "A", "FireRating": "B"})
+        self.setProperties(obj, ifcfile)
+        self.assertEqual(obj.FireRating, "A")
+        self.assertEqual(obj.FireRating_, "B")
+        self.setProperties(obj, ifcfile)  # updating reuses the same names
+        self.assertFalse(hasattr(obj, "FireRating__"))
+
+    def testRemovedProperties(self):
+        """properties removed from the IFC file are removed on update"""
+
+        obj = FakeObject()
+        self.setProperties(obj, makePsetFile({"Reference": "A", "Status": "B"}))
+        self.setProperties(obj, makePsetFile({"Reference": "C"}))
+        self.assertEqual(obj.Reference, "C")
+        self.assertFalse(hasattr(obj, "Status"))
+
+    def testUpdateClone(self):
+        """clones given a new shape on update stop being clones"""
+
+        import BimIfcImport
+
+        obj = FakeObject()
+        obj.CloneOf = FakeObject()
+        BimIfcImport.objects = {1: obj}
+        BimIfcImport.updateShapes([(FakeProduct(1), "shape")])
+        self.assertEqual(obj.Shape, "shape")
+        self.assertIsNone(obj.CloneOf)
+
+    def testUndo(self):
+        """the undo is only disabled in new documents"""
+
+        import BimIfcImport
+
+        doc = FakeDocument()
+        state = BimIfcImport.suspendDocument(doc, new=True)
+        self.assertEqual(doc.UndoMode, 0)
+        self.assertTrue(doc.RecomputesFrozen)
+        BimIfcImport.resumeDocument(doc, state)
+        self.assertEqual(doc.UndoMode, 1)
+        self.assertFalse(doc.RecomputesFrozen)
+        self.assertEqual(doc.transactions, [])
+        state = BimIfcImport.suspendDocument(doc)
+        self.assertEqual(doc.UndoMode, 1)
+        BimIfcImport.resumeDocument(doc, state)
+        self.assertEqual(doc.transactions, ["open", "commit"])
+
+    def testIndex(self):
+        """relationships are indexed once, and property sets parsed once"""
+
+        import BimIfcImport
+
+        ifcfile = makeStructureFile()
+        BimIfcImport.buildIndex(ifcfile)
+        building = ifcfile.by_type("IfcBuilding")[0]
+        storey = ifcfile.by_type("IfcBuildingStorey")[0]
+        walls = ifcfile.by_type("IfcWall")
+        self.assertEqual(BimIfcImport.getParents(storey), [building])
+        pset = ifcfile.by_type("IfcPropertySet")[0]
+        material = ifcfile.by_type("IfcMaterial")[0]
+        for wall in walls:
+            self.assertEqual(BimIfcImport.getParents(wall), [storey])
+            self.assertEqual(BimIfcImport.getRelated("psets", wall), [pset])
+            self.assertEqual(BimIfcImport.getRelated("materials", wall), [material])
+        item = ifcfile.by_type("IfcCartesianPoint")[0]
+        layers = BimIfcImport.getRelated("layers", item)
+        self.assertEqual([layer.Name for layer in layers], ["Layer"])
+        self.assertEqual(BimIfcImport.getRelated("psets", building), [])
+        props = BimIfcImport.getPset(pset)
+        self.assertEqual(props[0][:2], ("Status", "PsetStatus"))
+        self.assertIs(BimIfcImport.getPset(pset), props)
+
+    def testInstances(self):
+        """products sharing a mapped representation are grouped"""
+
+        import BimIfcImport
+
+        ifcfile = makeMappedFile(3)
+        BimIfcImport.buildIndex(ifcfile)
+        walls = dict([(w.Name, w) for w in ifcfile.by_type("IfcWall")])
+        self.assertIsNone(BimIfcImport.getMappingKey(ifcfile, walls["4"]))
+        key = BimIfcImport.getMappingKey(ifcfile, walls["0"])
+        self.assertEqual(BimIfcImport.getMappingKey(ifcfile, walls["2"]), key)
+        self.assertNotEqual(BimIfcImport.getMappingKey(ifcfile, walls["3"]), key)
+        products = [walls[name] for name in sorted(walls)]
+        instances = BimIfcImport.getInstances(ifcfile, products)
+        expected = {
+            walls["1"].id(): (walls["1"], walls["0"]),
+            walls["2"].id(): (walls["2"], walls["0"]),
+        }
+        self.assertEqual(instances, expected)
+
+    def testProfile(self):
+        """timings are written by stage and by class, slowest first"""
+
+        import BimIfcImport
+
+        BimIfcImport.timings = {}
+        BimIfcImport.classtimings = {}
+        now = time.time()
+        BimIfcImport.addTiming("geometry", now - 3)
+        BimIfcImport.addTiming("object creation", now - 1, FakeProduct(1))
+        BimIfcImport.addTiming("object creation", now - 1, FakeProduct(2))
+        doc = FakeDocument()
+        doc.FileName = ""
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "model.ifc")
+            path = BimIfcImport.writeProfile(doc, filename, {"objects": 2})
+            self.assertEqual(path, os.path.join(tmp, "model.profile.json"))
+            with open(path) as f:
+                profile = json.load(f)
+        self.assertEqual(profile["objects"], 2)
+        self.assertEqual(list(profile["stages"]), ["geometry", "object creation"])
+        self.assertAlmostEqual(profile["stages"]["geometry"], 3, places=1)
+        self.assertEqual(profile["classes"]["IfcWall"]["count"], 2)
+        self.assertAlmostEqual(profile["classes"]["IfcWall"]["time"], 2, places=1)
@@ -0,0 +1,118 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+"""Unit tests of the BimIfcRecycler module"""
+
+import unittest
+
+try:
+    import ifcopenshell
+except ImportError:
+    ifcopenshell = None
+
+
+def makeFile(schema="IFC4"):
+    """returns an IFC file with one placed wall, and an unused point"""
+
+    ifcfile = ifcopenshell.file(schema=schema)
+    ifcfile.createIfcCartesianPoint((5.0, 5.0, 5.0))
+    origin = ifcfile.createIfcCartesianPoint((1.0, 2.0, 3.0))
+    axis = ifcfile.createIfcDirection((0.0, 0.0, 1.0))
+    placement = ifcfile.createIfcAxis2Placement3D(origin, axis, None)
+    placement = ifcfile.createIfcLocalPlacement(None, placement)
+    guid = ifcopenshell.guid.new()
+    ifcfile.createIfcWall(guid, None, "Wall", None, None, placement)
+    return ifcfile
+
+
+@unittest.skipUnless(ifcopenshell, "ifcopenshell is not available")
+class TestIfcRecycler(unittest.TestCase):
+    def testPoints(self):
+        """points closer than the tolerance are written once"""
+
+        import BimIfcRecycler
+
+        ifcbin = BimIfcRecycler.Recycler(ifcopenshell.file(schema="IFC4"))
+        first = ifcbin.createPoint((1.0, 2.0, 3.0))
+        second = ifcbin.createPoint((1.0, 2.0, 3.0 + 1e-9))
+        third = ifcbin.createPoint((1.0, 2.0, 3.1))
+        self.assertEqual(first.id(), second.id())
+        self.assertNotEqual(first.id(), third.id())
+        self.assertEqual(len(ifcbin.created), 2)
+        self.assertEqual((ifcbin.hits, ifcbin.misses), (1, 2))
+
+    def testSeedAll(self):
+        """seeding without entities reuses all the entities of the file"""
+
+        import BimIfcRecycler
+
+        ifcbin = BimIfcRecycler.Recycler(makeFile(), seed=True)
+        ifcbin.createPoint((5.0, 5.0, 5.0))
+        ifcbin.createPoint((1.0, 2.0, 3.0))
+        ifcbin.createDirection((0.0, 0.0, 1.0))
+        self.assertEqual(ifcbin.created, [])
+
+    def testSeedProducts(self):
+        """seeding with products only reuses the entities they use"""
+
+        import BimIfcRecycler
+
+        ifcfile = makeFile()
+        ifcbin = BimIfcRecycler.Recycler(ifcfile)
+        ifcbin.seed(ifcfile.by_type("IfcWall"))
+        point = ifcbin.createPoint((1.0, 2.0, 3.0))
+        axis = ifcbin.createDirection((0.0, 0.0, 1.0))
+        ifcbin.createAxis2Placement(point, axis, None)
+        self.assertEqual(ifcbin.created, [])
+        ifcbin.createPoint((5.0, 5.0, 5.0))
+        self.assertEqual(len(ifcbin.created), 1)
+
+    def testModify(self):
+        """a modified entity is reused for its new values only"""
+
+        import BimIfcRecycler
+
+        ifcfile = makeFile()
+        ifcbin = BimIfcRecycler.Recycler(ifcfile, seed=True)
+        wall = ifcfile.by_type("IfcWall")[0]
+        placement = wall.ObjectPlacement
+        old = placement.RelativePlacement
+        new = ifcbin.createAxis2Placement(ifcbin.createPoint((5.0, 5.0, 5.0)))
+        ifcbin.modify(placement, RelativePlacement=new)
+        self.assertEqual(placement.RelativePlacement, new)
+        self.assertEqual(ifcbin.createLocalPlacement(None, new), placement)
+        self.assertNotEqual(ifcbin.createLocalPlacement(None, old), placement)
+
+    def testStyleAssignment(self):
+        """items of the same style share one style assignment in IFC2X3"""
+
+        import BimIfcRecycler
+
+        ifcfile = ifcopenshell.file(schema="IFC2X3")
+        ifcbin = BimIfcRecycler.Recycler(ifcfile)
+        style = ifcbin.createSurfaceStyle((1.0, 0.0, 0.0))
+        self.assertEqual(style.id(), ifcbin.createSurfaceStyle((1.0, 0.0, 0.0)).id())
+        items = [ifcbin.createPoint((float(i), 0.0, 0.0)) for i in range(2)]
+        styled = [ifcbin.createStyledItem(item, style) for item in items]
+        self.assertNotEqual(styled[0].id(), styled[1].id())
+        self.assertEqual(styled[0].Styles[0].id(), styled[1].Styles[0].id())
+        self.assertEqual(len(ifcfile.by_type("IfcPresentationStyleAssignment")), 1)
@@ -0,0 +1,297 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+"""Unit tests of the BimPreflight and BimPreflightRunner modules"""
+
+import os
+import json
+import tempfile
+import unittest
+import concurrent.futures
+
+try:
+    import FreeCAD
+except ImportError:
+    FreeCAD = None
+
+
+class FakeObject:
+    """a document object stand-in, of the given IFC type"""
+
+    def __init__(self, name, ifctype="Wall", shape=None):
+        self.Name = name
+        self.Label = name
+        self.IfcType = ifctype
+        self.IfcAttributes = {}
+        self.PropertiesList = ["IfcType", "IfcAttributes"]
+        self.TypeId = "Part::Feature" if shape else "App::FeaturePython"
+        self.Shape = shape
+
+    def isDerivedFrom(self, typeid):
+        return typeid == self.TypeId
+
+
+class FakeDocument:
+    """a document stand-in, with objects and meta data"""
+
+    def __init__(self, objs):
+        self.Objects = objs
+        self.Meta = {}
+
+
+class FakeEdge:
+    """an edge stand-in, of the given length"""
+
+    def __init__(self, length):
+        self.Length = length
+
+
+class FakeShape:
+    """a shape stand-in, whose BREP string is its name"""
+
+    def __init__(self, name, lengths=()):
+        self.name = name
+        self.Edges = [FakeEdge(length) for length in lengths]
+        self.Solids = []
+        self.BoundBox = (0, 0, 0, 1, 1, 1)
+        self.Length = sum(lengths)
+        self.Area = 0.0
+        self.Volume = 0.0
+
+    def exportBrepToString(self):
+        return self.name
+
+    def isNull(self):
+        return False
+
+    def countElement(self, subtype):
+        return len(self.Edges) if subtype == "Edge" else 0
+
+
+class FakeExecutor:
+    """a process pool stand-in, that records the jobs it is given"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, func, args):
+        future = concurrent.futures.Future()
+        self.jobs.append((args, future))
+        return future
+
+
+@unittest.skipUnless(FreeCAD, "FreeCAD is not available")
+class TestPreflight(unittest.TestCase):
+    def testHierarchy(self):
+        """the hierarchy check fails with the missing types"""
+
+        import BimPreflight
+
+        objs = [FakeObject("Wall"), FakeObject("Site", "Site")]
+        self.assertEqual(
+            BimPreflight.checkHierarchy(objs), ["Building", "Building Storey"]
+        )
+        objs.append(FakeObject("Building", "Building"))
+        objs.append(FakeObject("Level", "Building Storey"))
+        self.assertEqual(BimPreflight.checkHierarchy(objs), None)
+        self.assertEqual(len(BimPreflight.checkHierarchy([])), 3)
+
+    def testFailures(self):
+        """the failures of every object check are reported the same way"""
+
+        import BimPreflightRunner
+
+        failed = [(FakeObject("Wall"), "not solid")]
+        for test in ["testSolid", "testHierarchy"]:
+            failures = BimPreflightRunner.getFailures(test, failed)
+            expected = {"object": "Wall", "label": "Wall", "verdict": "not solid"}
+            self.assertEqual(failures, [expected])
+
+    def testBatches(self):
+        """BREP batches are sent only while few are waiting"""
+
+        import os
+        import BimPreflight
+
+        limit = BimPreflight.MAXPENDING * (os.cpu_count() or 1)
+        count = BimPreflight.CHUNKSIZE * (limit + 1) + 1
+        objs = [FakeObject("Box" + str(i)) for i in range(count)]
+        for obj in objs:
+            obj.Shape = FakeShape(obj.Name)
+        executor = FakeExecutor()
+        futures = []
+        sent = BimPreflight.submitBatches(executor, "testSolid", objs, futures)
+        self.assertEqual(len(executor.jobs), limit)
+        self.assertEqual(sent, BimPreflight.CHUNKSIZE * limit)
+        # once the first batch is done, the next ones are sent
+        executor.jobs[0][1].set_result([])
+        sent = BimPreflight.submitBatches(executor, "testSolid", objs, futures, sent)
+        self.assertEqual(len(executor.jobs), limit + 1)
+        for args, future in executor.jobs[1:]:
+            future.set_result([])
+        sent = BimPreflight.submitBatches(executor, "testSolid", objs, futures, sent)
+        self.assertEqual(sent, count)
+        self.assertEqual(len(futures), limit + 2)
+        breps = []
+        for args, future in executor.jobs:
+            self.assertEqual(args[0], "testSolid")
+            breps.extend(args[1])
+        self.assertEqual(breps, [obj.Name for obj in objs])
+
+    def testSetupChecks(self):
+        """the setup checks are shared by the panel and the runner"""
+
+        import BimPreflight
+        import BimPreflightRunner
+
+        objectchecks, docchecks = BimPreflightRunner.getChecks()
+        for test, check in BimPreflight.setupchecks.items():
+            self.assertIs(docchecks[test], check)
+        try:
+            import ifcopenshell
+        except ImportError:
+            self.assertTrue(BimPreflight.checkIFC4())
+        else:
+            self.assertIsNone(BimPreflight.checkIFC4())
+
+    def testCacheFile(self):
+        """verdicts can be cached in a file instead of the document"""
+
+        import BimPreflight
+
+        doc = FakeDocument([FakeObject("Wall")])
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "model.FCStd.preflight.json")
+            cache = BimPreflight.VerdictCache(doc, filename)
+            verdicts = {"Wall": ["token", None], "Deleted": ["token", None]}
+            cache.tables = {"testSolid": {"version": "1", "verdicts": verdicts}}
+            cache.save()
+            self.assertEqual(doc.Meta, {})
+            with open(filename) as f:
+                tables = json.load(f)
+            self.assertEqual(list(tables["testSolid"]["verdicts"]), ["Wall"])
+            cache = BimPreflight.VerdictCache(doc, filename)
+            self.assertEqual(cache.tables, tables)
+
+    def testJUnit(self):
+        """results are written as one test suite per file"""
+
+        import xml.etree.ElementTree as ET
+        import BimPreflightRunner
+
+        failure = {"object": "Wall", "label": "Wall", "verdict": "not solid"}
+        checks = [
+            {"name": "testSolid", "time": 0.5, "passed": False},
+            {"name": "testMaterials", "time": 0.1, "passed": True},
+        ]
+        checks[0]["failures"] = [failure]
+        checks[1]["failures"] = []
+        results = [
+            {"file": "a.FCStd", "error": None, "time": 1.0, "checks": checks},
+            {"file": "b.ifc", "error": "Traceback", "time": 0.2, "checks": []},
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "junit.xml")
+            BimPreflightRunner.writeJUnit(results, filename)
+            root = ET.parse(filename).getroot()
+        first, second = root.findall("testsuite")
+        self.assertEqual(first.get("name"), "a.FCStd")
+        self.assertEqual(first.get("tests"), "2")
+        self.assertEqual(first.get("failures"), "1")
+        self.assertEqual(first.get("errors"), "0")
+        case = first.find("testcase[@name='testSolid']/failure")
+        self.assertEqual(case.get("message"), "1 failures")
+        self.assertEqual(json.loads(case.text), failure)
+        self.assertIsNone(first.find("testcase[@name='testMaterials']/failure"))
+        self.assertEqual(second.get("errors"), "1")
+        self.assertEqual(second.find("testcase/error").text, "Traceback")
+
+    def testVersion(self):
+        """cached verdicts are discarded when a check or a helper changes"""
+
+        import BimPreflight
+
+        cache = BimPreflight.VerdictCache(FakeDocument([]))
+        check = BimPreflight.checks["testTinyLines"]
+        version = cache.getVersion(check)
+        self.assertEqual(cache.getVersion(check), version)
+        self.assertNotEqual(cache.getVersion(BimPreflight.checkSolid), version)
+        for name, value in [("MINLENGTH", 1.0), ("TINYBINS", [0.1])]:
+            old = getattr(BimPreflight, name)
+            setattr(BimPreflight, name, value)
+            try:
+                self.assertNotEqual(cache.getVersion(check), version)
+            finally:
+                setattr(BimPreflight, name, old)
+        self.assertEqual(cache.getVersion(check), version)
+
+    def testCachedVerdicts(self):
+        """verdicts are reused until the shape or the attributes change"""
+
+        import BimPreflight
+
+        wall = FakeObject("Wall", shape=FakeShape("Wall", [0.5, 1000]))
+        group = FakeObject("Group")
+        cache = BimPreflight.VerdictCache(FakeDocument([wall, group]))
+        for test in ["testTinyLines", "testExtrusions"]:
+            check = BimPreflight.checks[test]
+            verdicts, dirty = cache.split(test, check, [wall, group])
+            self.assertEqual(verdicts, {})
+            failed = BimPreflight.runChecks(dirty, {test: check})[test]
+            cache.update(test, dirty, failed)
+            verdicts, dirty = cache.split(test, check, [wall, group])
+            self.assertEqual(list(verdicts), ["Wall"])
+            # objects without shape are never cached
+            expected = [] if test in BimPreflight.shapechecks else [group]
+            self.assertEqual(dirty, expected)
+        verdict = cache.tables["testTinyLines"]["verdicts"]["Wall"][1]
+        self.assertEqual(verdict, {"count": 1, "histogram": [0, 0, 0, 1, 0]})
+        tinylines = BimPreflight.checks["testTinyLines"]
+        extrusions = BimPreflight.checks["testExtrusions"]
+        wall.IfcAttributes = {"FlagForceBrep": "True"}
+        self.assertEqual(cache.split("testTinyLines", tinylines, [wall])[1], [])
+        dirty = cache.split("testExtrusions", extrusions, [wall])[1]
+        self.assertEqual(dirty, [wall])
+        cache.clearTokens()
+        wall.Shape = FakeShape("Wall", [0.5, 1000, 1000])
+        dirty = cache.split("testTinyLines", tinylines, [wall])[1]
+        self.assertEqual(dirty, [wall])
+        cache.update("testTinyLines", dirty, [])
+        self.assertEqual(cache.split("testTinyLines", tinylines, [wall])[1], [])
+        # same bounding box and number of edges, but a different edge
+        cache.clearTokens()
+        wall.Shape = FakeShape("Wall", [0.5, 1000, 999.9999999])
+        dirty = cache.split("testTinyLines", tinylines, [wall])[1]
+        self.assertEqual(dirty, [wall])
+
+    def testTinyLines(self):
+        """tiny lines are found and binned by length"""
+
+        import BimPreflight
+
+        lengths = [0.005, 0.01, 0.05, 0.3, 0.7, 5, 0.79]
+        expected = ([0, 1, 2, 3, 4, 6], [2, 1, 0, 1, 2])
+        self.assertEqual(BimPreflight.getTinyLines(lengths), expected)
+        self.assertEqual(BimPreflight.getTinyLines([]), ([], [0, 0, 0, 0, 0]))
+        verdict = BimPreflight.checkShapeTinyLines(FakeShape("Box", lengths))
+        self.assertEqual(verdict, {"count": 6, "histogram": expected[1]})
+        self.assertIsNone(BimPreflight.checkShapeTinyLines(FakeShape("Box", [5])))
@@ -0,0 +1,76 @@
+# ***************************************************************************
+# *   Copyright (c) 2022 Yorik van Havre <yorik@uncreated.net>              *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+"""Unit tests of the BimProcesses module"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+try:
+    import FreeCAD
+except ImportError:
+    FreeCAD = None
+
+
+def getExecutable():
+    """returns the python interpreter of this process"""
+
+    return sys.executable
+
+
+@unittest.skipUnless(FreeCAD, "FreeCAD is not available")
+class TestProcesses(unittest.TestCase):
+    def testPython(self):
+        """outside the GUI, processes use this python"""
+
+        import BimProcesses
+
+        if not FreeCAD.GuiUp:
+            self.assertEqual(BimProcesses.getPython(), sys.executable)
+
+    def testSingleCore(self):
+        """no process pool is made for one core"""
+
+        import BimProcesses
+
+        self.assertIsNone(BimProcesses.getExecutor(1))
+        self.assertTrue(BimProcesses.getCores() >= 1)
+
+    @unittest.skipIf(sys.platform == "win32", "symbolic links need privileges")
+    def testExecutable(self):
+        """the interpreter of a pool is not used by other processes"""
+
+        import concurrent.futures
+        import multiprocessing.spawn
+        import BimProcesses
+
+        default = multiprocessing.spawn.get_executable()
+        with tempfile.TemporaryDirectory() as tmp:
+            python = os.path.join(tmp, "python")
+            os.symlink(sys.executable, python)
+            context = BimProcesses.SpawnContext(python)
+            pool = concurrent.futures.ProcessPoolExecutor(1, mp_context=context)
+            with pool:
+                self.assertEqual(pool.submit(getExecutable).result(), python)
+        self.assertEqual(multiprocessing.spawn.get_executable(), default)